@@ -1,9 +1,17 @@
 """
 Accumulation functions.
 
+Accumulation functions map a state and an event type to a new state.
+
+The functions defined here are `interned`: they take and return (interned) `State`s. Any
+other (custom) function is passed a mutable copy of the state, and its result is interned
+afterwards (see `accumulate`).
+
 """
 from enum import Enum
 
+from microcosm_eventsource.states import State
+
 
 def as_enum(value, event_type):
     if isinstance(value, Enum):
@@ -11,12 +19,33 @@ def as_enum(value, event_type):
     return event_type.__class__[value]
 
 
+def interned(func):
+    """
+    Mark an accumulation function that takes and returns interned `State`s.
+
+    """
+    func.interned = True
+    return func
+
+
+def accumulate(func, state, event_type):
+    """
+    Apply an accumulation function to a state.
+
+    :returns: a `State`
+
+    """
+    if getattr(func, "interned", False):
+        return State(func(State(state), event_type))
+    return State(func(set(state), event_type))
+
+
 def current():
     """
     Return the current event type.
 
     """
-    return lambda state, event_type: [event_type]
+    return interned(lambda state, event_type: State((event_type,)))
 
 
 def keep():
@@ -24,7 +53,7 @@ def keep():
     Keep the current state.
 
     """
-    return lambda state, event_type: state
+    return interned(lambda state, event_type: State(state))
 
 
 def alias(other_event_type):
@@ -32,7 +61,7 @@ def alias(other_event_type):
     Return another event type.
 
     """
-    return lambda state, event_type: [as_enum(other_event_type, event_type)]
+    return interned(lambda state, event_type: State((as_enum(other_event_type, event_type),)))
 
 
 def addition(*other_event_types):
@@ -45,8 +74,8 @@ def addition(*other_event_types):
             as_enum(other_event_type, event_type)
             for other_event_type in other_event_types
         }
-        return sorted(state | to_add)
-    return _addition
+        return State(state | to_add)
+    return interned(_addition)
 
 
 def difference(*other_event_types):
@@ -55,12 +84,12 @@ def difference(*other_event_types):
 
     """
     def _difference(state, event_type):
-        to_add = {
+        to_remove = {
             as_enum(other_event_type, event_type)
             for other_event_type in other_event_types
         }
-        return sorted(state - to_add)
-    return _difference
+        return State(state - to_remove)
+    return interned(_difference)
 
 
 def compose(*funcs):
@@ -71,9 +100,9 @@ def compose(*funcs):
     def _compose(state, event_type):
         new_state = state
         for func in funcs:
-            new_state = func(set(new_state), event_type)
+            new_state = accumulate(func, new_state, event_type)
         return new_state
-    return _compose
+    return interned(_compose)
 
 
 def union():
@@ -81,4 +110,4 @@ def union():
     Return the aggregated event type.
 
     """
-    return lambda state, event_type: sorted(state | {event_type, })
+    return interned(lambda state, event_type: State(state | {event_type, }))
@@ -0,0 +1,392 @@
+"""
+Persisted state machine artifacts.
+
+Enumerating the reachable states of a large event type enumeration is expensive and is
+otherwise repeated by every process. Instead, a compiled state machine can be saved to a
+binary artifact and memory-mapped (read-only), so that processes that load the same file
+(e.g. forked workers) share its pages.
+
+An artifact holds:
+
+ -  A header with the (SHA-256) hash of the enumeration's definition
+ -  The (bitmask) state of every state code
+ -  The transition matrix: the next state code for each state code and event type code, or -1
+ -  The auto-transition map: the auto-transition event type code for each state code, or -1
+ -  The state codes, ordered by state (bitmask), so that states are looked up by binary search
+
+States are decoded on demand (rather than when an artifact is opened), so processes only touch
+the pages they use. Artifacts whose definition hash does not match the enumeration (or that
+were written in an older format) are rebuilt.
+
+"""
+from array import array
+from collections.abc import Mapping
+from enum import Enum
+from functools import partial
+from hashlib import sha256
+from mmap import ACCESS_READ, mmap
+from os import replace
+from os.path import dirname, join
+from re import compile as compile_regex
+from struct import Struct
+from tempfile import NamedTemporaryFile
+from types import BuiltinFunctionType, MethodType, ModuleType
+
+from microcosm_eventsource.errors import StateMachineTooLargeError
+from microcosm_eventsource.reachability import StateGraph
+
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+MAGIC = b"ESM2"
+
+# detects artifacts written with another byte order
+BYTE_ORDER_MARK = 0xFEFF
+
+# magic, byte order mark, definition hash, state count, event type count
+HEADER = Struct("=4sHxx32sII")
+
+# values whose repr is reproducible across processes
+PRIMITIVES = (type(None), bool, int, float, complex, str, bytes)
+
+# the default repr of an object includes its (per-process) address
+ADDRESS = compile_regex(r" at 0x[0-9a-fA-F]+")
+
+
+def describe(value):
+    """
+    Describe a (part of an) event type definition as a string.
+
+    Functions (e.g. accumulation closures) are described by their name, code, and captured values;
+    partials by their function and arguments; other objects by their attributes (or slots).
+
+    :raises: ValueError if the value cannot be described reproducibly (e.g. by its address)
+
+    """
+    if isinstance(value, Enum):
+        return "{}.{}".format(value.__class__.__name__, value.name)
+    if isinstance(value, PRIMITIVES):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return "({})".format(", ".join(describe(item) for item in value))
+    if isinstance(value, (set, frozenset)):
+        return "{{{}}}".format(", ".join(sorted(describe(item) for item in value)))
+    if isinstance(value, dict):
+        return "{{{}}}".format(", ".join(sorted(
+            "{}: {}".format(describe(key), describe(item))
+            for key, item in value.items()
+        )))
+    if isinstance(value, partial):
+        return "partial({}, {}, {})".format(describe(value.func), describe(value.args), describe(value.keywords))
+    if callable(value) or hasattr(value, "co_code"):
+        return describe_callable(value)
+    return describe_object(value)
+
+
+def describe_callable(value):
+    if hasattr(value, "co_code"):
+        return "{}:{}:{}".format(value.co_name, value.co_code.hex(), describe(value.co_consts))
+    if isinstance(value, MethodType):
+        return "{}.{}".format(describe(value.__self__), describe(value.__func__))
+    if hasattr(value, "__code__"):
+        return "{}.{}:{}:{}".format(
+            value.__module__,
+            value.__qualname__,
+            describe(value.__code__),
+            describe([cell.cell_contents for cell in value.__closure__ or ()]),
+        )
+    if isinstance(value, BuiltinFunctionType):
+        if value.__self__ is None or isinstance(value.__self__, ModuleType):
+            return "{}.{}".format(value.__module__, value.__qualname__)
+        return "{}.{}".format(describe(value.__self__), value.__name__)
+    if isinstance(value, type):
+        return "{}.{}".format(value.__module__, value.__qualname__)
+    # callable objects (e.g. transitions)
+    return describe_object(value)
+
+
+def describe_object(value):
+    members = dict(vars(value)) if hasattr(value, "__dict__") else {}
+    for cls in type(value).__mro__:
+        slots = getattr(cls, "__slots__", ())
+        for slot in (slots,) if isinstance(slots, str) else slots:
+            if slot not in ("__dict__", "__weakref__") and hasattr(value, slot):
+                members[slot] = getattr(value, slot)
+    if hasattr(value, "__dict__") or members:
+        return "{}({})".format(
+            value.__class__.__qualname__,
+            ", ".join(
+                "{}={}".format(key, describe(item))
+                for key, item in sorted(members.items())
+            ),
+        )
+
+    description = repr(value)
+    if ADDRESS.search(description):
+        raise ValueError("Cannot describe {} reproducibly".format(description))
+    return description
+
+
+def definition_hash(event_type_cls):
+    """
+    Hash the definition of an event type enumeration.
+
+    :raises: ValueError if the definition cannot be described reproducibly
+
+    """
+    digest = sha256()
+    for event_type in event_type_cls:
+        digest.update(describe((
+            event_type.name,
+            event_type.value.follows,
+            event_type.value.accumulate,
+            event_type.value.restarting,
+            event_type.value.auto_transition,
+        )).encode("utf-8"))
+    return digest.digest()
+
+
+def artifact_path(event_type_cls, directory):
+    return join(directory, "{}.{}.esm".format(event_type_cls.__module__, event_type_cls.__qualname__))
+
+
+def mask_width(event_type_count):
+    """
+    The number of bytes used per state mask, keeping the following arrays aligned.
+
+    """
+    return (event_type_count + 31) // 32 * 4
+
+
+def dump(state_machine):
+    """
+    Serialize a (fully enumerated) compiled state machine.
+
+    :raises: StateMachineTooLargeError
+
+    """
+    event_type_count = len(state_machine.event_types)
+    width = mask_width(event_type_count)
+    state_codes = state_machine.state_codes
+
+    masks = []
+    matrix = array("i", [-1]) * (len(state_codes) * event_type_count)
+    auto_transitions = array("i", [-1]) * len(state_codes)
+    for code, (mask, transitions) in enumerate(state_machine.table.items()):
+        masks.append(mask)
+        for event_type, next_state in transitions.items():
+            next_code = state_codes.get(next_state)
+            if next_code is None:
+                raise StateMachineTooLargeError("State machine is too large to save")
+            event_code = state_machine.codes[event_type]
+            matrix[code * event_type_count + event_code] = next_code
+            if event_type.is_auto_transition and auto_transitions[code] < 0:
+                auto_transitions[code] = event_code
+
+    header = HEADER.pack(
+        MAGIC,
+        BYTE_ORDER_MARK,
+        definition_hash(state_machine.event_type_cls),
+        len(state_codes),
+        event_type_count,
+    )
+    order = array("i", sorted(range(len(masks)), key=masks.__getitem__))
+    return b"".join((
+        header,
+        b"".join(mask.to_bytes(width, "little") for mask in masks),
+        matrix.tobytes(),
+        auto_transitions.tobytes(),
+        order.tobytes(),
+    ))
+
+
+def save(state_machine, path):
+    """
+    Save a compiled state machine, atomically replacing any existing artifact.
+
+    Processes that mapped a replaced artifact keep using it.
+
+    """
+    data = dump(state_machine)
+    with NamedTemporaryFile(dir=dirname(path), prefix=".esm", delete=False) as outfile:
+        outfile.write(data)
+    replace(outfile.name, path)
+
+
+def open_artifact(event_type_cls, path):
+    """
+    Memory-map an artifact.
+
+    :returns: a `StateMachineArtifact` or None if the artifact is missing or stale
+
+    """
+    try:
+        with open(path, "rb") as infile:
+            buffer = mmap(infile.fileno(), 0, access=ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    artifact = StateMachineArtifact(buffer)
+    if not artifact.matches(event_type_cls):
+        return None
+    return artifact
+
+
+def load_artifact(state_machine, directory):
+    """
+    Load the artifact of a compiled state machine from a directory, (re)building it as needed.
+
+    :returns: the artifact, or None if the (re)built artifact cannot be opened (e.g. it was
+              replaced concurrently with another definition)
+    :raises: StateMachineTooLargeError
+    :raises: ValueError if the definition cannot be hashed (see `describe`)
+
+    """
+    path = artifact_path(state_machine.event_type_cls, directory)
+    artifact = open_artifact(state_machine.event_type_cls, path)
+    if artifact is None:
+        save(state_machine, path)
+        artifact = open_artifact(state_machine.event_type_cls, path)
+    return artifact
+
+
+class StateMachineArtifact:
+    """
+    A read-only view of a saved state machine.
+
+    """
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.valid = len(buffer) >= HEADER.size
+        if not self.valid:
+            return
+
+        magic, byte_order_mark, self.digest, self.state_count, self.event_type_count = HEADER.unpack_from(buffer)
+        self.width = mask_width(self.event_type_count)
+        matrix_offset = HEADER.size + self.state_count * self.width
+        auto_transitions_offset = matrix_offset + self.state_count * self.event_type_count * 4
+        order_offset = auto_transitions_offset + self.state_count * 4
+        self.valid = all((
+            magic == MAGIC,
+            byte_order_mark == BYTE_ORDER_MARK,
+            len(buffer) == order_offset + self.state_count * 4,
+        ))
+        if not self.valid:
+            return
+
+        view = memoryview(buffer)
+        self.masks = view[HEADER.size:matrix_offset]
+        self.matrix = view[matrix_offset:auto_transitions_offset].cast("i")
+        self.auto_transitions = view[auto_transitions_offset:order_offset].cast("i")
+        self.order = view[order_offset:].cast("i")
+
+    def __len__(self):
+        return self.state_count
+
+    def matches(self, event_type_cls):
+        return self.valid and all((
+            self.event_type_count == len(event_type_cls),
+            self.digest == definition_hash(event_type_cls),
+        ))
+
+    def mask(self, code):
+        """
+        Decode the (bitmask) state of a state code.
+
+        """
+        offset = code * self.width
+        return int.from_bytes(self.masks[offset:offset + self.width], "little")
+
+    def iter_masks(self):
+        for code in range(self.state_count):
+            yield self.mask(code)
+
+    def code(self, mask):
+        """
+        Look up the code of a (bitmask) state by binary search.
+
+        :returns: the state code or None if the state is not reachable
+
+        """
+        low, high = 0, self.state_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.mask(self.order[middle]) < mask:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.state_count and self.mask(self.order[low]) == mask:
+            return self.order[low]
+        return None
+
+    def row(self, code):
+        return self.matrix[code * self.event_type_count:(code + 1) * self.event_type_count]
+
+    def transition_matrix(self):
+        """
+        The transition matrix as a (read-only) NumPy array, if NumPy is available.
+
+        """
+        if numpy is None:
+            return None
+        return numpy.frombuffer(self.matrix, dtype=numpy.int32).reshape(
+            self.state_count,
+            self.event_type_count,
+        )
+
+    def graph(self, state_machine):
+        """
+        The fully explored graph of reachable states.
+
+        """
+        graph = StateGraph(state_machine)
+        graph.masks = list(self.iter_masks())
+        graph.codes = {
+            mask: code
+            for code, mask in enumerate(graph.masks)
+        }
+        graph.predecessors = [[] for _ in graph.masks]
+        for code in range(self.state_count):
+            successors = tuple(
+                (event_code, next_code)
+                for event_code, next_code in enumerate(self.row(code))
+                if next_code >= 0
+            )
+            for event_code, next_code in successors:
+                graph.predecessors[next_code].append((code, event_code))
+            graph.successors.append(successors)
+        return graph
+
+
+class ArtifactTable(Mapping):
+    """
+    A transition table that decodes the rows of an artifact on demand.
+
+    """
+    def __init__(self, artifact, state_machine):
+        self.artifact = artifact
+        self.state_machine = state_machine
+        self.rows = {}
+
+    def __getitem__(self, mask):
+        transitions = self.rows.get(mask)
+        if transitions is None:
+            code = self.artifact.code(mask)
+            if code is None:
+                raise KeyError(mask)
+            transitions = self.rows[mask] = {
+                self.state_machine.event_types[event_code]: self.state_machine.decode(self.artifact.mask(next_code))
+                for event_code, next_code in enumerate(self.artifact.row(code))
+                if next_code >= 0
+            }
+        return transitions
+
+    def __iter__(self):
+        return self.artifact.iter_masks()
+
+    def __len__(self):
+        return len(self.artifact)
@@ -0,0 +1,244 @@
+"""
+In-process write coalescing.
+
+Concurrent creates for the same container race for the container (e.g. its lock or the
+unique parent constraint) and all but one fail. Within a process, such creates can instead be
+routed to one lane per container: the first caller to arrive applies the lane's creates back
+to back, in order, in one transaction and resolves every caller's future. Conflicts then only
+happen across processes.
+
+Similarly, high-rate producers can group the commits of many (small) creates: a group commit
+buffer collects creates for a few milliseconds (or until enough creates arrive), applies them
+in one transaction and releases their callers together, so that throughput scales with the
+size of the group rather than with commit latency.
+
+Creates are applied in the session of the thread that applies them (`SessionContext.session`).
+A session opened with `SessionContext.open` is a single session that every thread shares, so
+lanes (and groups) are applied one at a time. A thread-local session (a `scoped_session`)
+lets the lanes of different containers be applied in parallel; created events are then
+detached from the applying thread's session before they are handed to their callers.
+
+"""
+from concurrent.futures import Future
+from contextlib import nullcontext
+from threading import Condition, Lock
+from time import monotonic
+
+from microcosm_postgres.context import SessionContext, transaction
+from sqlalchemy import inspect
+from sqlalchemy.orm import scoped_session
+
+
+def is_session_shared():
+    """
+    Is the session shared by every thread (rather than thread-local)?
+
+    """
+    return not isinstance(SessionContext.session, scoped_session)
+
+
+def detach(event):
+    """
+    Detach an event from a thread-local session, so that it can be handed to other threads.
+
+    Lightweight records (see `EventStore.new_record`) are never tracked by a session. Like the
+    sessions of `SessionContext`, thread-local sessions must not expire instances on commit.
+
+    """
+    state = inspect(event, raiseerr=False)
+    if state is not None and state.session is not None and not is_session_shared():
+        SessionContext.session.expunge(event)
+    return event
+
+
+def apply_creates(event_factory, items):
+    """
+    Apply many creates back to back in one transaction and resolve their futures.
+
+    Each create runs in its own savepoint, so that a failing create (e.g. an illegal transition
+    or a conflict) fails only its own future. If the transaction itself fails to commit, every
+    create that succeeded fails with the same error.
+
+    :param items: (future, args, kwargs) tuples of `EventFactory.create` calls
+
+    """
+    results = []
+    try:
+        with transaction():
+            for future, args, kwargs in items:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with SessionContext.session.begin_nested():
+                        results.append((future, event_factory.create(*args, **kwargs)))
+                except Exception as error:
+                    future.set_exception(error)
+    except Exception as error:
+        for future, _ in results:
+            future.set_exception(error)
+        return
+
+    for future, event in results:
+        future.set_result(detach(event))
+
+
+def fail_unresolved(items, error):
+    """
+    Fail the futures of creates that were not resolved (e.g. because applying was interrupted).
+
+    :param items: (future, args, kwargs) tuples of `EventFactory.create` calls
+
+    """
+    for future, _, _ in items:
+        if not future.done():
+            future.set_exception(error)
+
+
+class CreateCoalescer:
+    """
+    Serialize the creates of each container within a process.
+
+    Coalesced creates run in their own transactions; callers must not hold a transaction open.
+
+    """
+    def __init__(self, event_factory):
+        self.event_factory = event_factory
+        self.container_id_name = event_factory.event_store.model_class.container_id_name
+        # guards the lanes
+        self.lock = Lock()
+        # guards the session, if shared
+        self.apply_lock = Lock()
+        self.lanes = {}
+
+    def create(self, ns, sns_producer, event_type, **kwargs):
+        """
+        Create an event (see `EventFactory.create`) in its container's lane.
+
+        """
+        return self.submit(ns, sns_producer, event_type, **kwargs).result()
+
+    def submit(self, ns, sns_producer, event_type, **kwargs):
+        """
+        Submit an event to its container's lane.
+
+        If the lane is idle, the caller applies it (including creates that arrive meanwhile);
+        otherwise, the create is applied by the caller that is already applying the lane.
+
+        :returns: a future of the created event
+
+        """
+        container_id = kwargs[self.container_id_name]
+        future = Future()
+        with self.lock:
+            lane = self.lanes.get(container_id)
+            is_idle = lane is None
+            if is_idle:
+                lane = self.lanes[container_id] = []
+            lane.append((future, (ns, sns_producer, event_type), kwargs))
+
+        if is_idle:
+            self.drain(container_id)
+        return future
+
+    def drain(self, container_id):
+        """
+        Apply a lane until it is empty.
+
+        If applying is interrupted (e.g. by `KeyboardInterrupt`), the lane is removed so that
+        later creates are not queued behind it forever; its unresolved creates fail with the
+        same error.
+
+        """
+        while True:
+            with self.lock:
+                items = self.lanes[container_id]
+                if not items:
+                    del self.lanes[container_id]
+                    return
+                self.lanes[container_id] = []
+
+            try:
+                with self.apply_lock if is_session_shared() else nullcontext():
+                    apply_creates(self.event_factory, items)
+            except BaseException as error:
+                with self.lock:
+                    items += self.lanes.pop(container_id)
+                fail_unresolved(items, error)
+                raise
+
+
+class GroupCommitBuffer:
+    """
+    Group the creates of many callers into one transaction.
+
+    Grouped creates run in their own transactions; callers must not hold a transaction open.
+
+    """
+    def __init__(self, event_factory, max_items=100, max_delay=0.005):
+        """
+        :param max_items: apply a group as soon as it has this many creates
+        :param max_delay: otherwise, apply a group this many seconds after its first create arrived
+
+        """
+        self.event_factory = event_factory
+        self.max_items = max_items
+        self.max_delay = max_delay
+        # guards the buffered items
+        self.condition = Condition()
+        # guards the session, if shared
+        self.apply_lock = Lock()
+        self.items = []
+
+    def create(self, ns, sns_producer, event_type, **kwargs):
+        """
+        Create an event (see `EventFactory.create`) as part of a group.
+
+        """
+        return self.submit(ns, sns_producer, event_type, **kwargs).result()
+
+    def submit(self, ns, sns_producer, event_type, **kwargs):
+        """
+        Submit an event to the current group.
+
+        The caller that starts a group applies it once it is full or its delay has passed.
+
+        :returns: a future of the created event
+
+        """
+        future = Future()
+        with self.condition:
+            self.items.append((future, (ns, sns_producer, event_type), kwargs))
+            starts_group = len(self.items) == 1
+            if len(self.items) >= self.max_items:
+                self.condition.notify_all()
+
+        if starts_group:
+            self.flush(deadline=monotonic() + self.max_delay)
+        return future
+
+    def flush(self, deadline=None):
+        """
+        Apply the current group, waiting until the deadline (if any) unless the group is full.
+
+        If waiting or applying is interrupted (e.g. by `KeyboardInterrupt`), the group's
+        unresolved creates fail with the same error, so that their callers do not wait forever.
+
+        """
+        items = []
+        try:
+            with self.condition:
+                try:
+                    while deadline is not None and len(self.items) < self.max_items:
+                        remaining = deadline - monotonic()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                finally:
+                    items, self.items = self.items, []
+
+            if items:
+                with self.apply_lock if is_session_shared() else nullcontext():
+                    apply_creates(self.event_factory, items)
+        except BaseException as error:
+            fail_unresolved(items, error)
+            raise
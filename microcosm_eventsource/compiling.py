@@ -0,0 +1,425 @@
+"""
+Compiled state machines.
+
+Interpreting the transition mini-language walks an object tree (and looks up enum
+members by name) on every call. Instead, each event type enumeration is compiled once:
+
+ -  Every event type is assigned a bit (by declaration order)
+ -  A state (a set of event types) is encoded as the bitwise or of its event types
+ -  Every `follows` condition becomes a predicate over such an integer mask
+ -  Every event type is indexed by the event types that may enable it (its "support"),
+    so that only plausible candidates are evaluated for a given state
+
+On top of the predicates, a transition table maps each reachable (encoded) state to the
+event types that may follow it and the states they lead to. The table is enumerated lazily
+(on first batch use) or loaded from an artifact, and is bounded; other states (and all states,
+until the table exists) are served from an LRU memo, so single transitions never pay for the
+enumeration. Once a state machine is known to be too large to enumerate, it is not enumerated
+again.
+
+Note that the table assumes that accumulation functions are pure.
+
+For batch operations, the (fully enumerated) table can also be expressed as a dense NumPy
+matrix indexed by state code and event type code; NumPy is an optional dependency.
+
+A fully enumerated state machine can also be saved to (and loaded from) a memory-mapped
+artifact; see `microcosm_eventsource.artifacts`.
+
+"""
+from functools import lru_cache
+
+from microcosm_eventsource.artifacts import ArtifactTable
+from microcosm_eventsource.errors import StateMachineTooLargeError
+from microcosm_eventsource.reachability import ReachabilityIndex, StateGraph, iter_bits
+from microcosm_eventsource.states import State
+from microcosm_eventsource.transitioning import compile_transition, transition_support
+
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# enumerate at most this many reachable states into the transition table
+MAX_TABLE_STATES = 10000
+
+# bound the memo used for states that are not in the transition table
+MAX_MEMO_STATES = 1024
+
+
+class CompiledStateMachine:
+    """
+    Bitmask form of an event type enumeration.
+
+    """
+    def __init__(self, event_type_cls):
+        self.event_type_cls = event_type_cls
+        self.event_types = tuple(event_type_cls)
+        self.codes = {
+            event_type: code
+            for code, event_type in enumerate(self.event_types)
+        }
+        self.bits = {
+            event_type: 1 << code
+            for event_type, code in self.codes.items()
+        }
+        self.auto_transitions = self.encode(event_type_cls.auto_transition_event_types)
+        self.predicates = {
+            event_type: compile_transition(event_type.value.follows, self)
+            for event_type in self.event_types
+        }
+        self.build_index()
+        self._table = None
+        self._memo = lru_cache(maxsize=MAX_MEMO_STATES)(self.compute_transitions)
+        self._states = None
+        self._state_codes = None
+        self._transition_matrix = None
+        self._artifact = None
+        self._graph = None
+        self._reachability = None
+        self._legal_transitions = {}
+        self._too_large = False
+
+    def load(self, artifact):
+        """
+        Use a saved artifact instead of enumerating reachable states.
+
+        """
+        table = ArtifactTable(artifact, self)
+        self._artifact = artifact
+        self._table = table
+        self._states = None
+        self._state_codes = None
+        self._transition_matrix = artifact.transition_matrix()
+        self._memo.cache_clear()
+        self._graph = None
+        self._reachability = None
+        self._legal_transitions = {}
+        self._too_large = False
+
+    @property
+    def is_too_large(self):
+        """
+        Is this state machine known to have more reachable states than can be enumerated?
+
+        """
+        return self._too_large
+
+    @property
+    def table(self):
+        """
+        The transition table, enumerated on first use.
+
+        """
+        if self._table is None:
+            self._table = self.build_table(MAX_TABLE_STATES)
+        return self._table
+
+    def build_index(self):
+        """
+        Index event types by the event types that may enable them.
+
+         -  `triggers[code]` is the mask of event types that may follow the event type `code`
+         -  `untriggered` is the mask of event types that may follow any state
+
+        """
+        self.triggers = [0] * len(self.event_types)
+        self.untriggered = 0
+        for event_type, code in self.codes.items():
+            support = transition_support(event_type.value.follows, self)
+            if support is None:
+                self.untriggered |= 1 << code
+                continue
+            for trigger in iter_bits(support):
+                self.triggers[trigger] |= 1 << code
+
+    def candidates(self, mask):
+        """
+        Generate the event types that may follow the given (encoded) state, in declaration order.
+
+        """
+        candidates = self.untriggered
+        for code in iter_bits(mask):
+            candidates |= self.triggers[code]
+        for code in iter_bits(candidates):
+            yield self.event_types[code]
+
+    def bit(self, name):
+        """
+        The bit of the event type with the given name.
+
+        """
+        return self.bits[self.event_type_cls[name]]
+
+    def encode(self, state):
+        """
+        Encode a state (an iterable of event types) as an integer mask.
+
+        """
+        mask = 0
+        for event_type in state:
+            mask |= self.bits[event_type]
+        return mask
+
+    def decode(self, mask):
+        """
+        Decode an integer mask into a state.
+
+        """
+        return State(
+            event_type
+            for event_type in self.event_types
+            if mask & self.bits[event_type]
+        )
+
+    def may_transition(self, event_type, mask):
+        """
+        Can the given event type follow the given (encoded) state?
+
+        """
+        return self.predicates[event_type](mask)
+
+    def available_transitions(self, mask):
+        """
+        Which event types can follow the given (encoded) state?
+
+        """
+        return [
+            event_type
+            for event_type in self.candidates(mask)
+            if self.predicates[event_type](mask)
+        ]
+
+    def transitions(self, mask):
+        """
+        Which event types can follow the given (encoded) state and which states do they lead to?
+
+        :returns: a dict from event type to the next state, in declaration order
+
+        """
+        transitions = None if self._table is None else self._table.get(mask)
+        if transitions is None:
+            transitions = self._memo(mask)
+        return transitions
+
+    def next_state(self, event_type, mask):
+        """
+        Look up the state that the given event type leads to from the given (encoded) state.
+
+        :returns: the next state or None if the transition is illegal
+
+        """
+        return self.transitions(mask).get(event_type)
+
+    def auto_transition(self, mask):
+        """
+        Which auto-transition event type (if any) follows the given (encoded) state?
+
+        """
+        if self._artifact is not None:
+            code = self._artifact.code(mask)
+            if code is not None:
+                event_code = self._artifact.auto_transitions[code]
+                return self.event_types[event_code] if event_code >= 0 else None
+
+        for event_type in self.transitions(mask):
+            if event_type.is_auto_transition:
+                return event_type
+        return None
+
+    def state_graph(self, max_states=None):
+        """
+        Create a (lazily explored) graph of reachable states.
+
+        If an artifact was loaded (and fits the budget), its fully explored graph is used.
+
+        """
+        if self._artifact is not None and (max_states is None or len(self._artifact) <= max_states):
+            return self._artifact.graph(self)
+        return StateGraph(self, max_states=max_states)
+
+    @property
+    def graph(self):
+        """
+        The fully explored graph of reachable states, explored on first use.
+
+        :raises: StateMachineTooLargeError
+
+        """
+        if self._graph is None:
+            if self._too_large:
+                raise StateMachineTooLargeError("State machine has more than {} reachable states".format(
+                    MAX_TABLE_STATES,
+                ))
+            try:
+                self._graph = self.state_graph(MAX_TABLE_STATES).explore()
+            except StateMachineTooLargeError:
+                self._too_large = True
+                raise
+        return self._graph
+
+    @property
+    def reachability(self):
+        """
+        The transitive closure of the reachable states, indexed on first use.
+
+        :raises: StateMachineTooLargeError
+
+        """
+        if self._reachability is None:
+            self._reachability = ReachabilityIndex(self.graph)
+        return self._reachability
+
+    def legal_transitions(self, event_type):
+        """
+        The (state, next state) pairs of every reachable transition of the given event type.
+
+        :raises: StateMachineTooLargeError
+
+        """
+        legal_transitions = self._legal_transitions.get(event_type)
+        if legal_transitions is None:
+            event_code = self.codes[event_type]
+            legal_transitions = self._legal_transitions[event_type] = [
+                (self.graph.state(code), self.graph.state(next_code))
+                for code, successors in enumerate(self.graph.successors)
+                for successor_code, next_code in successors
+                if successor_code == event_code
+            ]
+        return legal_transitions
+
+    def step(self, mask):
+        """
+        Generate an (event type, next state) tuple for every transition out of the given (encoded) state.
+
+        """
+        state = self.decode(mask)
+        for event_type in self.available_transitions(mask):
+            yield event_type, event_type.accumulate_state(state)
+
+    def compute_transitions(self, mask):
+        """
+        Compute the transitions out of a single (encoded) state.
+
+        """
+        return dict(self.step(mask))
+
+    def build_table(self, max_states):
+        """
+        Enumerate the transitions of (up to `max_states`) reachable states.
+
+        Every entry is exact, so a partially enumerated table is still safe to use.
+
+        """
+        graph = StateGraph(self, max_states=max_states)
+        try:
+            graph.explore()
+        except StateMachineTooLargeError:
+            self._too_large = self._too_large or max_states >= MAX_TABLE_STATES
+
+        return {
+            graph.masks[code]: {
+                self.event_types[event_code]: self.decode(graph.masks[next_code])
+                for event_code, next_code in successors
+            }
+            for code, successors in enumerate(graph.successors)
+        }
+
+    @property
+    def states(self):
+        """
+        The reachable states, indexed by state code.
+
+        The empty (pre-initial) state always has code zero.
+
+        """
+        if self._states is None:
+            self._states = tuple(self.decode(mask) for mask in self.table)
+        return self._states
+
+    @property
+    def state_codes(self):
+        """
+        A mapping from reachable states to state codes.
+
+        """
+        if self._state_codes is None:
+            self._state_codes = {
+                state: code
+                for code, state in enumerate(self.states)
+            }
+        return self._state_codes
+
+    @property
+    def transition_matrix(self):
+        """
+        The dense transition matrix.
+
+        Rows are indexed by state code and columns by event type code; each cell holds the
+        code of the next state or -1 if the transition is illegal.
+
+        :raises: StateMachineTooLargeError if the state machine is too large to enumerate
+
+        """
+        if self._transition_matrix is None:
+            if numpy is None:
+                raise ImportError("Batch transitions require numpy")
+
+            matrix = numpy.full((len(self.table), len(self.event_types)), -1, dtype=numpy.int32)
+            for code, transitions in enumerate(self.table.values()):
+                for event_type, next_state in transitions.items():
+                    try:
+                        matrix[code, self.codes[event_type]] = self.state_codes[next_state]
+                    except KeyError:
+                        raise StateMachineTooLargeError("State machine is too large for a dense transition matrix")
+            self._transition_matrix = matrix
+        return self._transition_matrix
+
+    def validate_transitions(self, state_codes, event_type_codes):
+        """
+        Look up many transitions at once.
+
+        """
+        if numpy is None:
+            raise ImportError("Batch transitions require numpy")
+
+        state_codes = numpy.asarray(state_codes)
+        event_type_codes = numpy.asarray(event_type_codes)
+        next_state_codes = self.transition_matrix[state_codes, event_type_codes]
+        return TransitionBatch(
+            state_machine=self,
+            state_codes=state_codes,
+            event_type_codes=event_type_codes,
+            next_state_codes=next_state_codes,
+        )
+
+
+class TransitionBatch:
+    """
+    The result of validating many transitions at once.
+
+    """
+    def __init__(self, state_machine, state_codes, event_type_codes, next_state_codes):
+        self.state_machine = state_machine
+        self.state_codes = state_codes
+        self.event_type_codes = event_type_codes
+        self.next_state_codes = next_state_codes
+
+    @property
+    def legal(self):
+        """
+        A boolean mask of legal transitions.
+
+        """
+        return self.next_state_codes >= 0
+
+    def errors(self):
+        """
+        Generate an (index, error) tuple for every illegal transition.
+
+        """
+        for index in numpy.flatnonzero(~self.legal):
+            state = self.state_machine.states[self.state_codes[index]]
+            event_type = self.state_machine.event_types[self.event_type_codes[index]]
+            yield int(index), event_type.transition_error(state)
@@ -10,6 +10,14 @@ class ContainerLockNotAvailableRetry(Exception):
         return 423
 
 
+class ContainerLockTimeoutRetry(ContainerLockNotAvailableRetry):
+    pass
+
+
+class ContainerLockSkippedRetry(ContainerLockNotAvailableRetry):
+    pass
+
+
 class ConcurrentStateConflictError(Exception):
     @property
     def status_code(self):
@@ -24,3 +32,7 @@ class IllegalStateTransitionError(Exception):
 
 class IllegalInitialStateError(IllegalStateTransitionError):
     pass
+
+
+class StateMachineTooLargeError(Exception):
+    pass
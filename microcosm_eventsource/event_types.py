@@ -17,12 +17,16 @@ this accumulated `state` and the current event:
  -  An event can legally follow a negation of a conditon: `but_not(...)`
 
 """
-from enum import Enum
+from enum import Enum, EnumMeta
 from itertools import chain
+from types import MappingProxyType
 
-from microcosm_eventsource.accumulation import current
+from microcosm_eventsource.accumulation import accumulate, current
+from microcosm_eventsource.artifacts import load_artifact
+from microcosm_eventsource.compiling import CompiledStateMachine
 from microcosm_eventsource.errors import IllegalInitialStateError, IllegalStateTransitionError
-from microcosm_eventsource.transitioning import nothing
+from microcosm_eventsource.states import State
+from microcosm_eventsource.transitioning import nothing, sql_transition
 
 
 class EventTypeInfo:
@@ -46,7 +50,44 @@ class EventTypeInfo:
         self.auto_transition = auto_transition
 
 
-class EventType(Enum):
+class EventTypeMeta(EnumMeta):
+    """
+    Event type enum metaclass.
+
+    Computes class-level meta data once, when an enum (including an `EventTypeUnion`) is
+    created, instead of scanning every member whenever it is needed:
+
+     -  `initial_event_types` is the frozenset of event types that may be initial
+     -  `auto_transition_event_types` is the tuple of auto-transition event types
+     -  `required_columns` maps each required column name to the tuple of event types requiring it
+
+    """
+    def __new__(metacls, cls, bases, classdict, **kwargs):
+        enum_class = super().__new__(metacls, cls, bases, classdict, **kwargs)
+        event_types = list(enum_class)
+        required_columns = {}
+        for event_type in event_types:
+            for column_name in event_type.value.requires:
+                required_columns.setdefault(column_name, []).append(event_type)
+
+        enum_class.initial_event_types = frozenset(
+            event_type
+            for event_type in event_types
+            if not bool(event_type.value.follows)
+        )
+        enum_class.auto_transition_event_types = tuple(
+            event_type
+            for event_type in event_types
+            if event_type.value.auto_transition
+        )
+        enum_class.required_columns = MappingProxyType({
+            column_name: tuple(requiring_event_types)
+            for column_name, requiring_event_types in required_columns.items()
+        })
+        return enum_class
+
+
+class EventType(Enum, metaclass=EventTypeMeta):
     """
     Based event type enum.
 
@@ -57,7 +98,7 @@ class EventType(Enum):
         Can this event type be used for an initial event?
 
         """
-        return not bool(self.value.follows)
+        return self in self.__class__.initial_event_types
 
     @property
     def is_accumulating(self):
@@ -89,23 +130,84 @@ class EventType(Enum):
         Which events are auto-transition events?
 
         """
-        return [event_type for event_type in cls if event_type.is_auto_transition]
+        return list(cls.auto_transition_event_types)
 
     @classmethod
     def required_column_names(cls):
-        return {
-            column_name
-            for event_type in cls
-            for column_name in event_type.value.requires
-        }
+        return set(cls.required_columns)
 
     @classmethod
     def requires(cls, column_name):
-        return [
-            event_type
-            for event_type in cls
-            if column_name in event_type.value.requires
-        ]
+        return list(cls.required_columns.get(column_name, ()))
+
+    @classmethod
+    def state_machine(cls):
+        """
+        Return the compiled form of this enum's transitions.
+
+        Compilation happens lazily (once per enum) so that `follows` conditions may refer
+        to any member by name.
+
+        """
+        state_machine = cls.__dict__.get("_compiled_state_machine")
+        if state_machine is None:
+            state_machine = CompiledStateMachine(cls)
+            cls._compiled_state_machine = state_machine
+        return state_machine
+
+    @classmethod
+    def load_state_machine(cls, directory):
+        """
+        Load this enum's compiled state machine from an artifact in the given directory.
+
+        The artifact is (re)built if it is missing or if this enum's definition has changed.
+        Loading before workers are forked (or at import) lets all processes share the
+        memory-mapped artifact. If the artifact cannot be opened, states are compiled (and
+        enumerated) on demand as usual.
+
+        :raises: StateMachineTooLargeError
+        :raises: ValueError if this enum's definition cannot be hashed (see `describe`)
+
+        """
+        state_machine = cls.state_machine()
+        artifact = load_artifact(state_machine, directory)
+        if artifact is not None:
+            state_machine.load(artifact)
+        return state_machine
+
+    @property
+    def bit(self):
+        """
+        The bit that represents this event type in an encoded state.
+
+        """
+        return self.state_machine().bits[self]
+
+    @property
+    def code(self):
+        """
+        The index of this event type in batch operations.
+
+        """
+        return self.state_machine().codes[self]
+
+    @classmethod
+    def encode_state(cls, state):
+        """
+        Encode a state as an integer mask.
+
+        :param state: a set of event types
+
+        """
+        return cls.state_machine().encode(state)
+
+    @classmethod
+    def decode_state(cls, mask):
+        """
+        Decode an integer mask into a state.
+
+        """
+        return cls.state_machine().decode(mask)
 
     def may_transition(self, state):
         """
@@ -114,7 +216,8 @@ class EventType(Enum):
         :param state: a set of event types
 
         """
-        return self.value.follows(self.__class__, state)
+        state_machine = self.state_machine()
+        return state_machine.may_transition(self, state_machine.encode(state))
 
     @classmethod
     def available_transitions(cls, state):
@@ -124,7 +227,39 @@ class EventType(Enum):
         :param state: a set of event types
 
         """
-        return [event_type for event_type in cls if event_type.may_transition(state)]
+        state_machine = cls.state_machine()
+        return list(state_machine.transitions(state_machine.encode(state)))
+
+    @classmethod
+    def auto_transition_event(cls, state):
+        """
+        Which auto-transition event (if any) should follow the given state?
+
+        :param state: a set of event types
+
+        """
+        state_machine = cls.state_machine()
+        return state_machine.auto_transition(state_machine.encode(state))
+
+    def legal_transitions(self):
+        """
+        Return the list of (state, next state) pairs of every reachable transition of this event type.
+
+        :raises: StateMachineTooLargeError
+
+        """
+        return self.state_machine().legal_transitions(self)
+
+    def may_transition_expression(self, column):
+        """
+        A SQL expression that matches the states (of the given array column) this event type may follow.
+
+        :param column: an event `state` column, e.g. `TaskEvent.state`
+        :raises: StateMachineTooLargeError if `follows` is a custom transition of a state machine
+                 with too many reachable states to enumerate
+
+        """
+        return sql_transition(self.value.follows, self.state_machine(), column)
 
     def validate_transition(self, state):
         """
@@ -136,24 +271,91 @@ class EventType(Enum):
         if self.may_transition(state):
             return
 
+        raise self.transition_error(state)
+
+    def transition_error(self, state):
+        """
+        Construct the error for an illegal transition from the given state.
+
+        """
         if not state:
             # event may not be initial
-            raise IllegalInitialStateError("Event type '{}' may not be initial".format(
+            return IllegalInitialStateError("Event type '{}' may not be initial".format(
                 self.name,
             ))
 
         # event may not follow previous
-        raise IllegalStateTransitionError("Event type '{}' may not follow [{}]".format(
+        return IllegalStateTransitionError("Event type '{}' may not follow [{}]".format(
             self.name,
             ", ".join(event_type.name for event_type in state),
         ))
 
+    @classmethod
+    def state_code(cls, state):
+        """
+        The code of a (reachable) state in batch operations.
+
+        :param state: a set of event types
+        :raises: KeyError if the state is not reachable
+
+        """
+        return cls.state_machine().state_codes[State(state)]
+
+    @classmethod
+    def validate_transitions(cls, state_codes, event_type_codes):
+        """
+        Validate many transitions at once using a dense transition matrix.
+
+        Requires numpy.
+
+        :param state_codes: an array of state codes (see `state_code`)
+        :param event_type_codes: an array of event type codes (see `code`)
+        :returns: a `TransitionBatch` exposing the `legal` mask, the `next_state_codes`,
+                  and the `errors()` for illegal rows
+
+        """
+        return cls.state_machine().validate_transitions(state_codes, event_type_codes)
+
+    def next_state(self, state):
+        """
+        Validate a transition from the given state and return the accumulated state.
+
+        Reads the enum's transition table so that a state step is a lookup; enums that
+        override `validate_transition` or `may_transition` are still validated for legal transitions.
+
+        :param state: a set of event types
+        :raises: IllegalStateTransitionError
+
+        """
+        state_machine = self.state_machine()
+        next_state = state_machine.next_state(self, state_machine.encode(state))
+        if next_state is None or self.overrides_validation:
+            self.validate_transition(state)
+        return next_state
+
+    @property
+    def overrides_validation(self):
+        """
+        Does this enum override `validate_transition` or `may_transition`?
+
+        If so, transitions cannot be validated against the transition table alone.
+
+        """
+        cls = type(self)
+        return (
+            cls.validate_transition is not EventType.validate_transition
+            or cls.may_transition is not EventType.may_transition
+        )
+
     def accumulate_state(self, state):
         """
         Accumulate state.
 
+        :param state: a set of event types
+        :returns: a `State`
+
         """
-        return self.value.accumulate(state, self)
+        return accumulate(self.value.accumulate, state, self)
 
     def next_version(self, version):
         """
@@ -173,90 +375,144 @@ class EventType(Enum):
 
         """
         for event_type in cls.available_transitions({}):
-            yield frozenset(event_type.accumulate_state({}))
+            yield event_type.accumulate_state(())
+
+    @classmethod
+    def state_graph(cls, max_states=None):
+        """
+        Return a (lazily explored) graph of all allowed states.
+
+        :param max_states: the maximum number of states to explore, if any
+
+        """
+        return cls.state_machine().state_graph(max_states)
 
     @classmethod
-    def all_states(cls):
+    def all_states(cls, max_states=None):
         """
         Return a generator of all allowed states.
 
+        States are streamed as they are discovered.
+
+        :param max_states: the maximum number of states to explore, if any
+        :raises: StateMachineTooLargeError
+
         """
-        # Prefer to use frozenset and not set to represent states in this context
-        # Hashable frozenset allows us to easily avoid repeating the same state
-        next_states = list(cls.initial_states())
-        known_states = set(next_states)
-
-        while True:
-            if not next_states:
-                return
-            current_states = next_states
-            next_states = []
-            for state in current_states:
-                yield state
-                for event_type in cls.available_transitions(state):
-                    new_state = frozenset(event_type.accumulate_state(state))
-                    if new_state in known_states:
-                        continue
-                    next_states.append(new_state)
-                    known_states.add(new_state)
+        graph = cls.state_graph(max_states)
+        for code in graph.iter_allowed_codes():
+            yield graph.state(code)
 
     @classmethod
-    def all_states_and_events(cls):
+    def all_states_and_events(cls, max_states=None):
         """
         Return a generator of all allowed (state, event_type) combinations
         Note: it can return the same state or event twice (but all uniqu)
 
+        :param max_states: the maximum number of states to explore, if any
+        :raises: StateMachineTooLargeError
+
         """
-        next_states = [frozenset()]
-        known_states = set(next_states)
+        graph = cls.state_graph(max_states)
         known_states_and_events = set()
-
-        while True:
-            if not next_states:
-                return
-            current_states = next_states
-            next_states = []
-            for state in current_states:
-                for event_type in cls.available_transitions(state):
-                    new_state = frozenset(event_type.accumulate_state(state))
-                    if (new_state, event_type) in known_states_and_events:
-                        continue
-                    known_states_and_events.add((new_state, event_type))
-                    yield new_state, event_type
-                    if new_state in known_states:
-                        continue
-                    next_states.append(new_state)
-                    known_states.add(new_state)
+        for code in graph.iter_codes():
+            for event_code, next_code in graph.successors[code]:
+                if (next_code, event_code) in known_states_and_events:
+                    continue
+                known_states_and_events.add((next_code, event_code))
+                yield graph.state(next_code), graph.event_type(event_code)
 
     @classmethod
-    def all_transitions(cls, states=None):
+    def all_transitions(cls, states=None, max_states=None):
         """
         Return a generator of all allowed transitions as a tuple of (initial state, new state, event type).
 
         :param state: a list states to check, If None - all allowed states
+        :param max_states: the maximum number of states to explore, if any
+        :raises: StateMachineTooLargeError
+
+        """
+        if states is not None:
+            state_machine = cls.state_machine()
+            for state in states:
+                for event_type, new_state in state_machine.transitions(state_machine.encode(state)).items():
+                    yield (state, new_state, event_type)
+            return
+
+        graph = cls.state_graph(max_states)
+        for code in graph.iter_allowed_codes():
+            state = graph.state(code)
+            for event_code, next_code in graph.successors[code]:
+                yield (state, graph.state(next_code), graph.event_type(event_code))
+
+    @classmethod
+    def can_reach(cls, state, event_type):
+        """
+        Can the given event type ever follow the given state (after any number of transitions)?
+
+        :param state: a set of event types
+        :raises: StateMachineTooLargeError
+
+        """
+        state_machine = cls.state_machine()
+        return state_machine.reachability.can_reach(state_machine.encode(state), state_machine.codes[event_type])
+
+    @classmethod
+    def reachable_terminals(cls, state):
+        """
+        Return the list of terminal states (that no event may follow) reachable from the given state.
+
+        :param state: a set of event types
+        :raises: StateMachineTooLargeError
 
         """
-        if states is None:
-            states = cls.all_states()
-        for state in states:
-            for event_type in cls.available_transitions(state):
-                new_state = frozenset(event_type.accumulate_state(state))
-                yield (state, new_state, event_type)
+        state_machine = cls.state_machine()
+        reachability = state_machine.reachability
+        return [
+            reachability.graph.state(code)
+            for code in reachability.reachable_terminals(state_machine.encode(state))
+        ]
 
     @classmethod
-    def assert_only_valid_transitions(cls):
+    def invalid_transitions(cls, max_states=None):
+        """
+        Return a list of (state, event types) tuples for every state that has invalid transitions:
+        an auto-transition event type can follow the state together with other event types.
+
+        :param max_states: the maximum number of states to explore, if any
+        :raises: StateMachineTooLargeError
+
+        """
+        graph = cls.state_graph(max_states)
+        return [
+            (
+                graph.state(code),
+                [graph.event_type(event_code) for event_code, _ in graph.successors[code]],
+            )
+            for code in graph.iter_auto_transition_conflicts()
+        ]
+
+    @classmethod
+    def assert_only_valid_transitions(cls, max_states=None):
         """
         Check that the state machine has only valid transitions:
         * only one (or zero) auto-transition event can follow any state. No other event may follow.
 
+        Every invalid state is reported at once.
+
+        :param max_states: the maximum number of states to explore, if any
+
         """
-        for state in cls.all_states():
-            auto_transition_events = [
-                event_type for event_type in cls.auto_transition_events()
-                if event_type.may_transition(state)
-            ]
-            if auto_transition_events and len(cls.available_transitions(state)) > 1:
-                raise AssertionError("Only one auto-transition event can follow any state")
+        invalid_transitions = cls.invalid_transitions(max_states)
+        if invalid_transitions:
+            raise AssertionError("Only one auto-transition event can follow any state: {}".format(
+                "; ".join(
+                    "[{}] -> [{}]".format(
+                        ", ".join(str(item) for item in state),
+                        ", ".join(str(event_type) for event_type in event_types),
+                    )
+                    for state, event_types in invalid_transitions
+                ),
+            ))
 
     def __lt__(self, other):
         return self.name < other.name
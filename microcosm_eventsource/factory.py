@@ -4,13 +4,38 @@ Factory for events.
 Allows event creation logic to be decoupled from controllers.
 
 """
+from functools import partial
+from itertools import count, groupby
+from random import uniform
+from time import sleep
+
 from inflection import camelize
 from microcosm_flask.conventions.encoding import with_context
 from microcosm_flask.naming import name_for
 from microcosm_flask.operations import Operation
+from microcosm_postgres.errors import DuplicateModelError, MissingDependencyError
 from microcosm_pubsub.conventions import created
+from microcosm_pubsub.producer import DeferredBatchProducer, SNSProducer
 from werkzeug.exceptions import UnprocessableEntity
 
+from microcosm_eventsource.errors import ConcurrentStateConflictError, StateMachineTooLargeError
+from microcosm_eventsource.outbox import OutboxProducer
+
+
+# never back off for longer than this (in seconds) between optimistic retries
+MAX_RETRY_BACKOFF = 1.0
+
+# only inline this many legal transitions into a single-statement append (see `EventFactory.append_transition`)
+MAX_APPEND_TRANSITIONS = 256
+
+# the hooks of the per-event write path (see `EventFactory.overrides_write_hooks`)
+WRITE_HOOKS = (
+    "create_transition",
+    "create_event",
+    "create_instance",
+    "create_auto_transition_event",
+)
+
 
 class EventInfo:
     """
@@ -25,6 +50,7 @@ class EventInfo:
         self.version = version
         self.state = None
         self.event = None
+        self.error = None
 
     def publish_event(self, media_type, **kwargs):
         """
@@ -42,6 +68,14 @@ class EventFactory:
     """
     Base class for creating an event.
 
+    Events are processed in memory (see `process_event`) and then written: a single event with
+    `create_instance`, a chain of events (an event followed by auto-transition events) with
+    `insert_chain`. Both may be overridden.
+
+    Subclasses that override one of the per-event write hooks (`create_transition`,
+    `create_event`, `create_instance` or `create_auto_transition_event`) keep the per-event
+    path: every event of a chain is created (and published) one at a time through the hooks.
+
     """
     def __init__(
         self,
@@ -50,30 +84,634 @@ class EventFactory:
         identifier_key=None,
         publish_event_pubsub=True,
         publish_model_pubsub=False,
+        resolve_parent_in_database=False,
+        bypass_orm=False,
+        max_retries=0,
+        retry_backoff=0.01,
+        metrics=None,
+        outbox_store=None,
     ):
+        """
+        :param resolve_parent_in_database:  append events (without a given parent) with a single
+                                            statement that resolves the parent inside Postgres
+        :param bypass_orm:                  create lightweight event records with SQLAlchemy Core
+                                            instead of (session-tracked) model instances
+        :param max_retries:                 retry creating an event this many times if another event
+                                            was appended concurrently (see `create`)
+        :param retry_backoff:               the base (in seconds) of the jittered, exponential backoff
+                                            between retries
+        :param metrics:                     an optional metrics client, used to report retries
+        :param outbox_store:                write messages to an outbox (in the same transaction as
+                                            their events) instead of publishing them; see `OutboxRelay`
+
+        """
         self.event_store = event_store
         self.default_ns = default_ns
         self.identifier_key = identifier_key
         self.publish_event_pubsub = publish_event_pubsub
         self.publish_model_pubsub = publish_model_pubsub
+        self.resolve_parent_in_database = resolve_parent_in_database
+        self.bypass_orm = bypass_orm
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.metrics = metrics
+        self.outbox_store = outbox_store
 
     @property
     def event_info_cls(self):
         return EventInfo
 
+    @property
+    def overrides_write_hooks(self):
+        """
+        Does this factory override one of the per-event write hooks?
+
+        """
+        return any(
+            getattr(type(self), hook) is not getattr(EventFactory, hook)
+            for hook in WRITE_HOOKS
+        )
+
     def create(self, ns, sns_producer, event_type, parent=None, version=None, **kwargs):
         """
         Create an event, validating the underlying state machine.
 
+        The chain of auto-transition events that follows the event (if any) is resolved in
+        memory up front; the whole chain is written with a single statement and its messages
+        are published in one batch.
+
+        Appends are optimistic: the event is written after the given (or most recent) parent and
+        the unique parent constraint detects concurrent appends. If retries are enabled, the most
+        recent event is re-read (and the state machine re-run) after a jittered backoff.
+
+        If an idempotency key is given (see `EventMeta`) and an event was already created with
+        it, that event is returned as is: it is neither validated nor published again. This
+        includes an event created concurrently with the same key (see
+        `retry_idempotency_key_conflict`).
+
+        :raises: IllegalStateTransitionError
+        :raises: ConcurrentStateConflictError once retries are exhausted
+
+        """
+        idempotency_key = kwargs.get("idempotency_key")
+        if idempotency_key is not None:
+            event = self.event_store.retrieve_by_idempotency_key(idempotency_key, record=self.bypass_orm)
+            if event is not None:
+                return event
+
+        for retries in count():
+            create = partial(self.create_after, ns, sns_producer, event_type, parent, version, **kwargs)
+            try:
+                if idempotency_key is None:
+                    event = create()
+                else:
+                    event = self.retry_idempotency_key_conflict(
+                        create,
+                        partial(self.event_store.retrieve_by_idempotency_key, idempotency_key, record=self.bypass_orm),
+                    )
+            except ConcurrentStateConflictError:
+                if retries >= self.max_retries:
+                    self.report_retries(retries, "conflict")
+                    raise
+                self.back_off(retries)
+                parent = None
+                continue
+
+            self.report_retries(retries, "success")
+            return event
+
+    def create_after(self, ns, sns_producer, event_type, parent=None, version=None, **kwargs):
+        """
+        Create an event after the given (or most recent) parent, without retrying.
+
         """
         event_info = self.event_info_cls(ns or self.default_ns, sns_producer, event_type, parent, version)
+        if self.overrides_write_hooks:
+            self.validate_required_fields(event_info, **kwargs)
+            self.validate_transition(event_info, **kwargs)
+            if not event_info.parent:
+                event_info.parent = self.retrieve_most_recent(**kwargs)
+            self.create_transition(event_info, **kwargs)
+            self.create_auto_transition_event(ns, sns_producer, parent=event_info.event, version=version, **kwargs)
+            return event_info.event
+
+        if not event_info.parent and self.resolve_parent_in_database:
+            self.validate_required_fields(event_info, **kwargs)
+            self.validate_transition(event_info, **kwargs)
+            self.append_transition(event_info, skip_publish=True, **kwargs)
+            auto_transitions = self.process_auto_transitions(event_info, version, **kwargs)
+            self.insert_chain(auto_transitions)
+            chain = [event_info] + auto_transitions
+        else:
+            if not event_info.parent:
+                event_info.parent = self.retrieve_most_recent(**kwargs)
+            chain = self.process_chain(event_info, **kwargs)
+            self.insert_chain(chain)
+
+        self.publish_events(chain)
+        return event_info.event
+
+    def create_auto_transition_event(self, ns, sns_producer, parent, version=None, **kwargs):
+        """
+        Create the next auto-transition event (if any) after an event.
+
+        Deprecated: chains of auto-transition events are expanded in memory (see
+        `process_auto_transitions`); this hook is only called on the per-event path (see
+        `overrides_write_hooks`).
+
+        """
+        auto_transition_event = parent.event_type.auto_transition_event(parent.state)
+        if auto_transition_event is None:
+            return
+        # idempotency keys identify the event that was asked for
+        kwargs.pop("idempotency_key", None)
+        self.create_after(ns, sns_producer, auto_transition_event, parent, version, **kwargs)
+
+    def retry_idempotency_key_conflict(self, create, resolve=None):
+        """
+        Create events with idempotency keys within a savepoint.
+
+        Another transaction may concurrently create an event with one of the keys, in which case
+        the write conflicts on the idempotency key index and the statement is aborted. The
+        savepoint is rolled back and the conflict is resolved instead: by default, by creating
+        again (the keys then resolve to the events that were created concurrently).
+
+        """
+        try:
+            with self.event_store.session.begin_nested():
+                return create()
+        except DuplicateModelError as error:
+            if not self.event_store.is_idempotency_key_conflict(error):
+                raise
+        return (resolve or create)()
+
+    def resolve_idempotency_keys(self, batch):
+        """
+        Resolve the idempotency keys of batch items (see `make_batch_item`) with a single query.
+
+        An item whose key was already used by an existing event takes that event; an item whose key
+        is used by an earlier item of the batch duplicates that item. Neither is created.
+
+        :returns: the items to create, and pairs of duplicate and original event infos
+
+        """
+        existing = self.event_store.retrieve_by_idempotency_keys({
+            kwargs["idempotency_key"]
+            for event_info, kwargs in batch
+            if kwargs.get("idempotency_key") is not None
+        }, record=self.bypass_orm)
+
+        originals = {}
+        items = []
+        duplicates = []
+        for event_info, kwargs in batch:
+            idempotency_key = kwargs.get("idempotency_key")
+            if idempotency_key in existing:
+                event_info.event = existing[idempotency_key]
+            elif idempotency_key in originals:
+                duplicates.append((event_info, originals[idempotency_key]))
+            else:
+                if idempotency_key is not None:
+                    originals[idempotency_key] = event_info
+                items.append((event_info, kwargs))
+        return items, duplicates
+
+    def back_off(self, retries):
+        """
+        Sleep before retrying, using exponential backoff with full jitter.
+
+        """
+        sleep(uniform(0, min(MAX_RETRY_BACKOFF, self.retry_backoff * 2 ** retries)))
+
+    def report_retries(self, retries, result):
+        """
+        Report how many times creating an event was retried.
+
+        """
+        if self.metrics is None or not self.max_retries:
+            return
+
+        self.metrics.histogram(
+            "event_factory.retries",
+            retries,
+            tags=[
+                "source:microcosm-eventsource",
+                f"result:{result}",
+                f"model_name:{self.event_store.model_class.__name__}",
+            ],
+        )
+
+    def create_with_container(self, ns, sns_producer, container, event_type, version=None, **kwargs):
+        """
+        Create a (new) container together with its initial event.
+
+        The container has no events yet, so the parent lookup is skipped; the container, the
+        event and any auto-transition events that follow it are written with a single statement.
+
+        If an event was already created with the idempotency key (if any), that event is returned
+        and the container is not created.
+
+        :returns: the created event; the container is persisted in place
+
+        """
+        create = partial(self.create_with_container_once, ns, sns_producer, container, event_type, version, **kwargs)
+        if kwargs.get("idempotency_key") is None:
+            return create()
+        return self.retry_idempotency_key_conflict(create)
+
+    def create_with_container_once(self, ns, sns_producer, container, event_type, version=None, **kwargs):
+        """
+        Create a (new) container together with its initial event, without retrying.
+
+        """
+        idempotency_key = kwargs.get("idempotency_key")
+        if idempotency_key is not None:
+            event = self.event_store.retrieve_by_idempotency_key(idempotency_key, record=self.bypass_orm)
+            if event is not None:
+                return event
+
+        container_id_name = self.event_store.model_class.container_id_name
+        if container.id is None:
+            container.id = self.event_store.new_object_id()
+        kwargs[container_id_name] = container.id
+
+        event_info = self.event_info_cls(ns or self.default_ns, sns_producer, event_type, None, version)
+        chain = self.process_chain(event_info, **kwargs)
+        _, events = self.event_store.create_with_container(container, [
+            event_info.event
+            for event_info in chain
+        ])
+        for event_info, event in zip(chain, events):
+            event_info.event = event
+
+        self.publish_events(chain)
+        return chain[0].event
+
+    def create_many(self, ns, sns_producer, specs, skip_publish=False):
+        """
+        Create many events (possibly across many containers) at once.
+
+        Each spec is a dict of the keyword arguments that `create` takes (including the
+        `event_type`). Rather than processing each event separately:
+
+         -  The most recent events of all containers are retrieved with a single query
+         -  Transitions are computed in memory; events for the same container are chained in order
+            and auto-transition events are created as usual
+         -  Events are inserted with one multi-row INSERT (per level of chaining; initial events
+            are inserted separately)
+         -  Messages are published in batches
+
+        Errors (e.g. illegal transitions, missing containers, or concurrent conflicts) are reported
+        per spec as `EventInfo.error` instead of aborting the batch. A spec fails as a whole if any
+        of its auto-transition events fails.
+
+        Specs whose idempotency key was already used (see `resolve_idempotency_keys`) are not
+        created again; they take the existing (or earlier) event.
+
+        :returns: a list of `EventInfo`, one per spec
+
+        """
+        specs = list(specs)
+        create = partial(self.create_many_once, ns, sns_producer, specs, skip_publish)
+        if all(spec.get("idempotency_key") is None for spec in specs):
+            return create()
+        return self.retry_idempotency_key_conflict(create)
+
+    def create_many_once(self, ns, sns_producer, specs, skip_publish=False):
+        """
+        Create many events at once, without retrying.
+
+        """
+        ns = ns or self.default_ns
+        container_id_name = self.event_store.model_class.container_id_name
+        batch = [
+            self.make_batch_item(ns, sns_producer, **spec)
+            for spec in specs
+        ]
+        items, duplicates = self.resolve_idempotency_keys(batch)
+        parents = self.event_store.retrieve_most_recent_by_container_ids({
+            kwargs[container_id_name]
+            for event_info, kwargs in items
+            if not event_info.parent and kwargs.get(container_id_name) is not None
+        })
+        # containers without events may not exist; checking them up front keeps a foreign key
+        # violation from aborting the whole INSERT
+        container_ids = set(parents) | {
+            event_info.parent.container_id
+            for event_info, kwargs in items
+            if event_info.parent
+        }
+        container_ids |= self.event_store.retrieve_existing_container_ids({
+            kwargs[container_id_name]
+            for event_info, kwargs in items
+            if kwargs.get(container_id_name) is not None
+        } - container_ids)
+
+        # the most recent (in-memory) event of each container
+        heads = {}
+        # pairs of the events to insert, in order, and the event info of the spec they originate from
+        pending = []
+        for event_info, kwargs in items:
+            container_id = kwargs.get(container_id_name)
+            if not event_info.parent:
+                event_info.parent = heads.get(container_id, parents.get(container_id))
+            try:
+                self.validate_container(event_info, container_ids, **kwargs)
+                chain = self.process_chain(event_info, **kwargs)
+            except Exception as error:
+                event_info.error = error
+                continue
+
+            heads[container_id] = chain[-1].event
+            pending.extend((item, event_info) for item in chain)
+
+        self.insert_many(pending)
+        for event_info, original in duplicates:
+            event_info.event, event_info.error = original.event, original.error
+
+        if not skip_publish:
+            self.publish_events([
+                event_info
+                for event_info, origin in pending
+                if event_info.error is None
+            ])
+
+        return [event_info for event_info, _ in batch]
+
+    def create_chain(self, ns, sns_producer, container_id, specs, parent=None, skip_publish=False):
+        """
+        Create a chain of events for one container at once.
+
+        Each spec is a dict of the keyword arguments that `create` takes (including the
+        `event_type` but not the container id). The chain (including any auto-transition events)
+        is computed in memory, parent ids are assigned client-side, and the events are written
+        with a single statement (see `insert_chain`). If any transition is illegal, no event is
+        written.
+
+        Conflicts are resolved with ON CONFLICT (as for `create`), so a concurrent conflict does
+        not abort the transaction.
+
+        Specs whose idempotency key was already used (see `resolve_idempotency_keys`) are not
+        created again; the existing (or earlier) event takes the place of their chain.
+
+        :returns: the list of created events (including auto-transition events), in order
+        :raises: IllegalStateTransitionError
+        :raises: ConcurrentStateConflictError if another event was appended concurrently
+
+        """
+        specs = list(specs)
+        create = partial(self.create_chain_once, ns, sns_producer, container_id, specs, parent, skip_publish)
+        if all(spec.get("idempotency_key") is None for spec in specs):
+            return create()
+        return self.retry_idempotency_key_conflict(create)
+
+    def create_chain_once(self, ns, sns_producer, container_id, specs, parent=None, skip_publish=False):
+        """
+        Create a chain of events for one container at once, without retrying.
+
+        """
+        ns = ns or self.default_ns
+        container_id_name = self.event_store.model_class.container_id_name
+        batch = [
+            self.make_batch_item(ns, sns_producer, **spec)
+            for spec in specs
+        ]
+        items, duplicates = self.resolve_idempotency_keys(batch)
+        if items and parent is None:
+            parent = self.retrieve_most_recent(**{container_id_name: container_id})
+
+        # the chain that each created spec starts
+        chains = {}
+        for event_info, kwargs in items:
+            event_info.parent = parent
+            kwargs[container_id_name] = container_id
+            chains[event_info] = self.process_chain(event_info, **kwargs)
+            parent = chains[event_info][-1].event
+
+        chain = [
+            item
+            for spec_chain in chains.values()
+            for item in spec_chain
+        ]
+        self.insert_chain(chain)
+        for event_info, original in duplicates:
+            event_info.event = original.event
+
+        if not skip_publish:
+            self.publish_events(chain)
+
+        return [
+            item.event
+            for event_info, _ in batch
+            for item in chains.get(event_info, [event_info])
+        ]
+
+    def process_chain(self, event_info, **kwargs):
+        """
+        Process an event state transition in memory, followed by any auto-transition events.
+
+        :returns: the list of processed event infos, each with an (unsaved) event
+        :raises: IllegalStateTransitionError
+
+        """
+        version = event_info.version
+        self.process_event(event_info, **kwargs)
+        return [event_info] + self.process_auto_transitions(event_info, version, **kwargs)
+
+    def process_auto_transitions(self, event_info, version=None, **kwargs):
+        """
+        Process the chain of auto-transition events that follows an event in memory.
+
+        The chain is expanded iteratively, so long chains do not recurse.
+
+        :returns: the list of processed event infos, each with an (unsaved) event
+        :raises: IllegalStateTransitionError
+
+        """
+        # idempotency keys identify the event that was asked for
+        kwargs.pop("idempotency_key", None)
+        chain = []
+        event_info = self.make_auto_transition_event_info(event_info, version)
+        while event_info is not None:
+            self.process_event(event_info, **kwargs)
+            chain.append(event_info)
+            event_info = self.make_auto_transition_event_info(event_info, version)
+        return chain
+
+    def process_event(self, event_info, **kwargs):
+        """
+        Validate and process a single event state transition in memory.
+
+        :raises: IllegalStateTransitionError
+
+        """
         self.validate_required_fields(event_info, **kwargs)
         self.validate_transition(event_info, **kwargs)
-        if not event_info.parent:
-            event_info.parent = self.event_store.retrieve_most_recent(**kwargs)
-        self.create_transition(event_info, **kwargs)
-        self.create_auto_transition_event(ns, sns_producer, parent=event_info.event, version=version, **kwargs)
-        return event_info.event
+        self.process_state_transition(event_info)
+        event_info.event = self.new_event(event_info, **kwargs)
+
+    def retrieve_most_recent(self, **kwargs):
+        """
+        Retrieve the most recent event of a container (as a record, when bypassing the ORM).
+
+        """
+        if self.bypass_orm:
+            return self.event_store.retrieve_most_recent_record(**kwargs)
+        return self.event_store.retrieve_most_recent(**kwargs)
+
+    def make_batch_item(self, ns, sns_producer, event_type, parent=None, version=None, **kwargs):
+        """
+        Create the event info (and the remaining keyword arguments) for a spec of `create_many`.
+
+        """
+        return self.event_info_cls(ns, sns_producer, event_type, parent, version), kwargs
+
+    def make_auto_transition_event_info(self, event_info, version=None):
+        """
+        Create the event info for the auto-transition event (if any) that follows an (in-memory) event.
+
+        """
+        auto_transition_event = event_info.event_type.auto_transition_event(event_info.state)
+        if auto_transition_event is None:
+            return None
+        return self.event_info_cls(
+            event_info.ns,
+            event_info.sns_producer,
+            auto_transition_event,
+            event_info.event,
+            version,
+        )
+
+    def insert_many(self, pending):
+        """
+        Insert in-memory events, level by level.
+
+        Events whose parent is part of the batch are inserted after their parent; if the parent
+        failed to insert, so do they.
+
+        """
+        event_infos = {
+            event_info.event.id: event_info
+            for event_info, _ in pending
+        }
+        levels = {}
+        for event_info, origin in pending:
+            parent_info = event_infos.get(event_info.event.parent_id)
+            level = 0 if parent_info is None else levels[parent_info.event.id] + 1
+            levels[event_info.event.id] = level
+
+        for level in range(max(levels.values(), default=-1) + 1):
+            items = []
+            for event_info, origin in pending:
+                if levels[event_info.event.id] != level:
+                    continue
+                parent_info = event_infos.get(event_info.event.parent_id)
+                if parent_info is not None and parent_info.error is not None:
+                    event_info.error = parent_info.error
+                    origin.error = origin.error or event_info.error
+                    continue
+                if parent_info is not None:
+                    # the parent may have resolved to an existing (similar) event
+                    event_info.event.parent_id = parent_info.event.id
+                items.append((event_info, origin))
+
+            events = self.event_store.upsert_many_on_index_elements([
+                event_info.event
+                for event_info, _ in items
+            ])
+            for (event_info, origin), event in zip(items, events):
+                if event is None:
+                    event_info.error = ConcurrentStateConflictError()
+                    origin.error = origin.error or event_info.error
+                else:
+                    event_info.event = event
+
+    def insert_chain(self, chain):
+        """
+        Write an in-memory chain of events (each the parent of the next) with a single statement.
+
+        A single event is written with `create_instance`, as is every event of a chain if the
+        per-event write hooks are overridden (see `overrides_write_hooks`).
+
+        :raises: ConcurrentStateConflictError
+
+        """
+        if not chain:
+            return
+
+        if len(chain) == 1 or self.overrides_write_hooks:
+            parent = None
+            for event_info in chain:
+                if parent is not None:
+                    # the parent may have resolved to an existing (similar) event
+                    event_info.event.parent_id = parent.id
+                event_info.event = parent = self.create_instance(event_info, event_info.event)
+            return
+
+        events = self.event_store.upsert_chain([
+            event_info.event
+            for event_info in chain
+        ])
+        for event_info, event in zip(chain, events):
+            event_info.event = event
+
+    def append_transition(self, event_info, skip_publish=False, **kwargs):
+        """
+        Append an event after its container's most recent event with a single statement.
+
+        The legal transitions of the event type are computed in memory; Postgres picks the one
+        that applies to the most recent event. If none applies (e.g. the transition is illegal
+        or another event was appended concurrently), falls back to `create_transition` so that
+        the usual errors are raised.
+
+        Event types that cannot be appended this way also fall back to `create_transition`,
+        reading the most recent event first (see `appendable_transitions`).
+
+        :raises: IllegalStateTransitionError
+
+        """
+        legal_transitions = self.appendable_transitions(event_info.event_type)
+        if legal_transitions is None:
+            event = None
+        else:
+            event = self.event_store.append(
+                self.new_event(event_info, **kwargs),
+                legal_transitions,
+                restarting=event_info.event_type.is_restarting,
+            )
+        if event is None:
+            event_info.parent = self.retrieve_most_recent(**kwargs)
+            self.create_transition(event_info, skip_publish=skip_publish, **kwargs)
+            return
+
+        event_info.event = event
+        event_info.state = event.state
+        event_info.version = event.version
+
+        if not skip_publish:
+            self.publish_events([event_info])
+
+    def appendable_transitions(self, event_type):
+        """
+        The legal transitions to append events of the given type with, if any.
+
+        Events are not appended with a single statement if their enum overrides transition
+        validation (which cannot run inside Postgres), if their state machine is too large to
+        enumerate its legal transitions (which is remembered), or if there are too many legal
+        transitions to inline into a statement.
+
+        :returns: the (state, next state) pairs of the event type, or None
+
+        """
+        if event_type.overrides_validation:
+            return None
+        try:
+            legal_transitions = event_type.legal_transitions()
+        except StateMachineTooLargeError:
+            return None
+        if len(legal_transitions) > MAX_APPEND_TRANSITIONS:
+            return None
+        return legal_transitions
 
     def create_transition(self, event_info, **kwargs):
         """
@@ -88,19 +726,6 @@ class EventFactory:
         self.process_state_transition(event_info)
         self.create_event(event_info, **kwargs)
 
-    def create_auto_transition_event(self, ns, sns_producer, parent, **kwargs):
-        """
-        Creates the next auto-transition event if exist
-
-        """
-        auto_transition_events = [
-            event_type for event_type in parent.event_type.auto_transition_events()
-            if event_type.may_transition(parent.state)
-        ]
-        if not auto_transition_events:
-            return
-        self.create(ns, sns_producer, event_type=auto_transition_events[0], parent=parent, **kwargs)
-
     def validate_required_fields(self, event_info, **kwargs):
         """
         Validate type-specific required fields.
@@ -130,6 +755,40 @@ class EventFactory:
                 ],
             )
 
+    def validate_container(self, event_info, container_ids, **kwargs):
+        """
+        Validate that an event of a batch refers to an existing container.
+
+        :param container_ids: the set of existing container ids
+
+        """
+        container_id_name = self.event_store.model_class.container_id_name
+        container_id = kwargs.get(container_id_name)
+        if container_id is None:
+            raise with_context(
+                UnprocessableEntity("Validation error"), [
+                    {
+                        "message": "Missing required field: '{}'".format(
+                            camelize(container_id_name, uppercase_first_letter=False),
+                        ),
+                        "field": camelize(container_id_name, uppercase_first_letter=False),
+                        "reasons": [
+                            "Event type '{}' requires '{}'".format(
+                                event_info.event_type.name,
+                                camelize(container_id_name, uppercase_first_letter=False),
+                            ),
+                        ],
+                    },
+                ],
+            )
+        if container_id not in container_ids:
+            raise MissingDependencyError(
+                "{} not found: {}".format(
+                    self.event_store.model_class.__container__.__name__,
+                    container_id,
+                ),
+            )
+
     def validate_transition(self, event_info, **kwargs):
         """
         Allows implementations of event source to define custom validation.
@@ -145,9 +804,8 @@ class EventFactory:
         to persist.
 
         """
-        state = set(event_info.parent.state) if event_info.parent else set()
-        event_info.event_type.validate_transition(state)
-        event_info.state = event_info.event_type.accumulate_state(state)
+        state = event_info.parent.state if event_info.parent else ()
+        event_info.state = event_info.event_type.next_state(state)
         if event_info.version is not None:
             return
         parent_version = event_info.parent.version if event_info.parent else None
@@ -163,11 +821,24 @@ class EventFactory:
         If the event has a parent id, uses an upsert to handle concurrent operations
         that produce the *same* event.
 
+        """
+        instance = self.new_event(event_info, **kwargs)
+
+        event_info.event = self.create_instance(event_info, instance)
+
+        if not skip_publish:
+            self.publish_events([event_info])
+
+    def new_event(self, event_info, **kwargs):
+        """
+        Instantiate (but do not persist) the event.
+
         """
         parent_id = None if event_info.parent is None else event_info.parent.id
+        new_event = self.event_store.new_record if self.bypass_orm else self.event_store.model_class
 
         # NB: setting the id here so that it can easily be mocked in tests
-        instance = self.event_store.model_class(
+        return new_event(
             id=self.event_store.new_object_id(),
             event_type=event_info.event_type,
             parent_id=parent_id,
@@ -176,12 +847,10 @@ class EventFactory:
             **kwargs
         )
 
-        event_info.event = self.create_instance(event_info, instance)
-
-        if not skip_publish:
-            self.publish_event(event_info)
-
     def create_instance(self, event_info, instance):
+        if self.bypass_orm:
+            event, = self.event_store.upsert_chain([instance])
+            return event
         if event_info.parent is None:
             return self.event_store.create(instance)
         else:
@@ -205,6 +874,41 @@ class EventFactory:
                 **uri_kwargs,
             )
 
+    def publish_events(self, event_infos):
+        """
+        Publish that many events occurred, batching the messages of many events where the
+        producer supports it.
+
+        With an outbox store, the messages are written to the outbox instead.
+
+        """
+        if self.outbox_store is not None:
+            with OutboxProducer(self.outbox_store) as outbox_producer:
+                self.publish_events_with(outbox_producer, event_infos)
+            return
+
+        for sns_producer, group in groupby(event_infos, key=lambda event_info: event_info.sns_producer):
+            group = list(group)
+            if len(group) == 1 or not isinstance(sns_producer, SNSProducer):
+                for event_info in group:
+                    self.publish_event(event_info)
+                continue
+
+            with DeferredBatchProducer(sns_producer) as deferred_producer:
+                self.publish_events_with(deferred_producer, group)
+
+    def publish_events_with(self, producer, event_infos):
+        """
+        Publish events with another producer than their own (e.g. a deferred one).
+
+        """
+        for event_info in event_infos:
+            sns_producer, event_info.sns_producer = event_info.sns_producer, producer
+            try:
+                self.publish_event(event_info)
+            finally:
+                event_info.sns_producer = sns_producer
+
     def make_media_type(self, event_info, discard_event_type=False):
         if discard_event_type:
             return created("{}".format(
@@ -44,6 +44,134 @@ listen(
 )
 
 
+def array_literal(state):
+    return "'{{{}}}'".format(",".join(sorted(event_type.name for event_type in state)))
+
+
+def validation_trigger_ddl(model_class):
+    """
+    Generate a trigger that validates inserted events against the model's event type.
+
+    The (PL/pgSQL) trigger function checks every inserted event against its parent:
+
+     -  the event's type may follow the parent's state (or may be initial, without a parent)
+     -  the event's state is the state accumulated from the parent's state
+     -  the event's version is at least the parent's version (plus one if the event type is
+        restarting), or at least 1 without a parent; callers (e.g. imports) may supply later
+        versions than the factory would compute
+     -  the parent belongs to the same container
+
+    The legal transitions are compiled into the function from the reachable states of the
+    event type, so set-based inserts (e.g. bulk loads, backfills or `proc_events_create`) are
+    validated inside Postgres. Illegal events raise a `check_violation`.
+
+    The trigger is a (deferrable, initially immediate) constraint trigger that runs after each
+    statement, so that events may follow parents inserted by the same statement. Updates (e.g.
+    re-parenting existing events) are not validated.
+
+    :returns: a (create, drop) tuple of SQL statements
+    :raises: StateMachineTooLargeError
+
+    """
+    table_name = model_class.__tablename__
+    container_id_name = model_class.container_id_name
+    function_name = "{}_validate".format(table_name)
+    trigger_name = "{}_validate_trigger".format(table_name)
+
+    branches = []
+    for event_type in model_class.__eventtype__:
+        legal_transitions = event_type.legal_transitions()
+        if not legal_transitions:
+            continue
+        conditions = [
+            (
+                "        {} parent_state @> {state} AND parent_state <@ {state} THEN\n"
+                "            next_state := {next_state};\n"
+            ).format(
+                "IF" if index == 0 else "ELSIF",
+                state=array_literal(state),
+                next_state=array_literal(next_state),
+            )
+            for index, (state, next_state) in enumerate(legal_transitions)
+        ]
+        branches.append(
+            "    {} NEW.event_type = '{}' THEN\n"
+            "{}"
+            "        END IF;\n"
+            "        min_version := coalesce(parent_version{}, 1);\n".format(
+                "IF" if not branches else "ELSIF",
+                event_type.name,
+                "".join(conditions),
+                " + 1" if event_type.is_restarting else "",
+            )
+        )
+    if branches:
+        branches.append("    END IF;\n")
+
+    create = f"""
+CREATE OR REPLACE FUNCTION {function_name}() RETURNS trigger AS
+$func$
+DECLARE
+    parent_state text[] := '{{}}';
+    parent_version integer;
+    next_state text[];
+    min_version integer;
+BEGIN
+    IF NEW.parent_id IS NOT NULL THEN
+        SELECT state::text[], version INTO parent_state, parent_version
+          FROM {table_name}
+         WHERE id = NEW.parent_id
+           AND {container_id_name} = NEW.{container_id_name};
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Event % may not follow event %', NEW.id, NEW.parent_id
+                USING ERRCODE = 'check_violation';
+        END IF;
+    END IF;
+
+{"".join(branches)}
+    IF next_state IS NULL THEN
+        RAISE EXCEPTION 'Event type ''%'' may not follow %', NEW.event_type, parent_state
+            USING ERRCODE = 'check_violation';
+    END IF;
+    IF NOT (NEW.state::text[] @> next_state AND NEW.state::text[] <@ next_state) THEN
+        RAISE EXCEPTION 'Event % has state %, expected %', NEW.id, NEW.state, next_state
+            USING ERRCODE = 'check_violation';
+    END IF;
+    IF NEW.version IS NULL OR NEW.version < min_version THEN
+        RAISE EXCEPTION 'Event % has version %, expected at least %', NEW.id, NEW.version, min_version
+            USING ERRCODE = 'check_violation';
+    END IF;
+    RETURN NULL;
+END
+$func$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS {trigger_name} ON {table_name};
+CREATE CONSTRAINT TRIGGER {trigger_name}
+    AFTER INSERT ON {table_name}
+    DEFERRABLE INITIALLY IMMEDIATE
+    FOR EACH ROW EXECUTE PROCEDURE {function_name}();
+"""
+    drop = f"""
+DROP TRIGGER IF EXISTS {trigger_name} ON {table_name};
+DROP FUNCTION IF EXISTS {function_name}();
+"""
+    return create, drop
+
+
+def install_validation_trigger(model_class):
+    """
+    Register an event model's validation trigger (see `validation_trigger_ddl`) with its table.
+
+    The trigger is then created by `create_all`; existing databases should run the generated
+    DDL in a migration instead.
+
+    """
+    create, drop = validation_trigger_ddl(model_class)
+    # DDL statements are %-formatted
+    listen(model_class.__table__, "after_create", DDL(create.replace("%", "%%")))
+    listen(model_class.__table__, "before_drop", DDL(drop.replace("%", "%%")))
+
+
 class last(FunctionElement):
     """
     Define a SQLAlchemy function that maps to a postgres function to select the last non-null value in window.
@@ -0,0 +1,216 @@
+"""
+Per-container serialization.
+
+Writers that must not interleave (e.g. that read the most recent event of a container and
+append after it) serialize on the container. Each event store selects a strategy:
+
+ -  `RowLock` takes a row lock (`FOR UPDATE`) on the most recent event
+ -  `AdvisoryLock` takes a transaction-scoped advisory lock keyed by a hash of the container id
+
+Advisory locks avoid the ordered scan and the tuple lock (which dirties the locked page) and
+can also lock containers that have no events yet. Both strategies exclude only writers that
+use the same strategy.
+
+Strategies also differ in how they wait for a lock held by another writer; each way of
+failing raises its own subclass of `ContainerLockNotAvailableRetry`:
+
+ -  not at all (NOWAIT or a try-lock): `ContainerLockNotAvailableRetry`
+ -  up to a (transaction-local) `lock_timeout`: `ContainerLockTimeoutRetry`
+ -  skipping locked rows (SKIP LOCKED): `ContainerLockSkippedRetry`
+
+The time spent acquiring locks is recorded with the store's metrics, tagged by strategy.
+
+"""
+from contextlib import contextmanager
+from hashlib import blake2b
+
+import psycopg2
+from microcosm_logging.timing import elapsed_time
+from microcosm_postgres.metrics import SQLExecutionStatus
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from microcosm_eventsource.errors import (
+    ContainerLockNotAvailableRetry,
+    ContainerLockSkippedRetry,
+    ContainerLockTimeoutRetry,
+)
+
+
+def advisory_lock_key(table_name, container_id):
+    """
+    Derive a (signed 64-bit) advisory lock key for a container.
+
+    The key is stable across processes and includes the table name, so that different event
+    tables do not contend for the same keys.
+
+    """
+    digest = blake2b(
+        "{}:{}".format(table_name, container_id).encode("utf-8"),
+        digest_size=8,
+    ).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+@contextmanager
+def lock_not_available(error_cls):
+    """
+    Raise the given error if a lock is not available.
+
+    """
+    try:
+        yield
+    except OperationalError as error:
+        if isinstance(error.orig, psycopg2.errors.LockNotAvailable):
+            raise error_cls()
+        raise
+
+
+@contextmanager
+def lock_timeout(session, timeout):
+    """
+    Bound the wait for locks with a (transaction-local) lock timeout, restoring it afterwards.
+
+    :param timeout: the timeout in milliseconds
+
+    """
+    previous_timeout = session.execute(select(
+        func.current_setting("lock_timeout"),
+        func.set_config("lock_timeout", "{}ms".format(timeout), True),
+    )).first()[0]
+    with lock_not_available(ContainerLockTimeoutRetry):
+        yield
+    session.execute(select(func.set_config("lock_timeout", previous_timeout, True)))
+
+
+@contextmanager
+def lock_wait_timing(store, action):
+    """
+    Record the time spent acquiring a lock.
+
+    """
+    extra = dict(
+        model_name=store.model_name,
+        action=action,
+    )
+    execution_status = SQLExecutionStatus.FAILURE.name
+    try:
+        with elapsed_time(extra):
+            yield
+            execution_status = SQLExecutionStatus.SUCCESS.name
+    finally:
+        store.postgres_store_metrics(
+            execution_result=execution_status,
+            **extra
+        )
+
+
+class RowLock:
+    """
+    Lock the most recent event of a container with `FOR UPDATE`.
+
+    """
+    def __init__(self, timeout=None, skip_locked=False):
+        """
+        By default, does not wait for the lock (NOWAIT).
+
+        :param timeout: wait at most this many milliseconds for the lock
+        :param skip_locked: skip the most recent event if it is locked (SKIP LOCKED)
+
+        """
+        self.timeout = timeout
+        self.skip_locked = skip_locked
+
+    @property
+    def action(self):
+        if self.skip_locked:
+            return "lock_skip_locked"
+        if self.timeout is not None:
+            return "lock_timeout"
+        return "lock_nowait"
+
+    def retrieve_most_recent(self, store, container_id):
+        criterion = store.model_class.container_id == container_id
+        with lock_wait_timing(store, self.action):
+            if self.skip_locked:
+                return self.retrieve_unless_locked(store, criterion)
+            if self.timeout is not None:
+                with lock_timeout(store.session, self.timeout):
+                    return store._order_by(store._query(criterion)).with_for_update().first()
+            with lock_not_available(ContainerLockNotAvailableRetry):
+                return store._retrieve_most_recent(criterion, for_update=True)
+
+    def retrieve_unless_locked(self, store, criterion):
+        """
+        Lock the most recent event with SKIP LOCKED.
+
+        The most recent event is resolved before locking, so that a locked event is never
+        silently replaced by an older one.
+
+        """
+        most_recent_id = store._order_by(store._query(criterion)).with_entities(
+            store.model_class.id,
+        ).limit(1).scalar_subquery()
+        most_recent = store._query(
+            store.model_class.id == most_recent_id,
+        ).with_for_update(skip_locked=True).first()
+
+        if most_recent is None and store.session.query(store._query(criterion).exists()).scalar():
+            raise ContainerLockSkippedRetry()
+        return most_recent
+
+
+class AdvisoryLock:
+    """
+    Lock a container with `pg_advisory_xact_lock`.
+
+    The lock is released when the transaction ends.
+
+    """
+    def __init__(self, timeout=None, try_lock=False):
+        """
+        By default, waits for the lock indefinitely.
+
+        :param timeout: wait at most this many milliseconds for the lock
+        :param try_lock: do not wait for the lock at all
+
+        """
+        self.timeout = timeout
+        self.try_lock = try_lock
+
+    @property
+    def action(self):
+        if self.try_lock:
+            return "advisory_try_lock"
+        if self.timeout is not None:
+            return "advisory_lock_timeout"
+        return "advisory_lock"
+
+    def retrieve_most_recent(self, store, container_id):
+        with lock_wait_timing(store, self.action):
+            self.acquire(store, container_id)
+        return store._retrieve_most_recent(
+            store.model_class.container_id == container_id,
+        )
+
+    def acquire(self, store, container_id):
+        """
+        Acquire the lock of a container.
+
+        :raises: ContainerLockNotAvailableRetry
+
+        """
+        key = advisory_lock_key(store.model_class.__tablename__, container_id)
+        session = store.session
+
+        if self.try_lock:
+            if not session.execute(select(func.pg_try_advisory_xact_lock(key))).scalar():
+                raise ContainerLockNotAvailableRetry()
+            return
+
+        if self.timeout is None:
+            session.execute(select(func.pg_advisory_xact_lock(key)))
+            return
+
+        with lock_timeout(session, self.timeout):
+            session.execute(select(func.pg_advisory_xact_lock(key)))
@@ -5,4 +5,6 @@ Event modeling.
 from microcosm_eventsource.models.alias import ColumnAlias  # noqa: F401
 from microcosm_eventsource.models.base import BaseEvent  # noqa: F401
 from microcosm_eventsource.models.meta import EventMeta  # noqa: F401
+from microcosm_eventsource.models.outbox import OutboxMessageMixin  # noqa: F401
+from microcosm_eventsource.models.record import EventRecord  # noqa: F401
 from microcosm_eventsource.models.rollup import RollUp  # noqa: F401
@@ -13,6 +13,7 @@ from sqlalchemy import (
     ForeignKey,
     Index,
     Integer,
+    String,
 )
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy_utils import UUIDType
@@ -26,7 +27,7 @@ MetaClass: Any = type(Model)
 
 
 def default_state(context):
-    return (context.current_parameters["event_type"],)
+    return (context.get_current_parameters()["event_type"],)
 
 
 def join_event_types(event_types):
@@ -61,6 +62,8 @@ class EventMeta(MetaClass):
          -  `__unique_parent__` a flag indicating whether or not a unique parent constraint is created
          May be set to False in cases like having a unique parent for each version of the event
          If the flag is set to False, a similar unique constraint should be set on the event class
+         -  `__idempotency_key__` a flag indicating whether or not an (optional, unique) idempotency key
+         column is created; creating an event with a known key returns the original event
 
         """
         if any(type(base) is EventMeta for base in bases):
@@ -76,12 +79,14 @@ class EventMeta(MetaClass):
             event_type=dct["__eventtype__"],
             table_name=dct["__tablename__"],
             table_args=dct.get("__table_args__", ()),
-            unique_parent=dct.get("__unique_parent__", True)
+            unique_parent=dct.get("__unique_parent__", True),
+            idempotency_key=dct.get("__idempotency_key__", False),
         ))
 
         return super(EventMeta, cls).__new__(cls, name, bases, dct)
 
-    def make_declarations(cls, container_name, event_type, table_name, table_args, unique_parent):
+    def make_declarations(cls, container_name, event_type, table_name, table_args, unique_parent,
+                          idempotency_key=False):
         """
         Declare columns and indexes.
 
@@ -106,12 +111,14 @@ class EventMeta(MetaClass):
 
          -  Each event has a non-nullable serial clock to ensure total ordering.
 
+         -  Optionally, each event has a nullable idempotency key, unique across events.
+
         """
         container_id = "{}.id".format(container_name)
         container_id_name = "{}_id".format(container_name)
         parent_id = "{}.id".format(table_name)
 
-        return {
+        declarations = {
             # columns
             container_id_name: Column(UUIDType, ForeignKey(container_id), nullable=False),
             "event_type": Column(EnumType(event_type), nullable=False),
@@ -127,6 +134,23 @@ class EventMeta(MetaClass):
             # indexes and constraints
             "__table_args__": table_args + cls.make_table_args(cls, table_name, container_id_name, event_type),
         }
+        if idempotency_key:
+            declarations["idempotency_key"] = Column(String, nullable=True)
+            declarations["__table_args__"] += cls.make_idempotency_key_indexes(cls, table_name)
+        return declarations
+
+    def make_idempotency_key_indexes(cls, table_name):
+        """
+        Declare the (unique) idempotency key index.
+
+        """
+        return (
+            Index(
+                "{}_unique_idempotency_key".format(table_name),
+                "idempotency_key",
+                unique=True,
+            ),
+        )
 
     def make_table_args(cls, table_name, container_id_name, event_type):
         """
@@ -0,0 +1,24 @@
+"""
+Transactional outbox messages.
+
+"""
+from sqlalchemy import BigInteger, Column, String
+
+
+class OutboxMessageMixin:
+    """
+    A message waiting (in the outbox) to be published.
+
+    Rows are compact: the message is rebuilt from its media type and uri when relayed. The
+    (serial) id orders messages roughly in the order their events were created (ids are
+    assigned on insert, not on commit).
+
+    Usage:
+
+        class TaskOutboxMessage(OutboxMessageMixin, Model):
+            __tablename__ = "task_outbox"
+
+    """
+    id = Column(BigInteger, primary_key=True)
+    media_type = Column(String, nullable=False)
+    uri = Column(String, nullable=False)
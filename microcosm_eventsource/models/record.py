@@ -0,0 +1,56 @@
+"""
+Lightweight event records.
+
+"""
+from microcosm_eventsource.models.base import BaseEvent
+
+
+class EventRecord(BaseEvent):
+    """
+    A plain (non-ORM) event.
+
+    Records hold the same attributes as instances of their event model, but are not
+    instrumented by SQLAlchemy and are never tracked by a session. They are written and
+    read back with SQLAlchemy Core.
+
+    """
+    def __init__(self, model_class, **kwargs):
+        self._model_class = model_class
+        self.__dict__.update(kwargs)
+
+    @property
+    def container_id(self):
+        return getattr(self, self._model_class.container_id_name)
+
+    def _members(self):
+        """
+        Return a dict of non-private members.
+
+        """
+        return {
+            key: value
+            for key, value in self.__dict__.items()
+            if not key.startswith("_")
+        }
+
+    def __eq__(self, other):
+        return (
+            type(other) is type(self)
+            and self._model_class is other._model_class
+            and self._members() == other._members()
+        )
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return id(self) if self.id is None else hash(self.id)
+
+    def __repr__(self):
+        return "{}Record({})".format(
+            self._model_class.__name__,
+            ", ".join(
+                "{}={!r}".format(key, value)
+                for key, value in sorted(self._members().items())
+            ),
+        )
@@ -0,0 +1,105 @@
+"""
+Transactional outbox.
+
+Publishing inline puts the broker's latency (and failures) on the request path, and a message
+may be published for an event whose transaction later rolls back (or vice versa). Instead,
+an event factory with an outbox store writes each message to the outbox, in the same
+transaction as its event. A relay then drains the outbox in batches and hands the
+messages to the producer: messages are published at least once, after their events commit.
+
+Messages are taken in (serial) id order, which is only roughly the order their events were
+created: ids are assigned when messages are inserted, not when their transactions commit, so a
+message may become visible after messages with later ids were published. Messages written by
+the same transaction are published in order. Relays take batches with SKIP LOCKED, so several
+relays may drain the same outbox, and messages locked by one relay are skipped (not waited for)
+by the others. Consumers should therefore tolerate duplicate and out of order messages.
+
+"""
+from threading import Event
+
+from microcosm_postgres.context import transaction
+from microcosm_pubsub.producer import DeferredBatchProducer, SNSProducer
+
+
+class OutboxProducer:
+    """
+    Collect produced messages and write them to the outbox.
+
+    Accepts the same calls as the producers that events are published with.
+
+    """
+    def __init__(self, outbox_store):
+        self.outbox_store = outbox_store
+        self.messages = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is not None:
+            return
+
+        self.outbox_store.enqueue_many(self.messages)
+        self.messages = []
+
+    def produce(self, media_type, uri):
+        self.messages.append(dict(
+            media_type=media_type,
+            uri=uri,
+        ))
+
+
+class OutboxRelay:
+    """
+    Drain an outbox into a producer.
+
+    Any object with a `produce(media_type, uri=...)` method may stand in for the producer
+    (e.g. in tests); an `SNSProducer` publishes each batch as batch messages.
+
+    """
+    def __init__(self, outbox_store, sns_producer, batch_size=1000, interval=1.0):
+        """
+        :param batch_size: relay at most this many messages per transaction
+        :param interval: wait this many seconds (when running) once the outbox is drained
+
+        """
+        self.outbox_store = outbox_store
+        self.sns_producer = sns_producer
+        self.batch_size = batch_size
+        self.interval = interval
+
+    def relay(self):
+        """
+        Relay one batch of messages, oldest first.
+
+        If the producer fails, the transaction rolls back and the batch is relayed again later.
+
+        :returns: the number of messages relayed
+
+        """
+        with transaction():
+            messages = self.outbox_store.take_batch(self.batch_size)
+            self.produce(messages)
+        return len(messages)
+
+    def produce(self, messages):
+        if not isinstance(self.sns_producer, SNSProducer):
+            for message in messages:
+                self.sns_producer.produce(message.media_type, uri=message.uri)
+            return
+
+        with DeferredBatchProducer(self.sns_producer) as deferred_producer:
+            for message in messages:
+                deferred_producer.produce(message.media_type, uri=message.uri)
+
+    def run(self, stop=None):
+        """
+        Relay batches until stopped, waiting whenever the outbox is drained.
+
+        :param stop: a `threading.Event` that stops the relay
+
+        """
+        stop = stop or Event()
+        while not stop.is_set():
+            if self.relay() < self.batch_size:
+                stop.wait(self.interval)
@@ -0,0 +1,284 @@
+"""
+Reachable state graphs.
+
+Explores the states reachable from the empty (pre-initial) state of a compiled state machine:
+
+ -  States are integer masks and are assigned codes in breadth-first discovery order;
+    the empty state always has code zero.
+ -  Each state keeps its outgoing edges (successors) and incoming edges (predecessors)
+    as (event type code, state code) and (state code, event type code) tuples.
+ -  Exploration is lazy, so states can be streamed as they are discovered, and may be
+    capped with a node budget.
+
+"""
+from microcosm_eventsource.errors import StateMachineTooLargeError
+
+
+def iter_bits(mask):
+    """
+    Generate the positions of the bits set in a mask, in ascending order.
+
+    """
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+class StateGraph:
+    """
+    The graph of reachable states of a compiled state machine.
+
+    """
+    def __init__(self, state_machine, max_states=None):
+        """
+        :param state_machine:   a `CompiledStateMachine`
+        :param max_states:      the maximum number of states to discover, if any
+
+        """
+        self.state_machine = state_machine
+        self.max_states = max_states
+        self.masks = [0]
+        self.codes = {0: 0}
+        self.successors = []
+        self.predecessors = [[]]
+
+    def iter_codes(self):
+        """
+        Generate state codes in breadth-first order, exploring each state before it is generated.
+
+        :raises: StateMachineTooLargeError if more than `max_states` states are reachable
+
+        """
+        code = 0
+        while code < len(self.masks):
+            if code == len(self.successors):
+                self.expand(code)
+            yield code
+            code += 1
+
+    def iter_allowed_codes(self):
+        """
+        Generate the codes of allowed states.
+
+        The empty state is only allowed if some transition leads back to it, which is only
+        known once every state has been explored; if so, it is generated last.
+
+        """
+        for code in self.iter_codes():
+            if code:
+                yield code
+        if self.predecessors[0]:
+            yield 0
+
+    def iter_auto_transition_conflicts(self):
+        """
+        Generate the codes of allowed states that are followed by an auto-transition event type
+        and by any other event type.
+
+        Conflicts are computed in a single pass over the graph; no states are explored at all
+        if there are no auto-transition event types.
+
+        """
+        auto_transitions = self.state_machine.auto_transitions
+        if not auto_transitions:
+            return
+
+        for code in self.iter_allowed_codes():
+            successors = self.successors[code]
+            if len(successors) > 1 and any(
+                auto_transitions >> event_code & 1
+                for event_code, _ in successors
+            ):
+                yield code
+
+    def explore(self):
+        """
+        Explore every reachable state.
+
+        """
+        for _ in self.iter_codes():
+            pass
+        return self
+
+    def expand(self, code):
+        """
+        Compute the edges out of a state, discovering new states as needed.
+
+        """
+        successors = []
+        for event_type, next_state in self.state_machine.step(self.masks[code]):
+            next_code = self.add(self.state_machine.encode(next_state))
+            event_code = self.state_machine.codes[event_type]
+            successors.append((event_code, next_code))
+            self.predecessors[next_code].append((code, event_code))
+        self.successors.append(tuple(successors))
+
+    def add(self, mask):
+        """
+        Assign a code to a state.
+
+        """
+        code = self.codes.get(mask)
+        if code is not None:
+            return code
+
+        if self.max_states is not None and len(self.masks) >= self.max_states:
+            raise StateMachineTooLargeError("State machine has more than {} reachable states".format(
+                self.max_states,
+            ))
+
+        code = len(self.masks)
+        self.masks.append(mask)
+        self.codes[mask] = code
+        self.predecessors.append([])
+        return code
+
+    def state(self, code):
+        """
+        Decode the state with the given code.
+
+        """
+        return self.state_machine.decode(self.masks[code])
+
+    def event_type(self, event_code):
+        """
+        Resolve the event type with the given code.
+
+        """
+        return self.state_machine.event_types[event_code]
+
+
+def strongly_connected_components(graph):
+    """
+    Generate the strongly connected components of an explored graph as lists of state codes.
+
+    Uses (an iterative form of) Tarjan's algorithm, so components are generated after every
+    component that they lead to.
+
+    """
+    count = len(graph.masks)
+    index = [-1] * count
+    lowlink = [0] * count
+    on_stack = [False] * count
+    stack = []
+    next_index = 0
+
+    for root in range(count):
+        if index[root] >= 0:
+            continue
+
+        work = [(root, 0)]
+        while work:
+            code, position = work.pop()
+            if position == 0:
+                index[code] = lowlink[code] = next_index
+                next_index += 1
+                stack.append(code)
+                on_stack[code] = True
+
+            successors = graph.successors[code]
+            while position < len(successors):
+                next_code = successors[position][1]
+                position += 1
+                if index[next_code] < 0:
+                    break
+                if on_stack[next_code]:
+                    lowlink[code] = min(lowlink[code], index[next_code])
+            else:
+                if lowlink[code] == index[code]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == code:
+                            break
+                    yield component
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[code])
+                continue
+
+            # visit the undiscovered successor, then resume
+            work.append((code, position))
+            work.append((next_code, 0))
+
+
+class ReachabilityIndex:
+    """
+    The transitive closure of a (fully explored) state graph, as bitsets per state code:
+
+     -  `reachable_states[code]` has a bit for every state code reachable from a state (including itself)
+     -  `reachable_events[code]` has a bit for every event type code that may eventually follow a state
+     -  `terminals` has a bit for every state code without successors
+
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        count = len(graph.masks)
+        self.reachable_states = [0] * count
+        self.reachable_events = [0] * count
+        self.terminals = 0
+
+        for code, successors in enumerate(graph.successors):
+            if not successors:
+                self.terminals |= 1 << code
+
+        for component in strongly_connected_components(graph):
+            states, events = 0, 0
+            for code in component:
+                states |= 1 << code
+            for code in component:
+                for event_code, next_code in graph.successors[code]:
+                    events |= 1 << event_code
+                    if not states >> next_code & 1:
+                        # successor components are already closed
+                        states |= self.reachable_states[next_code]
+                        events |= self.reachable_events[next_code]
+            for code in component:
+                self.reachable_states[code] = states
+                self.reachable_events[code] = events
+
+    def closure(self, mask):
+        """
+        Compute the (reachable states, reachable events) bitsets of an (encoded) state.
+
+        States that are not themselves reachable (e.g. from legacy data) are closed over
+        their successors.
+
+        """
+        code = self.graph.codes.get(mask)
+        if code is not None:
+            return self.reachable_states[code], self.reachable_events[code]
+
+        state_machine = self.graph.state_machine
+        states, events = 0, 0
+        visited, pending = {mask}, [mask]
+        while pending:
+            for event_type, next_state in state_machine.transitions(pending.pop()).items():
+                events |= state_machine.bits[event_type]
+                next_mask = state_machine.encode(next_state)
+                next_code = self.graph.codes.get(next_mask)
+                if next_code is not None:
+                    states |= self.reachable_states[next_code]
+                    events |= self.reachable_events[next_code]
+                elif next_mask not in visited:
+                    visited.add(next_mask)
+                    pending.append(next_mask)
+        return states, events
+
+    def can_reach(self, mask, event_code):
+        """
+        Can an event type eventually follow the given (encoded) state?
+
+        """
+        return bool(self.closure(mask)[1] >> event_code & 1)
+
+    def reachable_terminals(self, mask):
+        """
+        Compute the codes of the terminal states reachable from the given (encoded) state.
+
+        """
+        states, _ = self.closure(mask)
+        return list(iter_bits(states & self.terminals))
@@ -0,0 +1,43 @@
+"""
+Event states.
+
+An event's state is the set of event types accumulated through its transitions. States
+are represented by `State`: an immutable set that iterates in sorted order so that it can
+be used directly as the value of the event `state` (array) column.
+
+States are interned: the same logical state always maps to one shared instance, so each
+state is sorted exactly once.
+
+"""
+from weakref import WeakValueDictionary
+
+
+class State(frozenset):
+    """
+    An immutable, interned and ordered set of event types.
+
+    """
+    _interned = WeakValueDictionary()
+
+    def __new__(cls, event_types=()):
+        if isinstance(event_types, State):
+            return event_types
+
+        key = frozenset(event_types)
+        state = cls._interned.get(key)
+        if state is None:
+            state = super().__new__(cls, key)
+            state._ordered = tuple(sorted(key))
+            state = cls._interned.setdefault(key, state)
+        return state
+
+    def __iter__(self):
+        return iter(self._ordered)
+
+    def __reduce__(self):
+        return (self.__class__, (self._ordered,))
+
+    def __repr__(self):
+        return "State([{}])".format(
+            ", ".join(str(event_type) for event_type in self._ordered),
+        )
@@ -1,2 +1,3 @@
 from microcosm_eventsource.stores.event import EventStore  # noqa: F401
+from microcosm_eventsource.stores.outbox import OutboxStore  # noqa: F401
 from microcosm_eventsource.stores.rollup import RollUpStore  # noqa: F401
@@ -2,16 +2,49 @@
 Event store.
 
 """
-import psycopg2
 from microcosm_postgres.models import Model
 from microcosm_postgres.store import Store
+from sqlalchemy import (
+    cast,
+    column,
+    exists,
+    func,
+    literal,
+    select,
+    true,
+    union_all,
+    values,
+)
 from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import make_transient_to_detached
 
-from microcosm_eventsource.errors import (
-    ConcurrentStateConflictError,
-    ContainerLockNotAvailableRetry,
-)
+from microcosm_eventsource.errors import ConcurrentStateConflictError
+from microcosm_eventsource.locking import RowLock
+from microcosm_eventsource.models.record import EventRecord
+
+
+class RowContext:
+    """
+    Evaluate (context-sensitive) column defaults for a row outside of statement execution.
+
+    """
+    def __init__(self, parameters):
+        self.parameters = parameters
+
+    def get_current_parameters(self):
+        return self.parameters
+
+
+def default_keys(mapper):
+    """
+    The keys of the columns of a mapper that have a (Python-side) default.
+
+    """
+    return [
+        key
+        for key, model_column in mapper.columns.items()
+        if model_column.default is not None
+    ]
 
 
 class EventStore(Store):
@@ -19,6 +52,15 @@ class EventStore(Store):
     Event persistence operations.
 
     """
+    def __init__(self, graph, model_class, auto_filter_fields=(), container_lock=None):
+        """
+        :param container_lock: the strategy used to serialize writers per container; defaults to
+                               a row lock on the most recent event
+
+        """
+        super().__init__(graph, model_class, auto_filter_fields)
+        self.container_lock = container_lock or RowLock()
+
     def retrieve_most_recent(self, **kwargs):
         """
         Retrieve the most recent by container id and event type.
@@ -40,23 +82,150 @@ class EventStore(Store):
             self.model_class.event_type == event_type,
         )
 
-    def retrieve_most_recent_with_update_lock(self, **kwargs):
+    def retrieve_most_recent_by_container_ids(self, container_ids):
         """
-        Retrieve the most recent by container id, while taking a ON UPDATE lock with NOWAIT OPTION.
-        If another instance of event is being processed simultaneously, it would raise LockNotAvailable error.
-        This method it to serialize event sourcing, if they are processing the same container instance.
+        Retrieve the most recent event of each of many containers with a single query.
+
+        :returns: a dict from container id to the container's most recent event
+
+        """
+        if not container_ids:
+            return {}
+
+        # SELECT DISTINCT ON (<container_id>) *
+        #   FROM <event>
+        #  WHERE <container_id> IN (...)
+        #  ORDER BY <container_id>, clock DESC
+        query = self._query(
+            self.model_class.container_id.in_(container_ids),
+        ).distinct(
+            self.model_class.container_id,
+        ).order_by(
+            self.model_class.container_id,
+            self.model_class.clock.desc(),
+        )
+        return {
+            event.container_id: event
+            for event in query
+        }
+
+    def retrieve_existing_container_ids(self, container_ids):
+        """
+        Retrieve which of many container ids refer to existing containers with a single query.
+
+        :returns: the set of existing container ids
+
+        """
+        if not container_ids:
+            return set()
+
+        container_class = self.model_class.__container__
+        return {
+            container_id
+            for container_id, in self.session.query(
+                container_class.id,
+            ).filter(
+                container_class.id.in_(container_ids),
+            )
+        }
+
+    def retrieve_most_recent_record(self, **kwargs):
+        """
+        Retrieve the most recent by container id as a lightweight record (see `new_record`).
 
         """
         container_id = kwargs.pop(self.model_class.container_id_name)
-        try:
-            return self._retrieve_most_recent(
+        table = self.model_class.__table__
+        row = self.session.execute(
+            select(
+                table,
+            ).where(
                 self.model_class.container_id == container_id,
-                for_update=True
-            )
-        except OperationalError as exc:
-            if isinstance(exc.orig, psycopg2.errors.LockNotAvailable):
-                raise ContainerLockNotAvailableRetry()
-            raise
+            ).order_by(
+                table.c.clock.desc(),
+            ).limit(1),
+        ).first()
+        return None if row is None else self._make_record(row._mapping)
+
+    def retrieve_by_idempotency_key(self, idempotency_key, record=False):
+        """
+        Retrieve the event created with an idempotency key, with a single (indexed) lookup.
+
+        Requires an event model declared with `__idempotency_key__`.
+
+        :param record: retrieve a lightweight record (see `new_record`)
+        :returns: the event or None
+
+        """
+        criterion = self.model_class.idempotency_key == idempotency_key
+        if not record:
+            return self._query(criterion).first()
+
+        row = self.session.execute(select(self.model_class.__table__).where(criterion)).first()
+        return None if row is None else self._make_record(row._mapping)
+
+    def retrieve_by_idempotency_keys(self, idempotency_keys, record=False):
+        """
+        Retrieve the events created with many idempotency keys with a single query.
+
+        :param record: retrieve lightweight records (see `new_record`)
+        :returns: a dict from idempotency key to event
+
+        """
+        if not idempotency_keys:
+            return {}
+
+        criterion = self.model_class.idempotency_key.in_(idempotency_keys)
+        if not record:
+            return {
+                event.idempotency_key: event
+                for event in self._query(criterion)
+            }
+
+        return {
+            row.idempotency_key: self._make_record(row._mapping)
+            for row in self.session.execute(select(self.model_class.__table__).where(criterion))
+        }
+
+    def is_idempotency_key_conflict(self, error):
+        """
+        Did creating events fail because another event already has one of their idempotency keys?
+
+        :param error: the `DuplicateModelError` raised while flushing
+
+        """
+        diag = getattr(getattr(error.args[0] if error.args else None, "orig", None), "diag", None)
+        # see `EventMeta.make_idempotency_key_indexes`
+        return getattr(diag, "constraint_name", None) == "{}_unique_idempotency_key".format(
+            self.model_class.__tablename__,
+        )
+
+    def retrieve_most_recent_with_update_lock(self, container_lock=None, **kwargs):
+        """
+        Retrieve the most recent by container id, while locking the container.
+
+        By default, takes a ON UPDATE lock with NOWAIT OPTION on the most recent event; stores (or
+        callers) may select another strategy (see `microcosm_eventsource.locking`).
+        If another instance of event is being processed simultaneously, it would raise ContainerLockNotAvailableRetry.
+        This method it to serialize event sourcing, if they are processing the same container instance.
+
+        :param container_lock: override the store's locking strategy
+
+        """
+        container_id = kwargs.pop(self.model_class.container_id_name)
+        return (container_lock or self.container_lock).retrieve_most_recent(self, container_id)
+
+    def new_record(self, **kwargs):
+        """
+        Instantiate (but do not persist) a lightweight event record.
+
+        Records may be passed to `upsert_many_on_index_elements`, `upsert_chain` and `append`
+        in place of model instances; they are inserted with SQLAlchemy Core, updated from the
+        returned row (including defaults such as `state`, `version` and `clock`) and never added
+        to the session.
+
+        """
+        return EventRecord(self.model_class, **kwargs)
 
     def upsert_index_elements(self):
         """
@@ -74,33 +243,435 @@ class EventStore(Store):
         Uses ON CONFLICT ... DO NOTHING to handle uniqueness constraint violations without
         invalidating the current transactions completely.
 
+        Uses RETURNING so that an inserted event need not be re-selected; the existing entry is
+        only looked up (by its index elements) when the insert actually conflicted.
+
         Depends on an unique constraint on index elements to find the resulting entry.
 
         """
-        with self.flushing():
-            insert_statement = insert(self.model_class).values(
-                instance._members(),
+        upserted, = self.upsert_many_on_index_elements([instance])
+        if upserted is None:
+            raise ConcurrentStateConflictError()
+
+        return upserted
+
+    def upsert_many_on_index_elements(self, instances):
+        """
+        Upsert many events by index elements with a single (multi-row) INSERT.
+
+        Uses ON CONFLICT ... DO NOTHING ... RETURNING so that inserted events need not be
+        re-selected; inserted instances become persistent as is. As with `upsert_on_index_elements`,
+        conflicting events resolve to the existing event if it is similar.
+
+        Events without (some of) their index elements (e.g. initial events) cannot conflict
+        and are inserted without ON CONFLICT, so that models without a unique constraint on
+        their index elements can still create them.
+
+        :returns: the resulting events, in order, or None for events that conflict with an
+                  existing event that is not similar
+
+        """
+        if not instances:
+            return []
+
+        inserted = {}
+        upserted = [instance for instance in instances if self._may_conflict(instance)]
+        if upserted:
+            inserted.update(self._insert_many(self._upsert_statement(), upserted))
+        created = [instance for instance in instances if not self._may_conflict(instance)]
+        if created:
+            inserted.update(self._insert_many(insert(self.model_class), created))
+        return [
+            self._make_persistent(instance, inserted[instance.id])
+            if instance.id in inserted
+            else self._retrieve_similar(instance)
+            for instance in instances
+        ]
+
+    def upsert_chain(self, instances):
+        """
+        Upsert a chain of events (each the parent of the next) with a single statement.
+
+        The first event is upserted by index elements; the following events are inserted only
+        if the first event was:
+
+            WITH head AS (
+                INSERT INTO <event> (...) VALUES (...)
+                ON CONFLICT (<index elements>) DO NOTHING
+                RETURNING *
+            ), tail AS (
+                INSERT INTO <event> (...)
+                SELECT ... WHERE EXISTS (SELECT 1 FROM head)
+                UNION ALL ...
+                RETURNING *
             )
-            upsert_statement = insert_statement.on_conflict_do_nothing(
-                index_elements=self.upsert_index_elements(),
+            SELECT * FROM head UNION ALL SELECT * FROM tail
+
+        If the first event conflicts with an existing (similar) event, the rest of the chain
+        follows the existing event instead.
+
+        A first event without (some of) its index elements (e.g. an initial event) is inserted
+        without ON CONFLICT (see `upsert_many_on_index_elements`).
+
+        :returns: the resulting events, in order
+        :raises: ConcurrentStateConflictError if an event conflicts with an existing event that is
+                 not similar
+
+        """
+        instances = list(instances)
+        events = []
+        while instances:
+            inserted = self._insert_chain(instances)
+            if inserted:
+                events.extend(
+                    self._make_persistent(instance, inserted[instance.id])
+                    for instance in instances
+                )
+                break
+
+            existing = self._retrieve_similar(instances[0])
+            if existing is None:
+                raise ConcurrentStateConflictError()
+
+            events.append(existing)
+            instances = instances[1:]
+            if instances:
+                instances[0].parent_id = existing.id
+
+        return events
+
+    def create_with_container(self, container, instances):
+        """
+        Create a container together with its first events with a single statement.
+
+        No event can precede the container's first event, so there is nothing to look up:
+
+            WITH container AS (
+                INSERT INTO <container> (...) VALUES (...) RETURNING *
+            ), event AS (
+                INSERT INTO <event> (...) VALUES (...), ... RETURNING *
             )
-            for member in instance.__dict__.values():
-                if isinstance(member, Model):
-                    self.session.add(member)
+            SELECT container.*, event.* FROM container, event
+
+        A container that spans several tables (joined table inheritance) is inserted with one
+        CTE per table.
+
+        Foreign keys are checked at the end of the statement, so events may refer to the
+        container (and to each other).
 
-            self.session.execute(upsert_statement)
+        :param container: the (new) container instance
+        :param instances: the container's first event, optionally followed by its chain of events
+        :returns: the created container and events, in order
 
-        most_recent = self._retrieve_most_recent(
+        """
+        container_mapper = type(container).__mapper__
+        mapper = self.model_class.__mapper__
+
+        # both inserts would otherwise bind (Python-side) defaults under the same names
+        container_row, = self._insert_rows([container], keys=default_keys(container_mapper), mapper=container_mapper)
+        container_columns = {}
+        for index, table in enumerate(container_mapper.tables):
+            container_cte = insert(table).values({
+                model_column.name: container_row[container_mapper.get_property_by_column(model_column).key]
+                for model_column in table.columns
+                if container_mapper.get_property_by_column(model_column).key in container_row
+            }).returning(
+                *table.columns
+            ).cte("container_{}".format(index))
+            for model_column in table.columns:
+                container_columns[model_column] = container_cte.c[model_column.name].label(
+                    "container_{}_{}".format(index, model_column.name),
+                )
+
+        event_cte = insert(self.model_class).values(
+            self._insert_rows(instances, keys=default_keys(mapper)),
+        ).returning(
+            *mapper.columns
+        ).cte("event")
+
+        statement = select(
+            *container_columns.values(),
             *[
-                getattr(self.model_class, elem) == getattr(instance, elem)
-                for elem in self.upsert_index_elements()
-            ]
+                event_cte.c[model_column.name]
+                for model_column in mapper.columns
+            ],
         )
 
-        if not most_recent.is_similar_to(instance):
-            raise ConcurrentStateConflictError()
+        with self.flushing():
+            rows = self.session.execute(statement).all()
+
+        self._make_persistent(
+            container,
+            {
+                model_column: rows[0]._mapping[label.name]
+                for model_column, label in container_columns.items()
+            },
+            mapper=container_mapper,
+        )
+        inserted = {
+            row._mapping["id"]: {
+                model_column: row._mapping[model_column.name]
+                for model_column in mapper.columns
+            }
+            for row in rows
+        }
+        return container, [
+            self._make_persistent(instance, inserted[instance.id])
+            for instance in instances
+        ]
+
+    def append(self, instance, legal_transitions, restarting=False):
+        """
+        Append an event after the most recent event of its container with a single statement.
+
+        The most recent event is resolved inside Postgres; the instance's `parent_id`, `state`
+        and (unless set) `version` are computed from it using the given legal transitions:
+
+            WITH head AS (
+                SELECT id, state, version FROM <event> WHERE <container_id> = ... ORDER BY clock DESC LIMIT 1
+            )
+            INSERT INTO <event> (...)
+            SELECT ..., head.id, transition.next_state, <version>
+              FROM (VALUES ...) AS transition (state, next_state)
+              LEFT OUTER JOIN head ON true
+             WHERE coalesce(head.state, '{}') @> transition.state
+               AND coalesce(head.state, '{}') <@ transition.state
+            ON CONFLICT (<index elements>) DO NOTHING
+            RETURNING *
+
+        A container without events has the empty state. Every legal transition is inlined into
+        the statement, and transitions are not otherwise validated (see
+        `EventFactory.appendable_transitions`).
+
+        :param legal_transitions: the (state, next state) pairs of the event's type
+        :param restarting: whether the event's type restarts a new version
+        :returns: the appended event or None if no legal transition applies (or on conflict)
+
+        """
+        if not legal_transitions:
+            return None
+
+        table = self.model_class.__table__
+        mapper = self.model_class.__mapper__
+        state_type = table.c.state.type
+
+        head = select(
+            table.c.id,
+            table.c.state,
+            table.c.version,
+        ).where(
+            self.model_class.container_id == instance.container_id,
+        ).order_by(
+            table.c.clock.desc(),
+        ).limit(1).cte("head")
+
+        transition = values(
+            column("state", state_type),
+            column("next_state", state_type),
+            name="transition",
+        ).data([
+            (list(state), list(next_state))
+            for state, next_state in legal_transitions
+        ])
+
+        head_state = func.coalesce(head.c.state, cast(literal([], state_type), state_type))
+        transition_state = cast(transition.c.state, state_type)
+        if instance.version is not None:
+            version = literal(instance.version)
+        elif restarting:
+            version = func.coalesce(head.c.version + 1, 1)
+        else:
+            version = func.coalesce(head.c.version, 1)
+
+        members = {
+            mapper.columns[key].name: literal(value, mapper.columns[key].type)
+            for key, value in instance._members().items()
+            if key not in ("parent_id", "state", "version")
+        }
+        members.update(
+            parent_id=head.c.id,
+            state=cast(transition.c.next_state, state_type),
+            version=version,
+        )
+
+        statement = insert(self.model_class).from_select(
+            list(members),
+            select(
+                *members.values()
+            ).select_from(
+                transition.outerjoin(head, true()),
+            ).where(
+                head_state.contains(transition_state),
+                head_state.contained_by(transition_state),
+            ),
+        ).on_conflict_do_nothing(
+            index_elements=self.upsert_index_elements(),
+        ).returning(
+            *mapper.columns
+        )
+
+        with self.flushing():
+            row = self.session.execute(statement).first()
+
+        if row is None:
+            return None
+        return self._make_persistent(instance, row._mapping)
+
+    def _insert_many(self, insert_statement, instances):
+        """
+        Execute a multi-row INSERT for many instances.
 
-        return most_recent
+        :returns: a dict from the ids of inserted instances to their returned rows
+
+        """
+        statement = insert_statement.values(
+            self._insert_rows(instances),
+        ).returning(
+            *self.model_class.__mapper__.columns
+        )
+
+        with self.flushing():
+            for instance in instances:
+                for member in instance.__dict__.values():
+                    if isinstance(member, Model):
+                        self.session.add(member)
+
+            return {
+                row._mapping["id"]: row._mapping
+                for row in self.session.execute(statement)
+            }
+
+    def _insert_chain(self, instances):
+        """
+        Execute the (single) statement that upserts a chain of events.
+
+        :returns: a dict from the ids of inserted instances to their returned rows; empty if
+                  the first instance conflicted
+
+        """
+        head_statement = self._upsert_statement() if self._may_conflict(instances[0]) else insert(self.model_class)
+        if len(instances) == 1:
+            return self._insert_many(head_statement, instances)
+
+        mapper = self.model_class.__mapper__
+        # both inserts would otherwise bind (Python-side) defaults under the same names
+        rows = self._insert_rows(instances, keys=default_keys(mapper))
+        keys = list(rows[0])
+
+        head = head_statement.values(
+            rows[0],
+        ).returning(
+            *mapper.columns
+        ).cte("head")
+
+        # every value is cast so that the types of the union are not inferred from literals
+        tail = insert(self.model_class).from_select(
+            [mapper.columns[key].name for key in keys],
+            union_all(*[
+                select(*[
+                    cast(literal(row[key], mapper.columns[key].type), mapper.columns[key].type)
+                    for key in keys
+                ]).where(
+                    exists(select(head.c.id)),
+                )
+                for row in rows[1:]
+            ]),
+        ).returning(
+            *mapper.columns
+        ).cte("tail")
+
+        statement = select(head).union_all(select(tail))
+
+        with self.flushing():
+            for instance in instances:
+                for member in instance.__dict__.values():
+                    if isinstance(member, Model):
+                        self.session.add(member)
+
+            return {
+                row._mapping["id"]: {
+                    model_column: row._mapping[model_column.name]
+                    for model_column in mapper.columns
+                }
+                for row in self.session.execute(statement)
+            }
+
+    def _upsert_statement(self):
+        return insert(self.model_class).on_conflict_do_nothing(
+            index_elements=self.upsert_index_elements(),
+        )
+
+    def _may_conflict(self, instance):
+        """
+        Can an instance conflict on the index elements? (NULLs never conflict.)
+
+        """
+        return all(
+            getattr(instance, elem, None) is not None
+            for elem in self.upsert_index_elements()
+        )
+
+    def _make_persistent(self, instance, row, mapper=None):
+        """
+        Make an inserted instance persistent using its returned row.
+
+        Records are updated from the row but are not added to the session.
+
+        """
+        mapper = mapper or self.model_class.__mapper__
+        for model_column in mapper.columns:
+            setattr(instance, mapper.get_property_by_column(model_column).key, row[model_column])
+        if isinstance(instance, EventRecord):
+            return instance
+        make_transient_to_detached(instance)
+        self.session.add(instance)
+        return instance
+
+    def _make_record(self, row):
+        return self._make_persistent(self.new_record(), row)
+
+    def _insert_rows(self, instances, keys=(), mapper=None):
+        """
+        Generate the rows of a multi-row INSERT.
+
+        Every row must bind the same columns (including the given keys), so missing values are
+        replaced with the column's (Python-side) default, if any.
+
+        """
+        mapper = mapper or self.model_class.__mapper__
+        rows = [instance._members() for instance in instances]
+        keys = set(keys).union(*rows)
+        for row in rows:
+            for key in keys - row.keys():
+                default = mapper.columns[key].default
+                if default is None:
+                    row[key] = None
+                elif default.is_callable:
+                    row[key] = default.arg(RowContext(row))
+                else:
+                    row[key] = default.arg
+        return rows
+
+    def _retrieve_similar(self, instance):
+        """
+        Retrieve the existing event that an upserted event conflicted with, if it is similar.
+
+        """
+        criterion = [
+            getattr(self.model_class, elem) == getattr(instance, elem)
+            for elem in self.upsert_index_elements()
+        ]
+        # the index elements are unique, so there is no need to order by clock
+        if isinstance(instance, EventRecord):
+            row = self.session.execute(
+                select(self.model_class.__table__).where(*criterion),
+            ).first()
+            existing = None if row is None else self._make_record(row._mapping)
+        else:
+            existing = self._query(*criterion).first()
+        if existing is None or not existing.is_similar_to(instance):
+            return None
+        return existing
 
     def _filter(self,
                 query,
@@ -110,10 +681,13 @@ class EventStore(Store):
                 max_clock=None,
                 parent_id=None,
                 version=None,
+                may_transition_to=None,
                 **kwargs):
         """
         Filter events by standard criteria.
 
+        :param may_transition_to: an event type that must be able to follow the event's state
+
         """
         container_id = kwargs.pop(self.model_class.container_id_name, None)
         if container_id is not None:
@@ -130,6 +704,8 @@ class EventStore(Store):
             query = query.filter(self.model_class.parent_id == parent_id)
         if version is not None:
             query = query.filter(self.model_class.version == version)
+        if may_transition_to is not None:
+            query = query.filter(may_transition_to.may_transition_expression(self.model_class.state))
 
         return super(EventStore, self)._filter(query, **kwargs)
 
@@ -0,0 +1,41 @@
+"""
+Outbox store.
+
+"""
+from microcosm_postgres.store import Store
+from sqlalchemy import delete, insert, select
+
+
+class OutboxStore(Store):
+    """
+    Outbox persistence operations.
+
+    """
+    def enqueue_many(self, messages):
+        """
+        Write messages to the outbox (in the current transaction) with a single INSERT.
+
+        :param messages: dicts of the media type and uri of each message, in order
+
+        """
+        if not messages:
+            return
+        self.session.execute(insert(self.model_class.__table__), messages)
+
+    def take_batch(self, limit):
+        """
+        Remove the oldest (committed) messages from the outbox with a single statement and return them.
+
+        Messages locked by other transactions (e.g. other relays) are skipped, and messages of
+        transactions that have yet to commit are not seen, even if they have lower ids. If the
+        transaction rolls back, the messages remain in the outbox.
+
+        :returns: the messages, in id order
+
+        """
+        table = self.model_class.__table__
+        batch = select(table.c.id).order_by(table.c.id).limit(limit).with_for_update(skip_locked=True)
+        rows = self.session.execute(
+            delete(table).where(table.c.id.in_(batch)).returning(*table.c),
+        ).all()
+        return sorted(rows, key=lambda row: row.id)
@@ -280,16 +280,21 @@ class RollUpStore:
 
         return query
 
-    def _filter(self, query, aggregate, **kwargs):
+    def _filter(self, query, aggregate, may_transition_to=None, **kwargs):
         """
         Filter by aggregates.
 
         By default, selects only events with the top rank (e.g. most recent clock).
 
+        :param may_transition_to: an event type that must be able to follow the most recent state
+
         """
-        return query.filter(
+        query = query.filter(
             aggregate["rank"] == 1,
         )
+        if may_transition_to is not None:
+            query = query.filter(may_transition_to.may_transition_expression(self.event_type.state))
+        return query
 
     def _to_model(self, aggregate, event, container, *args):
         keys = aggregate.keys()
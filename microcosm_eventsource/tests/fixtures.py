@@ -25,10 +25,10 @@ from microcosm_eventsource.accumulation import alias, keep, union
 from microcosm_eventsource.controllers import EventController
 from microcosm_eventsource.event_types import EventType, EventTypeUnion, event_info
 from microcosm_eventsource.factory import EventFactory
-from microcosm_eventsource.models import EventMeta
+from microcosm_eventsource.models import EventMeta, OutboxMessageMixin
 from microcosm_eventsource.resources import EventSchema, SearchEventSchema
 from microcosm_eventsource.routes import configure_event_crud
-from microcosm_eventsource.stores import EventStore
+from microcosm_eventsource.stores import EventStore, OutboxStore
 from microcosm_eventsource.transitioning import (
     all_of,
     any_of,
@@ -93,6 +93,17 @@ class FlexibleTaskEventType(EventType):
     )
 
 
+class CustomEventType(EventType):
+    # Used to test (compiling) plain callables and nested transitions
+    CREATED = event_info()
+    UPDATED = event_info(
+        follows=lambda cls, state: len(state) == 1,
+    )
+    CLOSED = event_info(
+        follows=all_of(any_of("CREATED", nothing()), but_not(any_of("CLOSED", "UPDATED"))),
+    )
+
+
 class BasicTaskEventType(EventType):
     CREATED = event_info(
         follows=nothing(),
@@ -176,6 +187,7 @@ class TaskEvent(UnixTimestampEntityMixin, metaclass=EventMeta):
     __tablename__ = "task_event"
     __eventtype__ = TaskEventType
     __container__ = Task
+    __idempotency_key__ = True
 
     assignee = Column(String)
     deadline = Column(DateTime)
@@ -220,6 +232,17 @@ class TaskEventStore(EventStore):
         super(TaskEventStore, self).__init__(graph, TaskEvent)
 
 
+class TaskOutboxMessage(OutboxMessageMixin, Model):
+    __tablename__ = "task_outbox"
+
+
+@binding("task_outbox_store")
+class TaskOutboxStore(OutboxStore):
+
+    def __init__(self, graph):
+        super(TaskOutboxStore, self).__init__(graph, TaskOutboxMessage)
+
+
 @binding("sub_task_event_store")
 class SubTaskEventStore(EventStore):
 
@@ -12,7 +12,9 @@ from hamcrest import (
     calling,
     contains,
     contains_inanyorder,
+    empty,
     equal_to,
+    has_properties,
     is_,
     none,
     not_none,
@@ -21,6 +23,9 @@ from hamcrest import (
 from microcosm.api import create_object_graph
 from microcosm_postgres.context import SessionContext, transaction
 from microcosm_postgres.errors import DuplicateModelError, ModelIntegrityError
+from microcosm_postgres.types import EnumType
+from sqlalchemy import literal, select
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Query
 from sqlalchemy.sql.schema import Sequence
@@ -29,10 +34,13 @@ from microcosm_eventsource.errors import (
     ConcurrentStateConflictError,
     ContainerLockNotAvailableRetry,
 )
+from microcosm_eventsource.states import State
 from microcosm_eventsource.tests.fixtures import (
     Activity,
     ActivityEvent,
     ActivityEventType,
+    CustomEventType,
+    FlexibleTaskEventType,
     Task,
     TaskEvent,
     TaskEventType,
@@ -137,6 +145,69 @@ class TestEventStore:
             contains_inanyorder(TaskEventType.ASSIGNED, TaskEventType.CREATED),
         )
 
+    def test_state_value(self):
+        """
+        A `State` may be persisted as is.
+
+        """
+        with transaction():
+            task_event = TaskEvent(
+                event_type=TaskEventType.CREATED,
+                state=State([TaskEventType.CREATED, TaskEventType.ASSIGNED]),
+                task_id=self.task.id,
+            )
+            self.store.create(task_event)
+
+        SessionContext.session.expire(task_event)
+        assert_that(
+            self.store.retrieve(task_event.id).state,
+            contains(TaskEventType.ASSIGNED, TaskEventType.CREATED),
+        )
+
+    def test_may_transition_expression(self):
+        """
+        SQL transition expressions agree with (compiled) transitions for every reachable state.
+
+        """
+        for event_type_cls in (TaskEventType, FlexibleTaskEventType, CustomEventType):
+            states = [State()] + list(event_type_cls.all_states())
+            for event_type in event_type_cls:
+                expressions = [
+                    event_type.may_transition_expression(literal(list(state), ARRAY(EnumType(event_type_cls))))
+                    for state in states
+                ]
+                assert_that(
+                    list(SessionContext.session.execute(select(expressions)).one()),
+                    is_(equal_to([event_type.may_transition(state) for state in states])),
+                )
+
+    def test_search_may_transition_to(self):
+        with transaction():
+            created_event = self.store.create(TaskEvent(
+                event_type=TaskEventType.CREATED,
+                task_id=self.task.id,
+            ))
+            assigned_event = self.store.create(TaskEvent(
+                assignee="Alice",
+                event_type=TaskEventType.ASSIGNED,
+                parent_id=created_event.id,
+                state=(TaskEventType.CREATED, TaskEventType.ASSIGNED),
+                task_id=self.task.id,
+            ))
+
+        assert_that(
+            self.store.search(may_transition_to=TaskEventType.SCHEDULED),
+            contains(assigned_event, created_event),
+        )
+        assert_that(
+            self.store.search(may_transition_to=TaskEventType.ASSIGNED),
+            contains(created_event),
+        )
+        assert_that(
+            self.store.search(may_transition_to=TaskEventType.STARTED),
+            contains(),
+        )
+
     def test_retrieve_most_recent(self):
         """
         The logical clock provides a total ordering on the main foreign key.
@@ -245,6 +316,78 @@ class TestEventStore:
             raises(ConcurrentStateConflictError),
         )
 
+    def test_upsert_chain_records(self):
+        """
+        Records are inserted with the event model's defaults and are not added to the session.
+
+        """
+        created_event_id = self.store.new_object_id()
+        with transaction():
+            created_event, assigned_event = self.store.upsert_chain([
+                self.store.new_record(
+                    id=created_event_id,
+                    event_type=TaskEventType.CREATED,
+                    task_id=self.task.id,
+                ),
+                self.store.new_record(
+                    id=self.store.new_object_id(),
+                    event_type=TaskEventType.ASSIGNED,
+                    parent_id=created_event_id,
+                    state=[TaskEventType.ASSIGNED, TaskEventType.CREATED],
+                    task_id=self.task.id,
+                    assignee="Alice",
+                ),
+            ])
+            assert_that(
+                [event for event in self.context.session.identity_map.values() if isinstance(event, TaskEvent)],
+                is_(empty()),
+            )
+
+        assert_that(created_event, has_properties(
+            clock=is_(equal_to(self.offset + 1)),
+            parent_id=none(),
+            state=contains(TaskEventType.CREATED),
+            version=1,
+        ))
+        assert_that(assigned_event, has_properties(
+            clock=is_(equal_to(self.offset + 2)),
+            parent_id=created_event.id,
+            version=1,
+        ))
+
+        with transaction():
+            assert_that(
+                self.store.retrieve_most_recent_record(task_id=self.task.id),
+                is_(equal_to(assigned_event)),
+            )
+
+    def test_retrieve_by_idempotency_key(self):
+        with transaction():
+            created_event = self.store.create(TaskEvent(
+                event_type=TaskEventType.CREATED,
+                task_id=self.task.id,
+            ))
+            assigned_event = self.store.create(TaskEvent(
+                event_type=TaskEventType.ASSIGNED,
+                assignee="Alice",
+                parent_id=created_event.id,
+                task_id=self.task.id,
+                idempotency_key="assign-alice",
+            ))
+
+            assert_that(
+                self.store.retrieve_by_idempotency_key("assign-alice"),
+                is_(equal_to(assigned_event)),
+            )
+            assert_that(
+                self.store.retrieve_by_idempotency_key("assign-alice", record=True),
+                has_properties(
+                    id=assigned_event.id,
+                    idempotency_key="assign-alice",
+                ),
+            )
+            assert_that(self.store.retrieve_by_idempotency_key("assign-bob"), is_(none()))
+
     def test_multiple_children_per_parent(self):
         """
         Events are not unique per parent for False unique_parent events.
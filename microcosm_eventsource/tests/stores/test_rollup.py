@@ -156,6 +156,31 @@ class TestRolledUpEventStore:
             ),
         ))
 
+    def test_filter_may_transition_to(self):
+        """
+        Containers can be filtered by the transitions that their most recent state allows.
+
+        """
+        assert_that(
+            self.store.search(may_transition_to=TaskEventType.SCHEDULED),
+            contains(
+                has_properties(
+                    _event=self.task1_created_event,
+                    _container=self.task1,
+                ),
+            ),
+        )
+        assert_that(
+            self.store.search(may_transition_to=TaskEventType.CANCELED),
+            contains(
+                has_properties(
+                    _event=self.task2_started_event,
+                    _container=self.task2,
+                ),
+            ),
+        )
+        assert_that(self.store.search(may_transition_to=TaskEventType.CREATED), has_length(0))
+
     def test_exact_count(self):
         count = self.store.count(asignee="Alice")
         exact_count = self.store.exact_count(asignee="Alice")
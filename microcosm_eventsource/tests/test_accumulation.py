@@ -130,3 +130,18 @@ def test_compose():
         )(state, TaskEventType.COMPLETED),
         contains(TaskEventType.COMPLETED, TaskEventType.REASSIGNED),
     )
+
+
+def test_compose_custom():
+    def checked(state, event_type):
+        state.add(event_type)
+        state.discard(TaskEventType.STARTED)
+        return state
+
+    assert_that(
+        compose(
+            checked,
+            addition("REASSIGNED"),
+        )({TaskEventType.STARTED}, TaskEventType.COMPLETED),
+        contains(TaskEventType.COMPLETED, TaskEventType.REASSIGNED),
+    )
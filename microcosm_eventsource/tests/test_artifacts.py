@@ -0,0 +1,179 @@
+"""
+Test state machine artifacts.
+
+"""
+from functools import partial
+from os import stat
+from os.path import exists
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from hamcrest import (
+    assert_that,
+    calling,
+    equal_to,
+    is_,
+    none,
+    not_none,
+    raises,
+)
+
+from microcosm_eventsource.accumulation import union
+from microcosm_eventsource.artifacts import (
+    artifact_path,
+    definition_hash,
+    describe,
+    load_artifact,
+    open_artifact,
+)
+from microcosm_eventsource.compiling import CompiledStateMachine
+from microcosm_eventsource.event_types import EventType, event_info
+from microcosm_eventsource.tests.fixtures import FlexibleTaskEventType, TaskEventType
+from microcosm_eventsource.transitioning import event
+
+
+class OrderEventType(EventType):
+    CREATED = event_info()
+    PAID = event_info(
+        follows=event("CREATED"),
+        accumulate=union(),
+    )
+    SHIPPED = event_info(
+        follows=event("PAID"),
+        auto_transition=True,
+    )
+
+
+class ChangedOrderEventType(EventType):
+    CREATED = event_info()
+    PAID = event_info(
+        follows=event("CREATED"),
+    )
+    SHIPPED = event_info(
+        follows=event("PAID"),
+        auto_transition=True,
+    )
+
+
+def test_definition_hash():
+    assert_that(definition_hash(TaskEventType), is_(equal_to(definition_hash(TaskEventType))))
+    assert_that(definition_hash(TaskEventType), is_(not_none()))
+    assert_that(definition_hash(OrderEventType) == definition_hash(ChangedOrderEventType), is_(equal_to(False)))
+    assert_that(definition_hash(TaskEventType) == definition_hash(FlexibleTaskEventType), is_(equal_to(False)))
+
+
+class Slotted:
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+
+def add(left, right):
+    return left + right
+
+
+def test_describe():
+    assert_that(describe(partial(add, right=1)), is_(equal_to(describe(partial(add, right=1)))))
+    assert_that(describe(partial(add, right=1)) == describe(partial(add, right=2)), is_(equal_to(False)))
+    assert_that(describe(Slotted("foo")), is_(equal_to(describe(Slotted("foo")))))
+    assert_that(describe(Slotted("foo")) == describe(Slotted("bar")), is_(equal_to(False)))
+    assert_that(calling(describe).with_args(object()), raises(ValueError))
+
+
+def test_load_artifact():
+    """
+    A loaded state machine agrees with an enumerated one.
+
+    """
+    expected = CompiledStateMachine(TaskEventType)
+    state_machine = CompiledStateMachine(TaskEventType)
+
+    with TemporaryDirectory() as directory:
+        state_machine.load(load_artifact(state_machine, directory))
+        assert_that(exists(artifact_path(TaskEventType, directory)))
+
+        assert_that(state_machine.states, is_(equal_to(expected.states)))
+        assert_that(dict(state_machine.table), is_(equal_to(expected.table)))
+        assert_that(
+            state_machine.transition_matrix.tolist(),
+            is_(equal_to(expected.transition_matrix.tolist())),
+        )
+        assert_that(
+            list(state_machine.state_graph().iter_allowed_codes()),
+            is_(equal_to(list(expected.state_graph().iter_allowed_codes()))),
+        )
+        assert_that(
+            [state_machine.auto_transition(mask) for mask in expected.table],
+            is_(equal_to([
+                TaskEventType.ENDED if mask == expected.encode({TaskEventType.COMPLETED}) else None
+                for mask in expected.table
+            ])),
+        )
+
+
+def test_reuse_artifact():
+    state_machine = CompiledStateMachine(OrderEventType)
+
+    with TemporaryDirectory() as directory:
+        load_artifact(state_machine, directory)
+        modified = stat(artifact_path(OrderEventType, directory)).st_mtime_ns
+
+        load_artifact(CompiledStateMachine(OrderEventType), directory)
+        assert_that(stat(artifact_path(OrderEventType, directory)).st_mtime_ns, is_(equal_to(modified)))
+
+
+def test_rebuild_stale_artifact():
+    """
+    An artifact for another definition (or a corrupt artifact) is rebuilt.
+
+    """
+    with TemporaryDirectory() as directory:
+        path = artifact_path(OrderEventType, directory)
+        with open(path, "wb") as outfile:
+            outfile.write(b"corrupt")
+        assert_that(open_artifact(OrderEventType, path), is_(none()))
+
+        load_artifact(CompiledStateMachine(ChangedOrderEventType), directory)
+        with open(artifact_path(ChangedOrderEventType, directory), "rb") as infile:
+            data = infile.read()
+        with open(path, "wb") as outfile:
+            outfile.write(data)
+        assert_that(open_artifact(OrderEventType, path), is_(none()))
+
+        state_machine = CompiledStateMachine(OrderEventType)
+        state_machine.load(load_artifact(state_machine, directory))
+        assert_that(open_artifact(OrderEventType, path), is_(not_none()))
+        assert_that(
+            state_machine.next_state(OrderEventType.PAID, state_machine.encode({OrderEventType.CREATED})),
+            is_(equal_to({OrderEventType.CREATED, OrderEventType.PAID})),
+        )
+        assert_that(
+            OrderEventType.auto_transition_event({OrderEventType.CREATED, OrderEventType.PAID}),
+            is_(equal_to(OrderEventType.SHIPPED)),
+        )
+
+
+def test_lookup_missing_state():
+    state_machine = CompiledStateMachine(OrderEventType)
+
+    with TemporaryDirectory() as directory:
+        state_machine.load(load_artifact(state_machine, directory))
+        missing = state_machine.encode({OrderEventType.PAID})
+        assert_that(state_machine.table.get(missing), is_(none()))
+        assert_that(calling(state_machine.table.__getitem__).with_args(missing), raises(KeyError))
+
+
+def test_load_state_machine_without_artifact():
+    """
+    States are compiled on demand if the artifact cannot be opened.
+
+    """
+    with TemporaryDirectory() as directory:
+        with patch("microcosm_eventsource.artifacts.open_artifact", return_value=None):
+            state_machine = OrderEventType.load_state_machine(directory)
+
+    assert_that(
+        state_machine.next_state(OrderEventType.PAID, state_machine.encode({OrderEventType.CREATED})),
+        is_(equal_to({OrderEventType.CREATED, OrderEventType.PAID})),
+    )
@@ -0,0 +1,259 @@
+"""
+Test in-process write coalescing.
+
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from os.path import dirname
+from time import monotonic, sleep
+from unittest.mock import patch
+
+from hamcrest import (
+    assert_that,
+    calling,
+    contains,
+    equal_to,
+    has_properties,
+    is_,
+    raises,
+)
+from microcosm.api import create_object_graph
+from microcosm_postgres.context import SessionContext, transaction
+from microcosm_postgres.operations import new_session
+from sqlalchemy import inspect
+from sqlalchemy.orm import scoped_session
+
+from microcosm_eventsource import coalescing
+from microcosm_eventsource.coalescing import CreateCoalescer, GroupCommitBuffer, apply_creates
+from microcosm_eventsource.errors import IllegalStateTransitionError
+from microcosm_eventsource.factory import EventFactory
+from microcosm_eventsource.tests.fixtures import Task, TaskEvent, TaskEventType
+
+
+class TestCoalescing:
+
+    def setup(self):
+        self.graph = create_object_graph(
+            "microcosm_eventsource",
+            root_path=dirname(__file__),
+            testing=True,
+        )
+        self.graph.use(
+            "task_store",
+            "task_event_store",
+        )
+        self.store = self.graph.task_event_store
+        self.factory = EventFactory(
+            event_store=self.store,
+            publish_event_pubsub=False,
+        )
+
+        self.context = SessionContext(self.graph)
+        self.context.recreate_all()
+        self.context.open()
+
+        with transaction():
+            self.task = Task().create()
+            self.created_event = TaskEvent(
+                event_type=TaskEventType.CREATED,
+                task_id=self.task.id,
+            ).create()
+
+    def teardown(self):
+        self.context.close()
+        self.graph.postgres.dispose()
+
+    def wait_for_lane(self, coalescer, size):
+        while len(coalescer.lanes.get(self.task.id, ())) < size:
+            sleep(0.001)
+
+    def test_coalesce(self):
+        """
+        Creates that arrive while a lane is applied are applied together, in order.
+
+        """
+        coalescer = CreateCoalescer(self.factory)
+        create = self.factory.create
+
+        def gated_create(*args, **kwargs):
+            # hold the first create until the others are queued behind it
+            if kwargs.get("assignee"):
+                self.wait_for_lane(coalescer, 2)
+            return create(*args, **kwargs)
+
+        with patch.object(self.factory, "create", side_effect=gated_create), \
+                patch.object(coalescing, "apply_creates", wraps=apply_creates) as mocked_apply_creates, \
+                ThreadPoolExecutor(max_workers=3) as executor:
+            assigned = executor.submit(
+                coalescer.create, None, None, TaskEventType.ASSIGNED, task_id=self.task.id, assignee="Alice",
+            )
+            while not coalescer.lanes:
+                sleep(0.001)
+            scheduled = executor.submit(
+                coalescer.create, None, None, TaskEventType.SCHEDULED, task_id=self.task.id, deadline=datetime.utcnow(),
+            )
+            self.wait_for_lane(coalescer, 1)
+            started = executor.submit(
+                coalescer.create, None, None, TaskEventType.STARTED, task_id=self.task.id,
+            )
+
+            assigned_event = assigned.result(timeout=10)
+            scheduled_event = scheduled.result(timeout=10)
+            started_event = started.result(timeout=10)
+
+        assert_that(assigned_event.parent_id, is_(equal_to(self.created_event.id)))
+        assert_that(scheduled_event.parent_id, is_(equal_to(assigned_event.id)))
+        assert_that(started_event.parent_id, is_(equal_to(scheduled_event.id)))
+        assert_that(
+            [len(call[0][1]) for call in mocked_apply_creates.call_args_list],
+            contains(1, 2),
+        )
+        assert_that(coalescer.lanes, is_(equal_to({})))
+
+    def test_coalesce_interrupted(self):
+        """
+        An interrupted lane is removed and its creates fail.
+
+        """
+        coalescer = CreateCoalescer(self.factory)
+
+        with patch.object(coalescing, "apply_creates", side_effect=KeyboardInterrupt):
+            assert_that(
+                calling(coalescer.submit).with_args(
+                    None, None, TaskEventType.ASSIGNED, task_id=self.task.id, assignee="Alice",
+                ),
+                raises(KeyboardInterrupt),
+            )
+        assert_that(coalescer.lanes, is_(equal_to({})))
+
+        assigned_event = coalescer.create(None, None, TaskEventType.ASSIGNED, task_id=self.task.id, assignee="Alice")
+        assert_that(assigned_event.parent_id, is_(equal_to(self.created_event.id)))
+
+    def test_coalesce_thread_local_sessions(self):
+        """
+        With thread-local sessions, lanes are applied without the apply lock and events are detached.
+
+        """
+        coalescer = CreateCoalescer(self.factory)
+        with transaction():
+            other_task = Task().create()
+
+        shared_session = SessionContext.session
+        SessionContext.session = scoped_session(partial(new_session, self.graph))
+        try:
+            with patch.object(coalescer, "apply_lock") as apply_lock, \
+                    ThreadPoolExecutor(max_workers=2) as executor:
+                assigned = executor.submit(
+                    coalescer.create, None, None, TaskEventType.ASSIGNED, task_id=self.task.id, assignee="Alice",
+                )
+                created = executor.submit(
+                    coalescer.create, None, None, TaskEventType.CREATED, task_id=other_task.id,
+                )
+                assigned_event = assigned.result(timeout=10)
+                created_event = created.result(timeout=10)
+        finally:
+            SessionContext.session.remove()
+            SessionContext.session = shared_session
+
+        assert_that(apply_lock.__enter__.call_count, is_(equal_to(0)))
+        assert_that(assigned_event.parent_id, is_(equal_to(self.created_event.id)))
+        assert_that(inspect(assigned_event).detached, is_(equal_to(True)))
+        assert_that(inspect(created_event).detached, is_(equal_to(True)))
+
+    def test_apply_creates_isolates_failures(self):
+        """
+        A failing create does not fail the other creates of the same transaction.
+
+        """
+        items = [
+            (Future(), (None, None, TaskEventType.ASSIGNED), dict(task_id=self.task.id, assignee="Alice")),
+            (Future(), (None, None, TaskEventType.STARTED), dict(task_id=self.task.id)),
+            (Future(), (None, None, TaskEventType.SCHEDULED), dict(task_id=self.task.id, deadline=datetime.utcnow())),
+        ]
+        apply_creates(self.factory, items)
+        assigned, started, scheduled = [future for future, _, _ in items]
+
+        assert_that(
+            calling(started.result),
+            raises(IllegalStateTransitionError),
+        )
+        assert_that(scheduled.result(), has_properties(
+            parent_id=assigned.result().id,
+        ))
+
+        with transaction():
+            assert_that(
+                self.store.retrieve_most_recent(task_id=self.task.id),
+                is_(equal_to(scheduled.result())),
+            )
+
+    def test_group_commit(self):
+        """
+        A full group is applied in one transaction.
+
+        """
+        buffer = GroupCommitBuffer(self.factory, max_items=3, max_delay=10)
+        with transaction():
+            tasks = [Task().create() for _ in range(3)]
+
+        with patch.object(coalescing, "apply_creates", wraps=apply_creates) as mocked_apply_creates, \
+                ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [
+                executor.submit(buffer.create, None, None, TaskEventType.CREATED, task_id=task.id)
+                for task in tasks
+            ]
+            events = [future.result(timeout=10) for future in futures]
+
+        assert_that(mocked_apply_creates.call_count, is_(equal_to(1)))
+        assert_that(
+            [event.task_id for event in events],
+            is_(equal_to([task.id for task in tasks])),
+        )
+        assert_that(buffer.items, is_(equal_to([])))
+
+    def test_group_commit_delay(self):
+        """
+        A group that does not fill up is applied after its delay.
+
+        """
+        buffer = GroupCommitBuffer(self.factory, max_items=100, max_delay=0.01)
+
+        event = buffer.create(None, None, TaskEventType.ASSIGNED, task_id=self.task.id, assignee="Alice")
+
+        assert_that(event, has_properties(
+            parent_id=self.created_event.id,
+        ))
+
+    def test_group_commit_interrupted(self):
+        """
+        An interrupted group is cleared and its creates fail.
+
+        """
+        buffer = GroupCommitBuffer(self.factory, max_items=100, max_delay=0)
+        future = Future()
+        buffer.items.append((future, (None, None, TaskEventType.ASSIGNED), dict(task_id=self.task.id, assignee="Bob")))
+
+        with patch.object(coalescing, "apply_creates", side_effect=KeyboardInterrupt):
+            assert_that(calling(buffer.flush), raises(KeyboardInterrupt))
+
+        assert_that(buffer.items, is_(equal_to([])))
+        assert_that(calling(future.result), raises(KeyboardInterrupt))
+
+        event = buffer.create(None, None, TaskEventType.ASSIGNED, task_id=self.task.id, assignee="Alice")
+        assert_that(event.parent_id, is_(equal_to(self.created_event.id)))
+
+    def test_group_commit_wait_interrupted(self):
+        """
+        A group whose starter is interrupted while waiting is cleared and its creates fail.
+
+        """
+        buffer = GroupCommitBuffer(self.factory, max_items=100, max_delay=10)
+        future = Future()
+        buffer.items.append((future, (None, None, TaskEventType.ASSIGNED), dict(task_id=self.task.id, assignee="Bob")))
+
+        with patch.object(buffer.condition, "wait", side_effect=KeyboardInterrupt):
+            assert_that(calling(buffer.flush).with_args(deadline=monotonic() + 10), raises(KeyboardInterrupt))
+
+        assert_that(buffer.items, is_(equal_to([])))
+        assert_that(calling(future.result), raises(KeyboardInterrupt))
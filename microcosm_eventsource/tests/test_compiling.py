@@ -0,0 +1,207 @@
+"""
+Test compiled state machines.
+
+"""
+from itertools import combinations
+from unittest.mock import patch
+
+from hamcrest import (
+    assert_that,
+    calling,
+    contains,
+    contains_inanyorder,
+    equal_to,
+    has_length,
+    instance_of,
+    is_,
+    none,
+    raises,
+)
+
+from microcosm_eventsource.compiling import CompiledStateMachine
+from microcosm_eventsource.errors import IllegalInitialStateError, IllegalStateTransitionError
+from microcosm_eventsource.tests.fixtures import CustomEventType, FlexibleTaskEventType, TaskEventType
+
+
+def iter_subsets(event_type_cls):
+    members = list(event_type_cls)
+    for size in range(len(members) + 1):
+        for subset in combinations(members, size):
+            yield set(subset)
+
+
+def test_bits():
+    assert_that(
+        [event_type.bit for event_type in TaskEventType],
+        is_(equal_to([1 << index for index in range(len(TaskEventType))])),
+    )
+
+
+def test_encode_decode():
+    state = {TaskEventType.CREATED, TaskEventType.ASSIGNED}
+    mask = TaskEventType.encode_state(state)
+
+    assert_that(mask, is_(equal_to(TaskEventType.CREATED.bit | TaskEventType.ASSIGNED.bit)))
+    assert_that(TaskEventType.decode_state(mask), is_(equal_to(state)))
+
+
+def test_compiled_matches_interpreted():
+    """
+    Compiled predicates give the same answers as the transition tree for every state.
+
+    """
+    for event_type_cls in (TaskEventType, FlexibleTaskEventType, CustomEventType):
+        for state in iter_subsets(event_type_cls):
+            for event_type in event_type_cls:
+                assert_that(
+                    event_type.may_transition(state),
+                    is_(equal_to(event_type.value.follows(event_type_cls, state))),
+                )
+
+
+def test_candidates():
+    """
+    Indexing event types by their support never skips an available transition.
+
+    """
+    for event_type_cls in (TaskEventType, FlexibleTaskEventType, CustomEventType):
+        state_machine = event_type_cls.state_machine()
+        for state in iter_subsets(event_type_cls):
+            mask = state_machine.encode(state)
+            assert_that(
+                state_machine.available_transitions(mask),
+                is_(equal_to([
+                    event_type
+                    for event_type in event_type_cls
+                    if event_type.value.follows(event_type_cls, state)
+                ])),
+            )
+
+
+def test_available_transitions():
+    assert_that(
+        TaskEventType.available_transitions({TaskEventType.CREATED}),
+        contains_inanyorder(
+            TaskEventType.ASSIGNED,
+            TaskEventType.SCHEDULED,
+            TaskEventType.REVISED,
+        ),
+    )
+
+
+def test_transition_table():
+    """
+    The transition table agrees with enumerating all transitions.
+
+    """
+    state_machine = TaskEventType.state_machine()
+    expected = {
+        (state_machine.encode(state), event_type): frozenset(new_state)
+        for state, new_state, event_type in TaskEventType.all_transitions()
+    }
+    actual = {
+        (mask, event_type): frozenset(next_state)
+        for mask, transitions in state_machine.table.items()
+        for event_type, next_state in transitions.items()
+        if mask
+    }
+    assert_that(actual, is_(equal_to(expected)))
+
+
+def test_next_state():
+    assert_that(
+        TaskEventType.ASSIGNED.next_state({TaskEventType.CREATED}),
+        contains(TaskEventType.ASSIGNED, TaskEventType.CREATED),
+    )
+    assert_that(
+        TaskEventType.CREATED.next_state(()),
+        contains(TaskEventType.CREATED),
+    )
+    assert_that(
+        calling(TaskEventType.STARTED.next_state).with_args({TaskEventType.CREATED}),
+        raises(IllegalStateTransitionError),
+    )
+    assert_that(
+        calling(TaskEventType.STARTED.next_state).with_args(()),
+        raises(IllegalInitialStateError),
+    )
+
+
+def test_bounded_transition_table():
+    """
+    States that are not enumerated into the table are computed on demand.
+
+    """
+    state_machine = CompiledStateMachine(TaskEventType)
+    state_machine._table = state_machine.build_table(max_states=2)
+    assert_that(state_machine.table, has_length(1))
+
+    mask = state_machine.encode({TaskEventType.CREATED, TaskEventType.SCHEDULED})
+    assert_that(state_machine.table.get(mask), is_(none()))
+    assert_that(
+        state_machine.next_state(TaskEventType.ASSIGNED, mask),
+        contains(TaskEventType.ASSIGNED, TaskEventType.CREATED, TaskEventType.SCHEDULED),
+    )
+    assert_that(state_machine.next_state(TaskEventType.STARTED, mask), is_(none()))
+
+
+def test_validate_transitions():
+    """
+    Batch validation agrees with validating one transition at a time.
+
+    """
+    states = [
+        (),
+        (),
+        {TaskEventType.CREATED},
+        {TaskEventType.CREATED},
+        {TaskEventType.CREATED, TaskEventType.ASSIGNED, TaskEventType.SCHEDULED},
+        {TaskEventType.COMPLETED},
+    ]
+    event_types = [
+        TaskEventType.CREATED,
+        TaskEventType.STARTED,
+        TaskEventType.ASSIGNED,
+        TaskEventType.STARTED,
+        TaskEventType.STARTED,
+        TaskEventType.ENDED,
+    ]
+    batch = TaskEventType.validate_transitions(
+        [TaskEventType.state_code(state) for state in states],
+        [event_type.code for event_type in event_types],
+    )
+
+    assert_that(list(batch.legal), is_(equal_to([True, False, True, False, True, True])))
+    assert_that(
+        [
+            TaskEventType.state_machine().states[code] if legal else None
+            for code, legal in zip(batch.next_state_codes, batch.legal)
+        ],
+        is_(equal_to([
+            event_type.next_state(state) if event_type.may_transition(state) else None
+            for state, event_type in zip(states, event_types)
+        ])),
+    )
+
+    errors = list(batch.errors())
+    assert_that([index for index, error in errors], is_(equal_to([1, 3])))
+    assert_that(errors[0][1], is_(instance_of(IllegalInitialStateError)))
+    assert_that(str(errors[0][1]), is_(equal_to("Event type 'STARTED' may not be initial")))
+    assert_that(errors[1][1], is_(instance_of(IllegalStateTransitionError)))
+    assert_that(str(errors[1][1]), is_(equal_to("Event type 'STARTED' may not follow [CREATED]")))
+
+
+def test_validate_transitions_without_numpy():
+    with patch("microcosm_eventsource.compiling.numpy", None):
+        assert_that(
+            calling(TaskEventType.validate_transitions).with_args([0], [0]),
+            raises(ImportError),
+        )
+
+
+def test_state_codes():
+    assert_that(TaskEventType.state_code(()), is_(equal_to(0)))
+    assert_that(
+        TaskEventType.state_machine().states[TaskEventType.state_code({TaskEventType.STARTED})],
+        is_(equal_to({TaskEventType.STARTED})),
+    )
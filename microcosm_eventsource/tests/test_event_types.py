@@ -2,18 +2,28 @@
 Event type tests.
 
 """
+from operator import setitem
+
 from hamcrest import (
     assert_that,
     calling,
     contains,
     contains_inanyorder,
     equal_to,
+    instance_of,
     is_,
     raises,
 )
 
+from microcosm_eventsource.accumulation import union
+from microcosm_eventsource.errors import IllegalStateTransitionError
 from microcosm_eventsource.event_types import EventType, event_info
-from microcosm_eventsource.tests.fixtures import FlexibleTaskEventType, TaskEventType
+from microcosm_eventsource.states import State
+from microcosm_eventsource.tests.fixtures import (
+    FlexibleTaskEventType,
+    SubTaskEventType,
+    TaskEventType,
+)
 from microcosm_eventsource.transitioning import event
 
 
@@ -30,6 +40,57 @@ class IllegalEventType(EventType):
     )
 
 
+class RepeatedlyIllegalEventType(EventType):
+    # Event type with the same invalid auto transition from more than one state
+    CREATED = event_info()
+    STARTED = event_info(
+        follows=event("CREATED"),
+        accumulate=union(),
+    )
+    CANCELED = event_info(
+        follows=event("CREATED"),
+        auto_transition=True,
+    )
+
+
+class LockedEventType(EventType):
+    # Event type with extra validation
+    CREATED = event_info()
+    ASSIGNED = event_info(
+        follows=event("CREATED"),
+    )
+
+    def validate_transition(self, state):
+        if self.name == "ASSIGNED":
+            raise IllegalStateTransitionError("Assignments are locked")
+        super().validate_transition(state)
+
+
+class GatedEventType(EventType):
+    # Event type with extra transition conditions
+    CREATED = event_info()
+    ASSIGNED = event_info(
+        follows=event("CREATED"),
+    )
+
+    def may_transition(self, state):
+        return self.name != "ASSIGNED" and super().may_transition(state)
+
+
+def checked(state, event_type):
+    # custom accumulation that mutates the state
+    state.add(event_type)
+    return state
+
+
+class ChecklistEventType(EventType):
+    CREATED = event_info()
+    CHECKED = event_info(
+        follows=event("CREATED"),
+        accumulate=checked,
+    )
+
+
 def test_accumulate_state():
     """
     State accumulatin is either cummulative or a singleton.
@@ -63,6 +124,16 @@ def test_accumulate_state():
     )
 
 
+def test_accumulate_custom_state():
+    state = ChecklistEventType.CHECKED.accumulate_state({ChecklistEventType.CREATED})
+    assert_that(state, is_(instance_of(State)))
+    assert_that(state, contains_inanyorder(ChecklistEventType.CREATED, ChecklistEventType.CHECKED))
+    assert_that(
+        ChecklistEventType.CHECKED.next_state({ChecklistEventType.CREATED}),
+        is_(equal_to(state)),
+    )
+
+
 def test_next_version():
     """
     Compute next version.
@@ -305,6 +376,36 @@ def test_auto_transition_events():
     ])))
 
 
+def test_cached_metadata():
+    """
+    Class-level meta data is computed when the enum (or enum union) is created.
+
+    """
+    assert_that(TaskEventType.initial_event_types, is_(equal_to(frozenset([TaskEventType.CREATED]))))
+    assert_that(TaskEventType.auto_transition_event_types, is_(equal_to((TaskEventType.ENDED,))))
+    assert_that(
+        dict(TaskEventType.required_columns),
+        is_(equal_to(dict(
+            assignee=(TaskEventType.ASSIGNED, TaskEventType.REASSIGNED),
+            deadline=(TaskEventType.SCHEDULED, TaskEventType.RESCHEDULED),
+        ))),
+    )
+    assert_that(
+        dict(SubTaskEventType.required_columns),
+        is_(equal_to(dict(
+            assignee=(SubTaskEventType.ASSIGNED,),
+            deadline=(SubTaskEventType.SCHEDULED,),
+        ))),
+    )
+    assert_that(
+        calling(setitem).with_args(TaskEventType.required_columns, "assignee", ()),
+        raises(TypeError),
+    )
+    assert_that(TaskEventType.required_column_names(), is_(equal_to({"assignee", "deadline"})))
+    assert_that(TaskEventType.requires("assignee"), is_(instance_of(list)))
+    assert_that(TaskEventType.requires("unknown"), is_(equal_to([])))
+
+
 def test_assert_only_valid_transitions():
     """
     Test that the state machine supports only valid transitions.
@@ -312,3 +413,49 @@ def test_assert_only_valid_transitions():
     """
     TaskEventType.assert_only_valid_transitions()
     assert_that(calling(IllegalEventType.assert_only_valid_transitions), raises(AssertionError))
+
+
+def test_invalid_transitions():
+    """
+    Every state with invalid transitions is reported.
+
+    """
+    assert_that(TaskEventType.invalid_transitions(), is_(equal_to([])))
+    assert_that(FlexibleTaskEventType.invalid_transitions(), is_(equal_to([])))
+    assert_that(
+        IllegalEventType.invalid_transitions(),
+        contains(
+            (
+                {IllegalEventType.CREATED},
+                [IllegalEventType.ASSIGNED, IllegalEventType.SCHEDULED],
+            ),
+        ),
+    )
+    assert_that(
+        [state for state, _ in RepeatedlyIllegalEventType.invalid_transitions()],
+        contains(
+            {RepeatedlyIllegalEventType.CREATED},
+            {RepeatedlyIllegalEventType.CREATED, RepeatedlyIllegalEventType.STARTED},
+        ),
+    )
+    assert_that(
+        calling(IllegalEventType.assert_only_valid_transitions),
+        raises(
+            AssertionError,
+            r"Only one auto-transition event can follow any state: \[CREATED\] -> \[ASSIGNED, SCHEDULED\]",
+        ),
+    )
+
+
+def test_next_state_with_custom_validation():
+    assert_that(
+        calling(LockedEventType.ASSIGNED.next_state).with_args({LockedEventType.CREATED}),
+        raises(IllegalStateTransitionError, "Assignments are locked"),
+    )
+    assert_that(LockedEventType.CREATED.next_state(()), contains(LockedEventType.CREATED))
+
+    assert_that(
+        calling(GatedEventType.ASSIGNED.next_state).with_args({GatedEventType.CREATED}),
+        raises(IllegalStateTransitionError),
+    )
+    assert_that(GatedEventType.CREATED.next_state(()), contains(GatedEventType.CREATED))
@@ -0,0 +1,1100 @@
+"""
+Test event factories.
+
+"""
+from datetime import datetime
+from json import loads
+from os import environ
+from os.path import dirname
+from unittest.mock import MagicMock, patch
+
+from hamcrest import (
+    assert_that,
+    calling,
+    contains,
+    contains_inanyorder,
+    equal_to,
+    has_item,
+    has_length,
+    has_properties,
+    instance_of,
+    is_,
+    none,
+    not_,
+    not_none,
+    raises,
+)
+from microcosm.api import create_object_graph
+from microcosm.loaders import load_from_dict
+from microcosm_postgres.context import SessionContext, transaction
+from microcosm_postgres.errors import MissingDependencyError
+from microcosm_postgres.identifiers import new_object_id
+from microcosm_postgres.operations import recreate_all
+from microcosm_pubsub.batch import MessageBatchSchema
+from sqlalchemy import event
+from werkzeug.exceptions import UnprocessableEntity
+
+from microcosm_eventsource.errors import (
+    ConcurrentStateConflictError,
+    IllegalStateTransitionError,
+    StateMachineTooLargeError,
+)
+from microcosm_eventsource.factory import EventFactory
+from microcosm_eventsource.models import EventRecord
+from microcosm_eventsource.tests.fixtures import (
+    Activity,
+    ActivityEventType,
+    SubTask,
+    SubTaskEventType,
+    Task,
+    TaskEvent,
+    TaskEventType,
+)
+
+
+class TestEventFactory:
+
+    def setup(self):
+        loader = load_from_dict(
+            secret=dict(
+                postgres=dict(
+                    host=environ.get("MICROCOSM_EVENTSOURCE__POSTGRES__HOST", "localhost"),
+                    password=environ.get("MICROCOSM_EVENTSOURCE__POSTGRES__PASSWORD", ""),
+                ),
+            ),
+            postgres=dict(
+                host=environ.get("MICROCOSM_EVENTSOURCE__POSTGRES__HOST", "localhost"),
+                password=environ.get("MICROCOSM_EVENTSOURCE__POSTGRES__PASSWORD", ""),
+            ),
+            sns_topic_arns=dict(
+                default="topic",
+                mappings={
+                    MessageBatchSchema.MEDIA_TYPE: "batch-topic",
+                },
+            ),
+        )
+        self.graph = create_object_graph(
+            "microcosm_eventsource",
+            loader=loader,
+            root_path=dirname(__file__),
+            testing=True,
+        )
+        self.graph.use(
+            "task_store",
+            "task_event_store",
+            "task_event_controller",
+            "task_crud_routes",
+            "activity_store",
+            "activity_event_store",
+            "sub_task_store",
+            "sub_task_event_store",
+        )
+        self.controller = self.graph.task_event_controller
+        self.factory = self.controller.event_factory
+        self.statements = []
+        recreate_all(self.graph)
+
+        self.context = SessionContext(self.graph)
+        self.context.open()
+
+        with transaction():
+            self.task1 = Task().create()
+            self.task2 = Task().create()
+            self.task1_created_event = TaskEvent(
+                event_type=TaskEventType.CREATED,
+                state=[TaskEventType.CREATED],
+                task_id=self.task1.id,
+            ).create()
+
+        self.graph.sns_producer.sns_client.reset_mock()
+        self.request_context = self.graph.flask.test_request_context()
+        self.request_context.push()
+        event.listen(self.graph.postgres, "before_cursor_execute", self.record_statement)
+
+    def teardown(self):
+        event.remove(self.graph.postgres, "before_cursor_execute", self.record_statement)
+        self.request_context.pop()
+        self.context.close()
+        self.graph.postgres.dispose()
+
+    def record_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement.split()[0])
+
+    def test_create(self):
+        """
+        Creating an event selects its parent and inserts it (without re-selecting it).
+
+        """
+        with transaction():
+            assigned_event = self.factory.create(
+                self.controller.ns,
+                self.graph.sns_producer,
+                TaskEventType.ASSIGNED,
+                task_id=self.task1.id,
+                assignee="Alice",
+            )
+
+        assert_that(self.statements.count("SELECT"), is_(equal_to(1)))
+        assert_that(self.statements.count("INSERT"), is_(equal_to(1)))
+        assert_that(assigned_event, has_properties(
+            clock=not_none(),
+            parent_id=self.task1_created_event.id,
+            state=contains(TaskEventType.ASSIGNED, TaskEventType.CREATED),
+        ))
+
+    def test_create_instance(self):
+        """
+        A single event is written with `create_instance`.
+
+        """
+        with patch.object(self.factory, "create_instance", wraps=self.factory.create_instance) as create_instance:
+            with transaction():
+                assigned_event = self.factory.create(
+                    self.controller.ns,
+                    self.graph.sns_producer,
+                    TaskEventType.ASSIGNED,
+                    task_id=self.task1.id,
+                    assignee="Alice",
+                )
+
+        assert_that(create_instance.call_count, is_(equal_to(1)))
+        assert_that(create_instance.call_args[0][1], is_(equal_to(assigned_event)))
+
+    def test_create_overridden_hooks(self):
+        """
+        Overridden per-event hooks are called for every event of a chain.
+
+        """
+        self.start_task2()
+
+        class HookedEventFactory(EventFactory):
+            created = []
+
+            def create_event(self, event_info, **kwargs):
+                self.created.append(event_info.event_type)
+                super().create_event(event_info, **kwargs)
+
+        factory = HookedEventFactory(
+            event_store=self.graph.task_event_store,
+            identifier_key=self.controller.identifier_key,
+        )
+        with transaction():
+            factory.create(
+                self.controller.ns,
+                self.graph.sns_producer,
+                TaskEventType.COMPLETED,
+                task_id=self.task2.id,
+            )
+
+        assert_that(HookedEventFactory.created, contains(TaskEventType.COMPLETED, TaskEventType.ENDED))
+        with transaction():
+            assert_that(
+                self.graph.task_event_store.retrieve_most_recent(task_id=self.task2.id),
+                has_properties(event_type=TaskEventType.ENDED),
+            )
+
+    def test_create_chain_overridden_create_instance(self):
+        """
+        An overridden `create_instance` writes every event of a chain.
+
+        """
+        class HookedEventFactory(EventFactory):
+            created = []
+
+            def create_instance(self, event_info, instance):
+                self.created.append(event_info.event_type)
+                return super().create_instance(event_info, instance)
+
+        factory = HookedEventFactory(
+            event_store=self.graph.task_event_store,
+            identifier_key=self.controller.identifier_key,
+        )
+        with transaction():
+            events = factory.create_chain(
+                self.controller.ns,
+                self.graph.sns_producer,
+                self.task2.id,
+                [
+                    dict(event_type=TaskEventType.CREATED),
+                    dict(event_type=TaskEventType.ASSIGNED, assignee="Alice"),
+                ],
+            )
+
+        assert_that(HookedEventFactory.created, contains(TaskEventType.CREATED, TaskEventType.ASSIGNED))
+        assert_that(events[1].parent_id, is_(equal_to(events[0].id)))
+
+    def test_create_without_unique_parent(self):
+        """
+        Initial events of models without a unique parent constraint are inserted without ON CONFLICT.
+
+        """
+        for bypass_orm in (False, True):
+            with transaction():
+                activity = Activity().create()
+            factory = EventFactory(
+                event_store=self.graph.activity_event_store,
+                publish_event_pubsub=False,
+                bypass_orm=bypass_orm,
+            )
+            with transaction():
+                created_event = factory.create(
+                    None,
+                    None,
+                    ActivityEventType.CREATED,
+                    activity_id=activity.id,
+                )
+
+            assert_that(created_event, has_properties(
+                clock=not_none(),
+                parent_id=none(),
+            ))
+
+    def test_create_publishes_unbatched(self):
+        """
+        The messages of a single event are not batched.
+
+        """
+        factory = EventFactory(
+            event_store=self.graph.task_event_store,
+            identifier_key=self.controller.identifier_key,
+            publish_model_pubsub=True,
+        )
+        with transaction():
+            factory.create(
+                self.controller.ns,
+                self.graph.sns_producer,
+                TaskEventType.CREATED,
+                task_id=self.task2.id,
+            )
+
+        assert_that(
+            [
+                publish_call[1]["TopicArn"]
+                for publish_call in self.graph.sns_producer.sns_client.publish.call_args_list
+            ],
+            contains("topic", "topic"),
+        )
+
+    def test_create_idempotency_key(self):
+        """
+        Creating an event with a known idempotency key returns the original event.
+
+        """
+        with transaction():
+            assigned_event = self.factory.create(
+                self.controller.ns,
+                self.graph.sns_producer,
+                TaskEventType.ASSIGNED,
+                task_id=self.task1.id,
+                assignee="Alice",
+                idempotency_key="assign-alice",
+            )
+        self.statements = []
+        self.graph.sns_producer.sns_client.reset_mock()
+
+        with transaction():
+            # would otherwise be an illegal transition
+            repeated_event = self.factory.create(
+                self.controller.ns,
+                self.graph.sns_producer,
+                TaskEventType.ASSIGNED,
+                task_id=self.task1.id,
+                assignee="Alice",
+                idempotency_key="assign-alice",
+            )
+
+        assert_that(self.statements, contains("SELECT"))
+        assert_that(repeated_event.id, is_(equal_to(assigned_event.id)))
+        assert_that(self.graph.sns_producer.sns_client.publish.call_count, is_(equal_to(0)))
+
+    def test_create_idempotency_key_auto_transition(self):
+        """
+        Only the requested event carries the idempotency key, not its auto-transition events.
+
+        """
+        self.start_task2()
+
+        with transaction():
+            completed_event = self.factory.create(
+                self.controller.ns,
+                self.graph.sns_producer,
+                TaskEventType.COMPLETED,
+                task_id=self.task2.id,
+                idempotency_key="complete",
+            )
+
+        with transaction():
+            assert_that(completed_event.idempotency_key, is_(equal_to("complete")))
+            assert_that(
+                self.graph.task_event_store.retrieve_most_recent(task_id=self.task2.id),
+                has_properties(
+                    event_type=TaskEventType.ENDED,
+                    idempotency_key=none(),
+                ),
+            )
+
+    def test_create_concurrent_idempotency_key(self):
+        """
+        An event created concurrently with the same idempotency key is returned.
+
+        """
+        with transaction():
+            with self.racing_idempotency_key("retrieve_by_idempotency_key", "assign"):
+                assigned_event = self.factory.create(
+                    self.controller.ns,
+                    self.graph.sns_producer,
+                    TaskEventType.ASSIGNED,
+                    task_id=self.task1.id,
+                    assignee="Alice",
+                    idempotency_key="assign",
+                )
+
+            assert_that(assigned_event, has_properties(
+                event_type=TaskEventType.CREATED,
+                task_id=self.task2.id,
+            ))
+            assert_that(self.graph.task_event_store.count(task_id=self.task1.id), is_(equal_to(1)))
+
+    def test_create_many_idempotency_keys(self):
+        """
+        Specs with known (or repeated) idempotency keys are not created again.
+
+        """
+        with transaction():
+            assigned_event = self.factory.create(
+                self.controller.ns,
+                self.graph.sns_producer,
+                TaskEventType.ASSIGNED,
+                task_id=self.task1.id,
+                assignee="Alice",
+                idempotency_key="assign",
+            )
+
+        results = self.create_many(
+            dict(
+                event_type=TaskEventType.ASSIGNED,
+                task_id=self.task1.id,
+                assignee="Alice",
+                idempotency_key="assign",
+            ),
+            dict(event_type=TaskEventType.CREATED, task_id=self.task2.id, idempotency_key="create"),
+            dict(event_type=TaskEventType.CREATED, task_id=self.task2.id, idempotency_key="create"),
+        )
+
+        assert_that([result.error for result in results], contains(none(), none(), none()))
+        assert_that(results[0].event.id, is_(equal_to(assigned_event.id)))
+        assert_that(results[2].event, is_(equal_to(results[1].event)))
+
+        with transaction():
+            assert_that(self.graph.task_event_store.count(task_id=self.task1.id), is_(equal_to(2)))
+            assert_that(self.graph.task_event_store.count(task_id=self.task2.id), is_(equal_to(1)))
+
+    def test_create_many_concurrent_idempotency_key(self):
+        """
+        A batch that conflicts with an event created concurrently is created again.
+
+        """
+        with self.racing_idempotency_key("retrieve_by_idempotency_keys", "assign"):
+            results = self.create_many(
+                dict(
+                    event_type=TaskEventType.ASSIGNED,
+                    task_id=self.task1.id,
+                    assignee="Alice",
+                    idempotency_key="assign",
+                ),
+                dict(event_type=TaskEventType.CREATED, task_id=self.task2.id, idempotency_key="create"),
+            )
+
+        assert_that(results[0], has_properties(
+            error=none(),
+            event=has_properties(event_type=TaskEventType.CREATED, idempotency_key="assign"),
+        ))
+        # the batch is created again after the concurrently created event
+        assert_that(results[1].error, is_(instance_of(IllegalStateTransitionError)))
+
+        with transaction():
+            assert_that(self.graph.task_event_store.count(task_id=self.task1.id), is_(equal_to(1)))
+
+    def test_create_chain_idempotency_keys(self):
+        """
+        Creating a chain again with the same idempotency keys returns the original events.
+
+        """
+        specs = [
+            dict(event_type=TaskEventType.CREATED, idempotency_key="create"),
+            dict(event_type=TaskEventType.ASSIGNED, assignee="Alice", idempotency_key="assign"),
+        ]
+        ns, sns_producer = self.controller.ns, self.graph.sns_producer
+        with transaction():
+            events = self.factory.create_chain(ns, sns_producer, self.task2.id, specs)
+        with transaction():
+            repeated_events = self.factory.create_chain(ns, sns_producer, self.task2.id, specs)
+
+        assert_that([event.id for event in repeated_events], is_(equal_to([event.id for event in events])))
+        with transaction():
+            assert_that(self.graph.task_event_store.count(task_id=self.task2.id), is_(equal_to(2)))
+
+    def test_create_with_container_idempotency_key(self):
+        with transaction():
+            created_event = self.factory.create_with_container(
+                self.controller.ns,
+                self.graph.sns_producer,
+                Task(),
+                TaskEventType.CREATED,
+                idempotency_key="create",
+            )
+        task = Task()
+        with transaction():
+            repeated_event = self.factory.create_with_container(
+                self.controller.ns,
+                self.graph.sns_producer,
+                task,
+                TaskEventType.CREATED,
+                idempotency_key="create",
+            )
+
+        assert_that(repeated_event.id, is_(equal_to(created_event.id)))
+        assert_that(task.id, is_(none()))
+
+    def racing_idempotency_key(self, lookup, idempotency_key):
+        """
+        Create an event with an idempotency key just after the first lookup by key (as if
+        created concurrently).
+
+        """
+        retrieve = getattr(self.graph.task_event_store, lookup)
+
+        def lookup_and_race(*args, **kwargs):
+            result = retrieve(*args, **kwargs)
+            racing.side_effect = retrieve
+            # another transaction
+            with self.graph.postgres.begin() as connection:
+                connection.execute(TaskEvent.__table__.insert().values(
+                    event_type=TaskEventType.CREATED,
+                    state=[TaskEventType.CREATED],
+                    task_id=self.task2.id,
+                    idempotency_key=idempotency_key,
+                ))
+            return result
+
+        racing = MagicMock(side_effect=lookup_and_race)
+        return patch.object(self.graph.task_event_store, lookup, racing)
+
+    def start_task2(self):
+        with transaction():
+            events = self.factory.create_chain(
+                self.controller.ns,
+                self.graph.sns_producer,
+                self.task2.id,
+                [
+                    dict(event_type=TaskEventType.CREATED),
+                    dict(event_type=TaskEventType.ASSIGNED, assignee="Alice"),
+                    dict(event_type=TaskEventType.SCHEDULED, deadline=datetime.utcnow()),
+                    dict(event_type=TaskEventType.STARTED),
+                ],
+            )
+        self.statements.clear()
+        self.graph.sns_producer.sns_client.reset_mock()
+        return events[-1]
+
+    def test_create_auto_transition(self):
+        """
+        An event and its auto-transition events are written with a single statement.
+
+        """
+        started_event = self.start_task2()
+
+        with transaction():
+            completed_event = self.factory.create(
+                self.controller.ns,
+                self.graph.sns_producer,
+                TaskEventType.COMPLETED,
+                task_id=self.task2.id,
+            )
+
+        # SELECT (parent) + WITH head AS (INSERT ...), tail AS (INSERT ...) SELECT ...
+        assert_that(self.statements, contains("SELECT", "WITH"))
+        assert_that(completed_event, has_properties(
+            parent_id=started_event.id,
+        ))
+        with transaction():
+            assert_that(
+                self.graph.task_event_store.retrieve_most_recent(task_id=self.task2.id),
+                has_properties(
+                    event_type=TaskEventType.ENDED,
+                    parent_id=completed_event.id,
+                ),
+            )
+
+        assert_that(self.graph.sns_producer.sns_client.publish.call_args_list, has_length(1))
+        message = loads(self.graph.sns_producer.sns_client.publish.call_args[1]["Message"])
+        assert_that(
+            [loads(item["message"])["mediaType"] for item in message["messages"]],
+            contains(
+                "application/vnd.globality.pubsub._.created.task_event.completed",
+                "application/vnd.globality.pubsub._.created.task_event.ended",
+            ),
+        )
+
+    def test_create_auto_transition_after_similar_event(self):
+        """
+        If an event resolves to an existing (similar) event, its auto-transition events follow that event.
+
+        """
+        started_event = self.start_task2()
+        with transaction():
+            completed_event = TaskEvent(
+                event_type=TaskEventType.COMPLETED,
+                parent_id=started_event.id,
+                state=[TaskEventType.COMPLETED],
+                task_id=self.task2.id,
+            ).create()
+
+        with transaction():
+            event = self.factory.create(
+                self.controller.ns,
+                self.graph.sns_producer,
+                TaskEventType.COMPLETED,
+                parent=started_event,
+                task_id=self.task2.id,
+            )
+            assert_that(event.id, is_(equal_to(completed_event.id)))
+            assert_that(
+                self.graph.task_event_store.retrieve_most_recent(task_id=self.task2.id),
+                has_properties(
+                    event_type=TaskEventType.ENDED,
+                    parent_id=completed_event.id,
+                ),
+            )
+
+    def test_create_bypass_orm(self):
+        """
+        Bypassing the ORM creates events (and their auto-transition events) as records.
+
+        """
+        started_event = self.start_task2()
+        factory = EventFactory(
+            event_store=self.graph.task_event_store,
+            identifier_key=self.controller.identifier_key,
+            bypass_orm=True,
+        )
+
+        with transaction():
+            completed_event = factory.create(
+                self.controller.ns,
+                self.graph.sns_producer,
+                TaskEventType.COMPLETED,
+                task_id=self.task2.id,
+            )
+            assert_that(
+                [event.id for event in self.context.session.identity_map.values() if isinstance(event, TaskEvent)],
+                not_(has_item(completed_event.id)),
+            )
+
+        assert_that(self.statements, contains("SELECT", "WITH"))
+        assert_that(completed_event, is_(instance_of(EventRecord)))
+        assert_that(completed_event, has_properties(
+            clock=not_none(),
+            parent_id=started_event.id,
+            state=contains(TaskEventType.COMPLETED),
+            version=1,
+        ))
+        with transaction():
+            assert_that(
+                self.graph.task_event_store.retrieve_most_recent(task_id=self.task2.id),
+                has_properties(
+                    event_type=TaskEventType.ENDED,
+                    parent_id=completed_event.id,
+                ),
+            )
+
+    def test_create_with_container(self):
+        """
+        A container and its initial event are written with a single statement.
+
+        """
+        task = Task(description="Container")
+        with transaction():
+            created_event = self.factory.create_with_container(
+                self.controller.ns,
+                self.graph.sns_producer,
+                task,
+                TaskEventType.CREATED,
+            )
+
+        assert_that(self.statements, contains("WITH"))
+        assert_that(task, has_properties(
+            created_at=not_none(),
+            id=not_none(),
+        ))
+        assert_that(created_event, has_properties(
+            clock=not_none(),
+            parent_id=none(),
+            state=contains(TaskEventType.CREATED),
+            task_id=task.id,
+            version=1,
+        ))
+        self.graph.sns_producer.sns_client.publish.assert_called_once()
+
+        with transaction():
+            assert_that(self.graph.task_store.retrieve(task.id), has_properties(
+                description="Container",
+            ))
+            assert_that(
+                self.graph.task_event_store.retrieve_most_recent(task_id=task.id),
+                is_(equal_to(created_event)),
+            )
+
+    def test_create_with_joined_container(self):
+        """
+        A container that spans several tables is written with one CTE per table.
+
+        """
+        factory = EventFactory(
+            event_store=self.graph.sub_task_event_store,
+            identifier_key=self.controller.identifier_key,
+            publish_event_pubsub=False,
+        )
+        sub_task = SubTask(description="Container", priority=1)
+        with transaction():
+            created_event = factory.create_with_container(
+                None,
+                None,
+                sub_task,
+                SubTaskEventType.CREATED,
+            )
+
+        assert_that(self.statements, contains("WITH"))
+        assert_that(sub_task, has_properties(
+            created_at=not_none(),
+            discriminator="sub_task",
+            id=not_none(),
+        ))
+        assert_that(created_event, has_properties(
+            parent_id=none(),
+            sub_task_id=sub_task.id,
+        ))
+
+        with transaction():
+            assert_that(self.graph.sub_task_store.retrieve(sub_task.id), has_properties(
+                description="Container",
+                priority=1,
+            ))
+            assert_that(
+                self.graph.sub_task_event_store.retrieve_most_recent(sub_task_id=sub_task.id),
+                is_(equal_to(created_event)),
+            )
+
+    def assign_task1(self):
+        with transaction():
+            return TaskEvent(
+                event_type=TaskEventType.ASSIGNED,
+                parent_id=self.task1_created_event.id,
+                state=[TaskEventType.ASSIGNED, TaskEventType.CREATED],
+                task_id=self.task1.id,
+                assignee="Bob",
+            ).create()
+
+    def test_create_retries(self):
+        """
+        A concurrent append is retried after the (new) most recent event.
+
+        """
+        assigned_event = self.assign_task1()
+        metrics = MagicMock()
+        factory = EventFactory(
+            event_store=self.graph.task_event_store,
+            identifier_key=self.controller.identifier_key,
+            max_retries=2,
+            retry_backoff=0,
+            metrics=metrics,
+        )
+
+        with transaction():
+            scheduled_event = factory.create(
+                self.controller.ns,
+                self.graph.sns_producer,
+                TaskEventType.SCHEDULED,
+                parent=self.task1_created_event,
+                task_id=self.task1.id,
+                deadline=datetime.utcnow(),
+            )
+
+        assert_that(scheduled_event, has_properties(
+            parent_id=assigned_event.id,
+            state=contains(TaskEventType.ASSIGNED, TaskEventType.CREATED, TaskEventType.SCHEDULED),
+        ))
+        metrics.histogram.assert_called_once_with(
+            "event_factory.retries",
+            1,
+            tags=["source:microcosm-eventsource", "result:success", "model_name:TaskEvent"],
+        )
+
+    def test_create_without_retries(self):
+        self.assign_task1()
+
+        with transaction():
+            assert_that(
+                calling(self.factory.create).with_args(
+                    self.controller.ns,
+                    self.graph.sns_producer,
+                    TaskEventType.SCHEDULED,
+                    parent=self.task1_created_event,
+                    task_id=self.task1.id,
+                    deadline=datetime.utcnow(),
+                ),
+                raises(ConcurrentStateConflictError),
+            )
+
+    def create_many(self, *specs):
+        with transaction():
+            return self.factory.create_many(self.controller.ns, self.graph.sns_producer, specs)
+
+    def test_create_many(self):
+        """
+        Events across containers are created with one query for parents (and one for containers
+        without events) and one insert per kind.
+
+        """
+        results = self.create_many(
+            dict(event_type=TaskEventType.ASSIGNED, task_id=self.task1.id, assignee="Alice"),
+            dict(event_type=TaskEventType.CREATED, task_id=self.task2.id),
+        )
+
+        assert_that([result.error for result in results], contains(none(), none()))
+        assert_that(results[0].event, has_properties(
+            clock=not_none(),
+            event_type=TaskEventType.ASSIGNED,
+            parent_id=self.task1_created_event.id,
+            state=contains(TaskEventType.ASSIGNED, TaskEventType.CREATED),
+            version=1,
+        ))
+        assert_that(results[1].event, has_properties(
+            clock=not_none(),
+            event_type=TaskEventType.CREATED,
+            parent_id=none(),
+            state=contains(TaskEventType.CREATED),
+        ))
+        assert_that(self.statements.count("SELECT"), is_(equal_to(2)))
+        # initial events are inserted separately (without ON CONFLICT)
+        assert_that(self.statements.count("INSERT"), is_(equal_to(2)))
+
+        with transaction():
+            assert_that(
+                self.graph.task_event_store.retrieve_most_recent(task_id=self.task1.id),
+                is_(equal_to(results[0].event)),
+            )
+
+    def test_create_many_per_item_errors(self):
+        """
+        Invalid specs are reported without aborting the batch.
+
+        """
+        results = self.create_many(
+            dict(event_type=TaskEventType.STARTED, task_id=self.task1.id),
+            dict(event_type=TaskEventType.ASSIGNED, task_id=self.task1.id),
+            dict(event_type=TaskEventType.SCHEDULED, task_id=self.task1.id, deadline=datetime.utcnow()),
+        )
+
+        assert_that(results[0].error, is_(instance_of(IllegalStateTransitionError)))
+        assert_that(results[1].error, is_(instance_of(UnprocessableEntity)))
+        assert_that(results[2].error, is_(none()))
+        assert_that(results[2].event, has_properties(
+            parent_id=self.task1_created_event.id,
+        ))
+
+    def test_create_many_missing_containers(self):
+        """
+        Specs without an (existing) container are reported without aborting the batch.
+
+        """
+        results = self.create_many(
+            dict(event_type=TaskEventType.CREATED, task_id=new_object_id()),
+            dict(event_type=TaskEventType.CREATED),
+            dict(event_type=TaskEventType.CREATED, task_id=self.task2.id),
+        )
+
+        assert_that(results[0].error, is_(instance_of(MissingDependencyError)))
+        assert_that(results[1].error, is_(instance_of(UnprocessableEntity)))
+        assert_that(results[2].error, is_(none()))
+
+        with transaction():
+            assert_that(self.graph.task_event_store.count(task_id=self.task2.id), is_(equal_to(1)))
+
+    def test_create_many_chains_events(self):
+        """
+        Events for the same container follow each other, including auto-transition events.
+
+        """
+        results = self.create_many(
+            dict(event_type=TaskEventType.CREATED, task_id=self.task2.id),
+            dict(event_type=TaskEventType.ASSIGNED, task_id=self.task2.id, assignee="Alice"),
+            dict(event_type=TaskEventType.SCHEDULED, task_id=self.task2.id, deadline=datetime.utcnow()),
+            dict(event_type=TaskEventType.STARTED, task_id=self.task2.id),
+            dict(event_type=TaskEventType.COMPLETED, task_id=self.task2.id),
+        )
+
+        assert_that([result.error for result in results], is_(equal_to([None] * 5)))
+        assert_that(
+            [result.event.parent_id for result in results[1:]],
+            is_(equal_to([result.event.id for result in results[:-1]])),
+        )
+
+        with transaction():
+            ended_event = self.graph.task_event_store.retrieve_most_recent(task_id=self.task2.id)
+        assert_that(ended_event, has_properties(
+            event_type=TaskEventType.ENDED,
+            parent_id=results[-1].event.id,
+        ))
+
+    def test_create_many_conflict(self):
+        """
+        A conflicting event fails, as do the events that follow it.
+
+        """
+        with transaction():
+            TaskEvent(
+                event_type=TaskEventType.ASSIGNED,
+                parent_id=self.task1_created_event.id,
+                state=[TaskEventType.ASSIGNED, TaskEventType.CREATED],
+                task_id=self.task1.id,
+                assignee="Bob",
+            ).create()
+
+        results = self.create_many(
+            dict(
+                event_type=TaskEventType.SCHEDULED,
+                parent=self.task1_created_event,
+                task_id=self.task1.id,
+                deadline=datetime.utcnow(),
+            ),
+            dict(event_type=TaskEventType.ASSIGNED, task_id=self.task1.id, assignee="Alice"),
+            dict(event_type=TaskEventType.CREATED, task_id=self.task2.id),
+        )
+
+        assert_that(results[0].error, is_(instance_of(ConcurrentStateConflictError)))
+        assert_that(results[1].error, is_(instance_of(ConcurrentStateConflictError)))
+        assert_that(results[2].error, is_(none()))
+
+    def test_create_many_publishes_batch(self):
+        self.create_many(
+            dict(event_type=TaskEventType.ASSIGNED, task_id=self.task1.id, assignee="Alice"),
+            dict(event_type=TaskEventType.CREATED, task_id=self.task2.id),
+        )
+
+        assert_that(self.graph.sns_producer.sns_client.publish.call_args_list, has_length(1))
+        message = loads(self.graph.sns_producer.sns_client.publish.call_args[1]["Message"])
+        assert_that(
+            [loads(item["message"])["mediaType"] for item in message["messages"]],
+            contains_inanyorder(
+                "application/vnd.globality.pubsub._.created.task_event.assigned",
+                "application/vnd.globality.pubsub._.created.task_event.created",
+            ),
+        )
+
+    def test_create_chain(self):
+        """
+        A chain of events is written with a single statement.
+
+        """
+        with transaction():
+            events = self.factory.create_chain(
+                self.controller.ns,
+                self.graph.sns_producer,
+                self.task2.id,
+                [
+                    dict(event_type=TaskEventType.CREATED),
+                    dict(event_type=TaskEventType.ASSIGNED, assignee="Alice"),
+                    dict(event_type=TaskEventType.SCHEDULED, deadline=datetime.utcnow()),
+                    dict(event_type=TaskEventType.STARTED),
+                    dict(event_type=TaskEventType.COMPLETED),
+                ],
+            )
+
+        assert_that(self.statements, contains("SELECT", "WITH"))
+        assert_that(
+            [event.event_type for event in events],
+            contains(
+                TaskEventType.CREATED,
+                TaskEventType.ASSIGNED,
+                TaskEventType.SCHEDULED,
+                TaskEventType.STARTED,
+                TaskEventType.COMPLETED,
+                TaskEventType.ENDED,
+            ),
+        )
+        assert_that(
+            [event.parent_id for event in events],
+            is_(equal_to([None] + [event.id for event in events[:-1]])),
+        )
+
+        with transaction():
+            assert_that(
+                self.graph.task_event_store.search(task_id=self.task2.id),
+                contains(*reversed(events)),
+            )
+
+    def test_create_chain_illegal_transition(self):
+        with transaction():
+            assert_that(
+                calling(self.factory.create_chain).with_args(
+                    self.controller.ns,
+                    self.graph.sns_producer,
+                    self.task1.id,
+                    [
+                        dict(event_type=TaskEventType.ASSIGNED, assignee="Alice"),
+                        dict(event_type=TaskEventType.STARTED),
+                    ],
+                ),
+                raises(IllegalStateTransitionError),
+            )
+            assert_that(self.graph.task_event_store.count(task_id=self.task1.id), is_(equal_to(1)))
+
+    def test_create_chain_conflict(self):
+        with transaction():
+            TaskEvent(
+                event_type=TaskEventType.ASSIGNED,
+                parent_id=self.task1_created_event.id,
+                state=[TaskEventType.ASSIGNED, TaskEventType.CREATED],
+                task_id=self.task1.id,
+                assignee="Bob",
+            ).create()
+
+        assert_that(
+            calling(self.factory.create_chain).with_args(
+                self.controller.ns,
+                self.graph.sns_producer,
+                self.task1.id,
+                [dict(event_type=TaskEventType.SCHEDULED, deadline=datetime.utcnow())],
+                parent=self.task1_created_event,
+            ),
+            raises(ConcurrentStateConflictError),
+        )
+
+    def test_create_chain_conflict_in_transaction(self):
+        """
+        A conflicting chain does not abort the enclosing transaction.
+
+        """
+        with transaction():
+            TaskEvent(
+                event_type=TaskEventType.ASSIGNED,
+                parent_id=self.task1_created_event.id,
+                state=[TaskEventType.ASSIGNED, TaskEventType.CREATED],
+                task_id=self.task1.id,
+                assignee="Bob",
+            ).create()
+
+            assert_that(
+                calling(self.factory.create_chain).with_args(
+                    self.controller.ns,
+                    self.graph.sns_producer,
+                    self.task1.id,
+                    [
+                        dict(event_type=TaskEventType.SCHEDULED, deadline=datetime.utcnow()),
+                        dict(event_type=TaskEventType.ASSIGNED, assignee="Alice"),
+                    ],
+                    parent=self.task1_created_event,
+                ),
+                raises(ConcurrentStateConflictError),
+            )
+            assert_that(self.graph.task_event_store.count(task_id=self.task1.id), is_(equal_to(2)))
+
+    def append(self, event_type, **kwargs):
+        factory = EventFactory(
+            event_store=self.graph.task_event_store,
+            identifier_key=self.controller.identifier_key,
+            resolve_parent_in_database=True,
+        )
+        with transaction():
+            return factory.create(self.controller.ns, self.graph.sns_producer, event_type, **kwargs)
+
+    def test_append(self):
+        """
+        Appending resolves the parent (and state) with a single statement.
+
+        """
+        created_event = self.append(TaskEventType.CREATED, task_id=self.task2.id)
+        assigned_event = self.append(TaskEventType.ASSIGNED, task_id=self.task2.id, assignee="Alice")
+
+        # WITH head AS (SELECT ...) INSERT ... SELECT ...
+        assert_that(self.statements, contains("WITH", "WITH"))
+        assert_that(created_event, has_properties(
+            clock=not_none(),
+            parent_id=none(),
+            state=contains(TaskEventType.CREATED),
+            version=1,
+        ))
+        assert_that(assigned_event, has_properties(
+            assignee="Alice",
+            parent_id=created_event.id,
+            state=contains(TaskEventType.ASSIGNED, TaskEventType.CREATED),
+            version=1,
+        ))
+        self.graph.sns_producer.sns_client.publish.assert_called()
+
+    def test_append_restarting(self):
+        revised_event = self.append(TaskEventType.REVISED, task_id=self.task1.id)
+
+        assert_that(revised_event, has_properties(
+            parent_id=self.task1_created_event.id,
+            state=contains(TaskEventType.CREATED),
+            version=2,
+        ))
+
+    def test_append_large_state_machine(self):
+        """
+        State machines that are too large to enumerate append after reading the most recent event.
+
+        """
+        with patch.object(
+            TaskEventType.state_machine(),
+            "legal_transitions",
+            side_effect=StateMachineTooLargeError(),
+        ):
+            assigned_event = self.append(TaskEventType.ASSIGNED, task_id=self.task1.id, assignee="Alice")
+
+        assert_that(self.statements, has_item("SELECT"))
+        assert_that(assigned_event, has_properties(
+            parent_id=self.task1_created_event.id,
+            state=contains(TaskEventType.ASSIGNED, TaskEventType.CREATED),
+        ))
+
+    def test_append_many_legal_transitions(self):
+        """
+        Event types with too many legal transitions to inline append after reading the most recent event.
+
+        """
+        with patch("microcosm_eventsource.factory.MAX_APPEND_TRANSITIONS", 1):
+            assigned_event = self.append(TaskEventType.ASSIGNED, task_id=self.task1.id, assignee="Alice")
+
+        assert_that(self.statements, has_item("SELECT"))
+        assert_that(assigned_event, has_properties(
+            parent_id=self.task1_created_event.id,
+            state=contains(TaskEventType.ASSIGNED, TaskEventType.CREATED),
+        ))
+
+    def test_append_custom_validation(self):
+        """
+        Enums that override transition validation are validated before appending.
+
+        """
+        def validate_transition(event_type, state):
+            raise IllegalStateTransitionError("Assignments are locked")
+
+        with patch.object(TaskEventType, "validate_transition", validate_transition):
+            assert_that(
+                calling(self.append).with_args(TaskEventType.ASSIGNED, task_id=self.task1.id, assignee="Alice"),
+                raises(IllegalStateTransitionError, "Assignments are locked"),
+            )
+        assert_that(self.graph.task_event_store.count(task_id=self.task1.id), is_(equal_to(1)))
+
+    def test_append_illegal_transition(self):
+        assert_that(
+            calling(self.append).with_args(TaskEventType.STARTED, task_id=self.task1.id),
+            raises(IllegalStateTransitionError),
+        )
+        assert_that(
+            calling(self.append).with_args(TaskEventType.CREATED, task_id=self.task1.id),
+            raises(IllegalStateTransitionError),
+        )
@@ -1,10 +1,20 @@
+from datetime import datetime
 from os.path import dirname
 
-from hamcrest import assert_that, contains
+from hamcrest import (
+    assert_that,
+    calling,
+    contains,
+    has_properties,
+    raises,
+)
 from microcosm.api import create_object_graph
 from microcosm_postgres.context import SessionContext, transaction
+from microcosm_postgres.errors import ModelIntegrityError
+from sqlalchemy import text
 
-from microcosm_eventsource.func import last
+from microcosm_eventsource.factory import EventFactory
+from microcosm_eventsource.func import last, validation_trigger_ddl
 from microcosm_eventsource.tests.fixtures import Task, TaskEvent, TaskEventType
 
 
@@ -94,3 +104,137 @@ class TestLast:
             contains("Alice", "Alice"),
             contains(None, None),
         ))
+
+
+class TestValidationTrigger:
+
+    def setup(self):
+        self.graph = create_object_graph(
+            "microcosm_eventsource",
+            root_path=dirname(__file__),
+            testing=True,
+        )
+        self.graph.use(
+            "task_store",
+            "task_event_store",
+        )
+        self.factory = EventFactory(
+            event_store=self.graph.task_event_store,
+            publish_event_pubsub=False,
+        )
+
+        self.context = SessionContext(self.graph)
+        self.context.recreate_all()
+
+        self.create_ddl, self.drop_ddl = validation_trigger_ddl(TaskEvent)
+        with self.graph.postgres.begin() as connection:
+            connection.execute(text(self.create_ddl))
+
+        self.context.open()
+
+        with transaction():
+            self.task = Task().create()
+            self.created_event = TaskEvent(
+                event_type=TaskEventType.CREATED,
+                task_id=self.task.id,
+            ).create()
+
+    def teardown(self):
+        self.context.close()
+        with self.graph.postgres.begin() as connection:
+            connection.execute(text(self.drop_ddl))
+        self.graph.postgres.dispose()
+
+    def insert(self, **kwargs):
+        kwargs.setdefault("parent_id", self.created_event.id)
+        with transaction():
+            return TaskEvent(
+                task_id=self.task.id,
+                **kwargs
+            ).create()
+
+    def test_legal_chain(self):
+        """
+        Events created by the factory (including a multi-row chain) pass validation.
+
+        """
+        with transaction():
+            self.factory.create(None, None, TaskEventType.REVISED, task_id=self.task.id)
+        with transaction():
+            events = self.factory.create_chain(None, None, self.task.id, [
+                dict(event_type=TaskEventType.ASSIGNED, assignee="Alice"),
+                dict(event_type=TaskEventType.SCHEDULED, deadline=datetime.utcnow()),
+                dict(event_type=TaskEventType.STARTED),
+                dict(event_type=TaskEventType.COMPLETED),
+            ])
+
+        assert_that(events[-1], has_properties(
+            event_type=TaskEventType.ENDED,
+            version=2,
+        ))
+
+    def test_illegal_transition(self):
+        assert_that(
+            calling(self.insert).with_args(
+                event_type=TaskEventType.STARTED,
+                state=[TaskEventType.STARTED],
+            ),
+            raises(ModelIntegrityError, "Event type 'STARTED' may not follow"),
+        )
+
+    def test_parent_of_other_container(self):
+        with transaction():
+            other_event = TaskEvent(
+                event_type=TaskEventType.CREATED,
+                task_id=Task().create().id,
+            ).create()
+
+        assert_that(
+            calling(self.insert).with_args(
+                event_type=TaskEventType.ASSIGNED,
+                assignee="Alice",
+                parent_id=other_event.id,
+                state=[TaskEventType.ASSIGNED, TaskEventType.CREATED],
+            ),
+            raises(ModelIntegrityError, "may not follow event"),
+        )
+
+    def test_illegal_state(self):
+        assert_that(
+            calling(self.insert).with_args(
+                event_type=TaskEventType.ASSIGNED,
+                assignee="Alice",
+                state=[TaskEventType.ASSIGNED],
+            ),
+            raises(ModelIntegrityError, "expected {ASSIGNED,CREATED}"),
+        )
+
+    def test_illegal_version(self):
+        assert_that(
+            calling(self.insert).with_args(
+                event_type=TaskEventType.REVISED,
+                state=[TaskEventType.CREATED],
+                version=1,
+            ),
+            raises(ModelIntegrityError, "has version 1, expected at least 2"),
+        )
+
+    def test_explicit_version(self):
+        """
+        Events may be created with a later version than the factory would compute.
+
+        """
+        with transaction():
+            event = self.factory.create(
+                None,
+                None,
+                TaskEventType.ASSIGNED,
+                task_id=self.task.id,
+                assignee="Alice",
+                version=3,
+            )
+
+        assert_that(event, has_properties(
+            parent_id=self.created_event.id,
+            version=3,
+        ))
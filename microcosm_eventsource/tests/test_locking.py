@@ -0,0 +1,175 @@
+"""
+Test per-container serialization.
+
+"""
+from os.path import dirname
+from unittest.mock import MagicMock
+
+from hamcrest import (
+    assert_that,
+    calling,
+    equal_to,
+    greater_than_or_equal_to,
+    has_entries,
+    is_,
+    none,
+    raises,
+)
+from microcosm.api import create_object_graph
+from microcosm_postgres.context import SessionContext, transaction
+from sqlalchemy import func, select, text
+
+from microcosm_eventsource.errors import (
+    ContainerLockNotAvailableRetry,
+    ContainerLockSkippedRetry,
+    ContainerLockTimeoutRetry,
+)
+from microcosm_eventsource.locking import AdvisoryLock, RowLock, advisory_lock_key
+from microcosm_eventsource.tests.fixtures import Task, TaskEvent, TaskEventType
+
+
+def test_advisory_lock_key():
+    key = advisory_lock_key("task_event", "c5a1a0ad-5b59-4b7b-9d2e-6a5c1c6cd6b0")
+
+    assert_that(key, is_(equal_to(advisory_lock_key("task_event", "c5a1a0ad-5b59-4b7b-9d2e-6a5c1c6cd6b0"))))
+    assert_that(-2 ** 63 <= key < 2 ** 63, is_(equal_to(True)))
+    assert_that(
+        key == advisory_lock_key("sub_task_event", "c5a1a0ad-5b59-4b7b-9d2e-6a5c1c6cd6b0"),
+        is_(equal_to(False)),
+    )
+
+
+class LockTest:
+
+    def setup(self):
+        self.graph = create_object_graph(
+            "microcosm_eventsource",
+            root_path=dirname(__file__),
+            testing=True,
+        )
+        self.graph.use(
+            "task_store",
+            "task_event_store",
+        )
+        self.store = self.graph.task_event_store
+
+        self.context = SessionContext(self.graph)
+        self.context.recreate_all()
+        self.context.open()
+
+        with transaction():
+            self.task = Task().create()
+            self.created_event = TaskEvent(
+                event_type=TaskEventType.CREATED,
+                task_id=self.task.id,
+            ).create()
+
+        # hold the container's lock from another connection
+        self.connection = self.graph.postgres.connect()
+        self.locking_transaction = self.connection.begin()
+        self.lock()
+
+    def teardown(self):
+        self.locking_transaction.rollback()
+        self.connection.close()
+        self.context.close()
+        self.graph.postgres.dispose()
+
+    def retrieve(self, container_lock):
+        with transaction():
+            return self.store.retrieve_most_recent_with_update_lock(
+                container_lock=container_lock,
+                task_id=self.task.id,
+            )
+
+
+class TestRowLock(LockTest):
+
+    def lock(self):
+        self.connection.execute(
+            select(TaskEvent.__table__).where(TaskEvent.id == self.created_event.id).with_for_update(),
+        )
+
+    def test_nowait(self):
+        assert_that(
+            calling(self.retrieve).with_args(RowLock()),
+            raises(ContainerLockNotAvailableRetry),
+        )
+
+    def test_timeout(self):
+        self.store.postgres_store_metrics = MagicMock()
+
+        assert_that(
+            calling(self.retrieve).with_args(RowLock(timeout=50)),
+            raises(ContainerLockTimeoutRetry),
+        )
+        assert_that(self.store.postgres_store_metrics.call_args[1], has_entries(
+            model_name="TaskEvent",
+            action="lock_timeout",
+            elapsed_time=greater_than_or_equal_to(50),
+            execution_result="FAILURE",
+        ))
+
+    def test_skip_locked(self):
+        assert_that(
+            calling(self.retrieve).with_args(RowLock(skip_locked=True)),
+            raises(ContainerLockSkippedRetry),
+        )
+
+        self.locking_transaction.rollback()
+        assert_that(self.retrieve(RowLock(skip_locked=True)), is_(equal_to(self.created_event)))
+
+    def test_skip_locked_without_events(self):
+        with transaction():
+            task = Task().create()
+            assert_that(
+                self.store.retrieve_most_recent_with_update_lock(
+                    container_lock=RowLock(skip_locked=True),
+                    task_id=task.id,
+                ),
+                is_(none()),
+            )
+
+
+class TestAdvisoryLock(LockTest):
+
+    def lock(self):
+        self.connection.execute(
+            select(func.pg_advisory_xact_lock(advisory_lock_key("task_event", self.task.id))),
+        )
+
+    def test_try_lock(self):
+        assert_that(
+            calling(self.retrieve).with_args(AdvisoryLock(try_lock=True)),
+            raises(ContainerLockNotAvailableRetry),
+        )
+
+        self.locking_transaction.rollback()
+        assert_that(self.retrieve(AdvisoryLock(try_lock=True)), is_(equal_to(self.created_event)))
+
+    def test_timeout(self):
+        assert_that(
+            calling(self.retrieve).with_args(AdvisoryLock(timeout=50)),
+            raises(ContainerLockTimeoutRetry),
+        )
+
+        self.locking_transaction.rollback()
+        with transaction() as session:
+            assert_that(
+                self.store.retrieve_most_recent_with_update_lock(
+                    container_lock=AdvisoryLock(timeout=50),
+                    task_id=self.task.id,
+                ),
+                is_(equal_to(self.created_event)),
+            )
+            # the lock timeout is restored
+            assert_that(session.execute(text("SHOW lock_timeout")).scalar(), is_(equal_to("0")))
+
+    def test_blocking(self):
+        self.locking_transaction.rollback()
+        self.store.container_lock = AdvisoryLock()
+        with transaction():
+            assert_that(
+                self.store.retrieve_most_recent_with_update_lock(task_id=self.task.id),
+                is_(equal_to(self.created_event)),
+            )
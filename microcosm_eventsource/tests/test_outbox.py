@@ -0,0 +1,212 @@
+"""
+Test the transactional outbox.
+
+"""
+from datetime import datetime
+from os.path import dirname
+from threading import Event
+
+from hamcrest import (
+    assert_that,
+    calling,
+    contains,
+    ends_with,
+    equal_to,
+    has_length,
+    is_,
+    raises,
+)
+from microcosm.api import create_object_graph
+from microcosm.loaders import load_from_dict
+from microcosm_postgres.context import SessionContext, transaction
+from microcosm_pubsub.batch import MessageBatchSchema
+
+from microcosm_eventsource.factory import EventFactory
+from microcosm_eventsource.outbox import OutboxRelay
+from microcosm_eventsource.tests.fixtures import (
+    Task,
+    TaskEventType,
+    TaskOutboxMessage,
+)
+
+
+class StandInProducer:
+    """
+    Record produced messages instead of publishing them.
+
+    """
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.messages = []
+
+    def produce(self, media_type, uri):
+        if self.fail:
+            raise Exception("broker unavailable")
+        self.messages.append((media_type, uri))
+
+
+class TestOutbox:
+
+    def setup(self):
+        loader = load_from_dict(
+            sns_topic_arns=dict(
+                default="topic",
+                mappings={
+                    MessageBatchSchema.MEDIA_TYPE: "batch-topic",
+                },
+            ),
+        )
+        self.graph = create_object_graph(
+            "microcosm_eventsource",
+            loader=loader,
+            root_path=dirname(__file__),
+            testing=True,
+        )
+        self.graph.use(
+            "task_store",
+            "task_event_store",
+            "task_outbox_store",
+            "task_event_controller",
+            "task_crud_routes",
+        )
+        self.controller = self.graph.task_event_controller
+        self.outbox_store = self.graph.task_outbox_store
+        self.factory = EventFactory(
+            event_store=self.graph.task_event_store,
+            identifier_key=self.controller.identifier_key,
+            outbox_store=self.outbox_store,
+        )
+
+        self.context = SessionContext(self.graph)
+        self.context.recreate_all()
+        self.context.open()
+
+        with transaction():
+            self.task = Task().create()
+
+        self.request_context = self.graph.flask.test_request_context()
+        self.request_context.push()
+
+    def teardown(self):
+        self.request_context.pop()
+        self.context.close()
+        self.graph.postgres.dispose()
+
+    def create(self, event_type, **kwargs):
+        return self.factory.create(
+            self.controller.ns,
+            self.graph.sns_producer,
+            event_type,
+            task_id=self.task.id,
+            **kwargs
+        )
+
+    def count_messages(self):
+        with transaction():
+            return self.outbox_store.count()
+
+    def test_create_writes_outbox(self):
+        """
+        Created events write their messages to the outbox instead of publishing them.
+
+        """
+        with transaction():
+            created_event = self.create(TaskEventType.CREATED)
+            assigned_event = self.create(TaskEventType.ASSIGNED, assignee="Alice")
+
+        with transaction():
+            messages = self.outbox_store.session.query(TaskOutboxMessage).order_by(TaskOutboxMessage.id).all()
+
+        assert_that([message.media_type for message in messages], contains(
+            "application/vnd.globality.pubsub._.created.task_event.created",
+            "application/vnd.globality.pubsub._.created.task_event.assigned",
+        ))
+        assert_that(messages[0].uri, ends_with(str(created_event.id)))
+        assert_that(messages[1].uri, ends_with(str(assigned_event.id)))
+        assert_that(self.graph.sns_producer.sns_client.publish.call_count, is_(equal_to(0)))
+
+    def test_rollback_discards_outbox(self):
+        """
+        Messages are only written if their events are.
+
+        """
+        def create_and_fail():
+            with transaction():
+                self.create(TaskEventType.CREATED)
+                raise Exception("rolled back")
+
+        assert_that(calling(create_and_fail), raises(Exception))
+        assert_that(self.count_messages(), is_(equal_to(0)))
+
+    def test_relay(self):
+        """
+        The relay drains the outbox in ordered batches.
+
+        """
+        with transaction():
+            created_event = self.create(TaskEventType.CREATED)
+            assigned_event = self.create(TaskEventType.ASSIGNED, assignee="Alice")
+            scheduled_event = self.create(TaskEventType.SCHEDULED, deadline=datetime.utcnow())
+
+        producer = StandInProducer()
+        relay = OutboxRelay(self.outbox_store, producer, batch_size=2)
+
+        assert_that(relay.relay(), is_(equal_to(2)))
+        assert_that(relay.relay(), is_(equal_to(1)))
+        assert_that(relay.relay(), is_(equal_to(0)))
+        assert_that(
+            [uri.rsplit("/", 1)[-1] for _, uri in producer.messages],
+            contains(str(created_event.id), str(assigned_event.id), str(scheduled_event.id)),
+        )
+        assert_that(self.count_messages(), is_(equal_to(0)))
+
+    def test_relay_failure(self):
+        """
+        Messages that fail to be produced remain in the outbox.
+
+        """
+        with transaction():
+            self.create(TaskEventType.CREATED)
+
+        relay = OutboxRelay(self.outbox_store, StandInProducer(fail=True))
+        assert_that(calling(relay.relay), raises(Exception))
+        assert_that(self.count_messages(), is_(equal_to(1)))
+
+        producer = StandInProducer()
+        OutboxRelay(self.outbox_store, producer).relay()
+        assert_that(producer.messages, has_length(1))
+
+    def test_relay_sns_producer(self):
+        """
+        Batches are published as batch messages by an SNS producer.
+
+        """
+        with transaction():
+            self.create(TaskEventType.CREATED)
+            self.create(TaskEventType.ASSIGNED, assignee="Alice")
+        self.graph.sns_producer.sns_client.reset_mock()
+
+        OutboxRelay(self.outbox_store, self.graph.sns_producer).relay()
+
+        assert_that(self.graph.sns_producer.sns_client.publish.call_count, is_(equal_to(1)))
+
+    def test_run(self):
+        """
+        A running relay stops once asked to.
+
+        """
+        with transaction():
+            self.create(TaskEventType.CREATED)
+
+        stop = Event()
+        producer = StandInProducer()
+
+        def produce(media_type, uri):
+            producer.messages.append((media_type, uri))
+            stop.set()
+
+        producer.produce = produce
+        OutboxRelay(self.outbox_store, producer, interval=0).run(stop)
+
+        assert_that(producer.messages, has_length(1))
+        assert_that(self.count_messages(), is_(equal_to(0)))
@@ -0,0 +1,202 @@
+"""
+Test reachable state graphs.
+
+"""
+from unittest.mock import patch
+
+from hamcrest import (
+    assert_that,
+    calling,
+    contains,
+    contains_inanyorder,
+    equal_to,
+    has_item,
+    has_length,
+    is_,
+    less_than_or_equal_to,
+    none,
+    raises,
+)
+
+from microcosm_eventsource.accumulation import difference, union
+from microcosm_eventsource.errors import StateMachineTooLargeError
+from microcosm_eventsource.event_types import EventType, event_info
+from microcosm_eventsource.tests.fixtures import FlexibleTaskEventType, TaskEventType
+from microcosm_eventsource.transitioning import any_of, event, nothing
+
+
+class ResetEventType(EventType):
+    CREATED = event_info(
+        follows=nothing(),
+    )
+    RESET = event_info(
+        follows=event("CREATED"),
+        accumulate=difference("CREATED"),
+    )
+
+
+def checklist(size):
+    """
+    Create an event type enum in which every subset of checked items is a distinct state.
+
+    """
+    items = ["ITEM_{}".format(index) for index in range(size)]
+    return EventType("ChecklistEventType", [("CREATED", event_info())] + [
+        (item, event_info(
+            follows=any_of("CREATED", *[other for other in items if other != item]),
+            accumulate=union(),
+        ))
+        for item in items
+    ])
+
+
+def test_all_states_are_streamed():
+    event_type_cls = checklist(40)
+    assert_that(
+        next(event_type_cls.all_states()),
+        contains(event_type_cls.CREATED),
+    )
+
+
+def test_max_states():
+    assert_that(list(checklist(4).all_states(max_states=100)), has_length(16))
+    assert_that(
+        calling(list).with_args(checklist(12).all_states(max_states=100)),
+        raises(StateMachineTooLargeError),
+    )
+
+
+def test_next_state_of_large_state_machine():
+    """
+    Single transitions are served without enumerating the reachable states.
+
+    """
+    event_type_cls = checklist(16)
+    state_machine = event_type_cls.state_machine()
+
+    assert_that(
+        event_type_cls.ITEM_1.next_state({event_type_cls.CREATED, event_type_cls.ITEM_0}),
+        contains(event_type_cls.CREATED, event_type_cls.ITEM_0, event_type_cls.ITEM_1),
+    )
+    assert_that(state_machine._table, is_(none()))
+    assert_that(state_machine.is_too_large, is_(equal_to(False)))
+
+    with patch("microcosm_eventsource.compiling.MAX_TABLE_STATES", 100):
+        assert_that(len(state_machine.table), is_(less_than_or_equal_to(100)))
+    assert_that(state_machine.is_too_large, is_(equal_to(True)))
+
+
+def test_predecessors():
+    graph = TaskEventType.state_graph().explore()
+    code = graph.codes[TaskEventType.encode_state({TaskEventType.STARTED})]
+
+    assert_that(
+        [
+            (graph.state(predecessor), graph.event_type(event_code))
+            for predecessor, event_code in graph.predecessors[code]
+        ],
+        has_item(
+            (
+                {TaskEventType.CREATED, TaskEventType.ASSIGNED, TaskEventType.SCHEDULED},
+                TaskEventType.STARTED,
+            ),
+        ),
+    )
+
+
+def test_empty_state_reached_again():
+    """
+    The empty state is allowed once a transition leads back to it.
+
+    """
+    assert_that(
+        list(ResetEventType.all_states()),
+        is_(equal_to([{ResetEventType.CREATED}, set()])),
+    )
+    assert_that(
+        list(ResetEventType.all_transitions()),
+        contains_inanyorder(
+            ({ResetEventType.CREATED}, set(), ResetEventType.RESET),
+            (set(), {ResetEventType.CREATED}, ResetEventType.CREATED),
+        ),
+    )
+
+
+def brute_force_closure(event_type_cls, state):
+    """
+    Walk every transition reachable from a state.
+
+    """
+    states, event_types = [state], set()
+    pending = [state]
+    while pending:
+        for _, next_state, event_type in event_type_cls.all_transitions(states=[pending.pop()]):
+            event_types.add(event_type)
+            if next_state not in states:
+                states.append(next_state)
+                pending.append(next_state)
+    return states, event_types
+
+
+def test_reachability():
+    """
+    The closure index agrees with walking the transitions from every state.
+
+    """
+    for event_type_cls in (TaskEventType, FlexibleTaskEventType, ResetEventType, checklist(3)):
+        for state in [set()] + list(event_type_cls.all_states()):
+            states, event_types = brute_force_closure(event_type_cls, state)
+            assert_that(
+                [event_type for event_type in event_type_cls if event_type_cls.can_reach(state, event_type)],
+                contains_inanyorder(*event_types),
+            )
+            assert_that(
+                event_type_cls.reachable_terminals(state),
+                contains_inanyorder(*[
+                    reachable_state
+                    for reachable_state in states
+                    if not event_type_cls.available_transitions(reachable_state)
+                ]),
+            )
+
+
+def test_can_reach():
+    assert_that(TaskEventType.can_reach({TaskEventType.CREATED}, TaskEventType.ENDED), is_(equal_to(True)))
+    assert_that(TaskEventType.can_reach({TaskEventType.CANCELED}, TaskEventType.COMPLETED), is_(equal_to(False)))
+    assert_that(
+        TaskEventType.reachable_terminals({TaskEventType.STARTED}),
+        contains_inanyorder({TaskEventType.CANCELED}, {TaskEventType.ENDED}),
+    )
+
+
+def test_can_reach_in_large_state_machine():
+    """
+    A state machine that is too large is explored only once.
+
+    """
+    event_type_cls = checklist(16)
+    state_machine = event_type_cls.state_machine()
+
+    with patch("microcosm_eventsource.compiling.MAX_TABLE_STATES", 100), \
+            patch.object(state_machine, "state_graph", wraps=state_machine.state_graph) as state_graph:
+        for _ in range(2):
+            assert_that(
+                calling(event_type_cls.can_reach).with_args({event_type_cls.CREATED}, event_type_cls.ITEM_0),
+                raises(StateMachineTooLargeError),
+            )
+            assert_that(
+                calling(event_type_cls.reachable_terminals).with_args({event_type_cls.CREATED}),
+                raises(StateMachineTooLargeError),
+            )
+
+    assert_that(state_graph.call_count, is_(equal_to(1)))
+
+
+def test_reachability_of_unreachable_state():
+    """
+    States that are not reachable from the initial state are closed over their successors.
+
+    """
+    state = {TaskEventType.CREATED, TaskEventType.STARTED}
+    assert_that(TaskEventType.can_reach(state, TaskEventType.COMPLETED), is_(equal_to(True)))
+    assert_that(TaskEventType.can_reach(state, TaskEventType.CREATED), is_(equal_to(False)))
@@ -0,0 +1,62 @@
+"""
+Test states.
+
+"""
+from copy import copy, deepcopy
+
+from hamcrest import (
+    assert_that,
+    contains,
+    equal_to,
+    is_,
+    same_instance,
+)
+
+from microcosm_eventsource.states import State
+from microcosm_eventsource.tests.fixtures import TaskEventType
+
+
+def test_ordered():
+    state = State({TaskEventType.SCHEDULED, TaskEventType.CREATED, TaskEventType.ASSIGNED})
+
+    assert_that(
+        state,
+        contains(TaskEventType.ASSIGNED, TaskEventType.CREATED, TaskEventType.SCHEDULED),
+    )
+    assert_that(
+        list(state),
+        is_(equal_to([TaskEventType.ASSIGNED, TaskEventType.CREATED, TaskEventType.SCHEDULED])),
+    )
+
+
+def test_interned():
+    state = State([TaskEventType.CREATED, TaskEventType.ASSIGNED])
+
+    assert_that(State({TaskEventType.ASSIGNED, TaskEventType.CREATED}), is_(same_instance(state)))
+    assert_that(State(state), is_(same_instance(state)))
+
+
+def test_copy():
+    state = State([TaskEventType.CREATED])
+
+    assert_that(copy(state), is_(same_instance(state)))
+    assert_that(deepcopy(state), is_(same_instance(state)))
+
+
+def test_set_semantics():
+    state = State([TaskEventType.CREATED, TaskEventType.ASSIGNED])
+
+    assert_that(state, is_(equal_to({TaskEventType.ASSIGNED, TaskEventType.CREATED})))
+    assert_that(hash(state), is_(equal_to(hash(frozenset(state)))))
+    assert_that(TaskEventType.CREATED in state, is_(equal_to(True)))
+    assert_that(state - {TaskEventType.CREATED}, is_(equal_to({TaskEventType.ASSIGNED})))
+
+
+def test_accumulation_returns_interned_states():
+    state = TaskEventType.ASSIGNED.accumulate_state({TaskEventType.CREATED})
+
+    assert_that(state, is_(same_instance(State([TaskEventType.CREATED, TaskEventType.ASSIGNED]))))
+    assert_that(
+        TaskEventType.CREATED.accumulate_state(()),
+        is_(same_instance(TaskEventType.REVISED.accumulate_state(state))),
+    )
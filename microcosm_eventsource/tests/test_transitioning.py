@@ -2,10 +2,25 @@
 Test transition functions.
 
 """
-from hamcrest import assert_that, equal_to, is_
+from unittest.mock import patch
 
+from hamcrest import (
+    assert_that,
+    calling,
+    contains,
+    equal_to,
+    is_,
+    raises,
+)
+from sqlalchemy import String, column
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from microcosm_eventsource.accumulation import union
+from microcosm_eventsource.errors import StateMachineTooLargeError
+from microcosm_eventsource.event_types import EventType, event_info
 from microcosm_eventsource.tests.fixtures import TaskEventType
 from microcosm_eventsource.transitioning import (
+    Transition,
     all_of,
     any_of,
     but_not,
@@ -207,3 +222,59 @@ def test_nothing():
         transition(TaskEventType, [TaskEventType.CREATED]),
         is_(equal_to(False)),
     )
+
+
+class OnlyCreated(Transition):
+    """
+    A custom transition that only defines `__call__`.
+
+    """
+    def __call__(self, cls, state):
+        return set(state) == {cls.CREATED}
+
+
+class CustomTransitionEventType(EventType):
+    CREATED = event_info(
+        follows=nothing(),
+    )
+    STARTED = event_info(
+        follows=OnlyCreated(),
+    )
+
+
+def test_custom_transition():
+    assert_that(
+        CustomTransitionEventType.STARTED.may_transition({CustomTransitionEventType.CREATED}),
+        is_(equal_to(True)),
+    )
+    assert_that(
+        CustomTransitionEventType.STARTED.may_transition({CustomTransitionEventType.STARTED}),
+        is_(equal_to(False)),
+    )
+    assert_that(
+        CustomTransitionEventType.available_transitions({CustomTransitionEventType.CREATED}),
+        contains(CustomTransitionEventType.STARTED),
+    )
+
+
+def test_custom_transition_of_large_state_machine():
+    """
+    Custom transitions are not compiled into SQL from a partially enumerated set of states.
+
+    """
+    items = ["ITEM_{}".format(index) for index in range(12)]
+    event_type_cls = EventType("LargeCustomTransitionEventType", [("CREATED", event_info())] + [
+        (item, event_info(
+            follows=any_of("CREATED", *[other for other in items if other != item]),
+            accumulate=union(),
+        ))
+        for item in items
+    ] + [
+        ("ENDED", event_info(follows=OnlyCreated())),
+    ])
+
+    with patch("microcosm_eventsource.compiling.MAX_TABLE_STATES", 100):
+        assert_that(
+            calling(event_type_cls.ENDED.may_transition_expression).with_args(column("state", ARRAY(String))),
+            raises(StateMachineTooLargeError),
+        )
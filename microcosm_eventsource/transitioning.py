@@ -4,6 +4,10 @@ Transition mini-language.
 """
 from abc import ABCMeta
 
+from sqlalchemy import and_, false, func, not_, or_
+
+from microcosm_eventsource.errors import StateMachineTooLargeError
+
 
 def normalize(value):
     """
@@ -15,6 +19,84 @@ def normalize(value):
     return event(value)
 
 
+def compile_transition(value, state_machine):
+    """
+    Compile a (normalized) transition into a predicate over bitmask states.
+
+    Arbitrary callables that are not part of the mini-language are evaluated against
+    the decoded state so that they keep their existing semantics.
+
+    """
+    value = normalize(value)
+    if isinstance(value, Transition):
+        return value.compile(state_machine)
+    cls = state_machine.event_type_cls
+    return lambda mask: value(cls, state_machine.decode(mask))
+
+
+def transition_support(value, state_machine):
+    """
+    Compute the support of a (normalized) transition.
+
+    The support is a mask of event types, at least one of which is present in every state
+    that satisfies the transition, or None if there is no such guarantee.
+
+    """
+    value = normalize(value)
+    if isinstance(value, Transition):
+        return value.support(state_machine)
+    return None
+
+
+def sql_transition(value, state_machine, column):
+    """
+    Compile a (normalized) transition into a SQL expression over an event `state` (array) column.
+
+    Arbitrary callables that are not part of the mini-language are evaluated against every
+    reachable state; the expression then matches any of the states that satisfy them.
+
+    """
+    value = normalize(value)
+    if isinstance(value, Transition):
+        return value.to_sql(state_machine, column)
+    return sql_states(compile_transition(value, state_machine), state_machine, column)
+
+
+def sql_states(predicate, state_machine, column):
+    """
+    Match the reachable (non-initial) states that satisfy a predicate over bitmask states.
+
+    :raises: StateMachineTooLargeError if the reachable states cannot all be enumerated
+
+    """
+    states = state_machine.states
+    if state_machine.is_too_large:
+        raise StateMachineTooLargeError("Cannot compile a custom transition of {} into SQL".format(
+            state_machine.event_type_cls.__name__,
+        ))
+    return or_(false(), *[
+        and_(column.contains(list(state)), column.contained_by(list(state)))
+        for state in states
+        if state and predicate(state_machine.encode(state))
+    ])
+
+
+def compile_events(args, state_machine):
+    """
+    Compile a list of transitions into a single mask if they are all `event(name)` conditions.
+
+    :returns: an integer mask or None
+
+    """
+    mask = 0
+    for arg in args:
+        arg = normalize(arg)
+        if not isinstance(arg, Event):
+            return None
+        mask |= state_machine.bit(arg.name)
+    return mask
+
+
 class Transition(metaclass=ABCMeta):
 
     def __call__(self, cls, state):
@@ -35,6 +117,38 @@ class Transition(metaclass=ABCMeta):
         """
         return True
 
+    def compile(self, state_machine):
+        """
+        Compile this condition into a predicate over a bitmask state of the given state machine.
+
+        By default, the condition is evaluated against the decoded state, so that subclasses
+        that only define `__call__` keep their semantics.
+
+        :returns: a function from an integer mask to a boolean
+
+        """
+        cls = state_machine.event_type_cls
+        return lambda mask: self(cls, state_machine.decode(mask))
+
+    def support(self, state_machine):
+        """
+        Which event types (as a mask) may enable this condition?
+
+        At least one of the returned event types is present in any state that satisfies this
+        condition; None means that the condition may be satisfied without any of them.
+
+        """
+        return None
+
+    def to_sql(self, state_machine, column):
+        """
+        Compile this condition into a SQL expression over an event `state` (array) column.
+
+        By default, the expression matches any of the reachable states that satisfy the condition.
+
+        """
+        return sql_states(self.compile(state_machine), state_machine, column)
+
 
 class Nothing(Transition):
 
@@ -44,6 +158,15 @@ class Nothing(Transition):
     def __bool__(self):
         return False
 
+    def compile(self, state_machine):
+        return lambda mask: not mask
+
+    def support(self, state_machine):
+        return None
+
+    def to_sql(self, state_machine, column):
+        return func.cardinality(column) == 0
+
     __nonzero__ = __bool__
 
 
@@ -58,6 +181,31 @@ class AllOf(Transition):
     def __bool__(self):
         return any(arg for arg in self.args)
 
+    def compile(self, state_machine):
+        required = compile_events(self.args, state_machine)
+        if required is not None:
+            return lambda mask: mask & required == required
+        predicates = [compile_transition(arg, state_machine) for arg in self.args]
+        return lambda mask: all(predicate(mask) for predicate in predicates)
+
+    def support(self, state_machine):
+        supports = [
+            support
+            for support in (transition_support(arg, state_machine) for arg in self.args)
+            if support is not None
+        ]
+        if not supports:
+            return None
+        # every argument must hold, so the narrowest support will do
+        return min(supports, key=lambda support: bin(support).count("1"))
+
+    def to_sql(self, state_machine, column):
+        required = compile_events(self.args, state_machine)
+        if required is not None:
+            # state @> ARRAY[...]
+            return column.contains(list(state_machine.decode(required)))
+        return and_(*[sql_transition(arg, state_machine, column) for arg in self.args])
+
     __nonzero__ = __bool__
 
 
@@ -72,6 +220,29 @@ class AnyOf(Transition):
     def __bool__(self):
         return all(arg for arg in self.args)
 
+    def compile(self, state_machine):
+        allowed = compile_events(self.args, state_machine)
+        if allowed is not None:
+            return lambda mask: bool(mask & allowed)
+        predicates = [compile_transition(arg, state_machine) for arg in self.args]
+        return lambda mask: any(predicate(mask) for predicate in predicates)
+
+    def support(self, state_machine):
+        mask = 0
+        for arg in self.args:
+            support = transition_support(arg, state_machine)
+            if support is None:
+                return None
+            mask |= support
+        return mask
+
+    def to_sql(self, state_machine, column):
+        allowed = compile_events(self.args, state_machine)
+        if allowed is not None:
+            # state && ARRAY[...]
+            return column.overlap(list(state_machine.decode(allowed)))
+        return or_(false(), *[sql_transition(arg, state_machine, column) for arg in self.args])
+
     __nonzero__ = __bool__
 
 
@@ -86,6 +257,16 @@ class ButNot(Transition):
     def __bool__(self):
         return True
 
+    def compile(self, state_machine):
+        predicate = compile_transition(self.arg, state_machine)
+        return lambda mask: not predicate(mask)
+
+    def support(self, state_machine):
+        return None
+
+    def to_sql(self, state_machine, column):
+        return not_(sql_transition(self.arg, state_machine, column))
+
     __nonzero__ = __bool__
 
 
@@ -100,6 +281,16 @@ class Event(Transition):
     def __bool__(self):
         return True
 
+    def compile(self, state_machine):
+        bit = state_machine.bit(self.name)
+        return lambda mask: bool(mask & bit)
+
+    def support(self, state_machine):
+        return state_machine.bit(self.name)
+
+    def to_sql(self, state_machine, column):
+        return column.contains([state_machine.event_type_cls[self.name]])
+
     __nonzero__ = __bool__
 
 
@@ -23,7 +23,13 @@ setup(
         "microcosm-logging>=1.5.0",
         "microcosm-postgres>=2.2.0",
         "microcosm-pubsub>=2.23.0",
+        "SQLAlchemy>=1.4.0",
     ],
+    extras_require={
+        "numpy": [
+            "numpy>=1.15.0",
+        ],
+    },
     setup_requires=[
         "nose>=1.3.6",
     ],
@@ -35,6 +41,7 @@ setup(
     },
     tests_require=[
         "coverage>=3.7.1",
+        "numpy>=1.15.0",
         "PyHamcrest>=1.9.0",
     ],
 )